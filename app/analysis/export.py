@@ -0,0 +1,151 @@
+import csv
+import io
+import json
+from datetime import datetime, time, timedelta, timezone
+
+import pandas as pd
+
+from app.config import EXPORT_CHUNK_SIZE
+from app.analysis.repository import encode_cursor
+
+# Column types for Parquet exports; columns not listed are text
+INTEGER_COLUMNS = ("acne_count", "papules_count", "pustules_count", "comedone_count", "nodules_count")
+FLOAT_COLUMNS = (
+    "avg_acne_width", "avg_acne_height", "avg_acne_area",
+    "avg_redness", "global_redness", "skin_disease_confidence"
+)
+BOOLEAN_COLUMNS = ("acne_detected",)
+TIMESTAMP_COLUMNS = ("created_at",)
+# Stored as JSON, exported as its JSON text
+JSON_COLUMNS = ("result",)
+
+def date_bounds(since=None, until=None):
+    """[start, end) in UTC covering the inclusive since and until dates"""
+    start = datetime.combine(since, time.min, timezone.utc) if since else None
+    end = datetime.combine(until + timedelta(days=1), time.min, timezone.utc) if until else None
+    return start, end
+
+async def iter_chunks(repository, user_id, columns, since=None, until=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield a user's analyses newest first, chunk_size rows at a time. Each chunk seeks past
+    the previous one with a cursor, so every request is one index range scan and only one
+    chunk is held at a time.
+    """
+    cursor = None
+    while True:
+        rows = await repository.list_for_user(
+            user_id, limit=chunk_size, cursor=cursor, columns=columns, since=since, until=until
+        )
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        cursor = encode_cursor(rows[-1])
+
+def to_frame(rows, columns):
+    """Typed DataFrame for one chunk, so every Parquet row group has the same column types"""
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    for column in columns:
+        if column in INTEGER_COLUMNS:
+            frame[column] = frame[column].astype("Int64")
+        elif column in FLOAT_COLUMNS:
+            frame[column] = frame[column].astype("Float64")
+        elif column in BOOLEAN_COLUMNS:
+            frame[column] = frame[column].astype("boolean")
+        elif column in TIMESTAMP_COLUMNS:
+            frame[column] = pd.to_datetime(frame[column], utc=True, format="ISO8601")
+        elif column in JSON_COLUMNS:
+            frame[column] = frame[column].map(lambda v: None if v is None else json.dumps(v, separators=(",", ":"))).astype("string")
+        else:
+            frame[column] = frame[column].astype("string")
+    return frame
+
+class CsvExportWriter:
+    """Writes chunks as CSV lines, with the header before the first one; values are written as stored"""
+
+    media_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer, lineterminator="\n")
+        self._csv.writerow(columns)
+
+    def _value(self, row, column):
+        value = row.get(column)
+        if column in JSON_COLUMNS and value is not None:
+            return json.dumps(value, separators=(",", ":"))
+        return value
+
+    def write(self, rows):
+        self._csv.writerows([self._value(row, c) for c in self.columns] for row in rows)
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data.encode()
+
+    def close(self):
+        # Flushes the header of an empty export
+        return self.write([])
+
+class _ChunkSink:
+    """Write-only file that hands back what has been written since the last drain"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class ParquetExportWriter:
+    """Writes each chunk as a zstd-compressed Parquet row group; the footer comes on close. Requires pyarrow."""
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def __init__(self, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.columns = columns
+        types = {
+            **{c: pa.int64() for c in INTEGER_COLUMNS},
+            **{c: pa.float64() for c in FLOAT_COLUMNS},
+            **{c: pa.bool_() for c in BOOLEAN_COLUMNS},
+            **{c: pa.timestamp("us", tz="UTC") for c in TIMESTAMP_COLUMNS}
+        }
+        self._pa = pa
+        self.schema = pa.schema([(c, types.get(c, pa.string())) for c in columns])
+        self._sink = _ChunkSink()
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression="zstd")
+
+    def write(self, rows):
+        table = self._pa.Table.from_pandas(to_frame(rows, self.columns), schema=self.schema, preserve_index=False)
+        self._writer.write_table(table)
+        return self._sink.drain()
+
+    def close(self):
+        self._writer.close()
+        return self._sink.drain()
+
+EXPORT_WRITERS = {"csv": CsvExportWriter, "parquet": ParquetExportWriter}
@@ -0,0 +1,276 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import (
+    IDEMPOTENCY_ENABLED,
+    IDEMPOTENCY_BACKEND,
+    IDEMPOTENCY_SQLITE_PATH,
+    IDEMPOTENCY_KEY_TTL_SECONDS,
+    IDEMPOTENCY_DEDUP_WINDOW_SECONDS,
+    IDEMPOTENCY_MAX_ENTRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Longest Idempotency-Key accepted
+MAX_KEY_LENGTH = 255
+
+class IdempotencyConflict(Exception):
+    """Raised when an Idempotency-Key is reused for a different image"""
+
+def content_hash(data):
+    """SHA-256 of an upload, the same digest the image store addresses originals by"""
+    return hashlib.sha256(data).hexdigest()
+
+class MemoryIdempotencyStore:
+    """In-process records with per-entry expiry; replays apply per process"""
+
+    shared = False
+
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._records.get(key)
+            if entry is None:
+                return None
+            record, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._records[key]
+                return None
+            return record
+
+    def set(self, key, record, ttl):
+        with self._lock:
+            self._records.pop(key, None)
+            self._records[key] = (record, time.monotonic() + ttl)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+
+    def forget_analysis(self, analysis_id):
+        with self._lock:
+            for key in [k for k, (r, _) in self._records.items() if r["analysis_id"] == analysis_id]:
+                del self._records[key]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def stats(self):
+        return {"entries": len(self._records)}
+
+class SQLiteIdempotencyStore:
+    """Records shared between processes on one host through a SQLite file"""
+
+    shared = True
+
+    def __init__(self, path=IDEMPOTENCY_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "key TEXT PRIMARY KEY, analysis_id TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS records_expires_at ON records (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS records_analysis_id ON records (analysis_id)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # SQLite connections must not be shared with forked server workers
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM records WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, record, ttl):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO records (key, analysis_id, value, expires_at) VALUES (?, ?, ?, ?)",
+                (key, record["analysis_id"], json.dumps(record, separators=(",", ":")), now + ttl)
+            )
+            conn.execute("DELETE FROM records WHERE expires_at < ?", (now,))
+
+    def forget_analysis(self, analysis_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM records WHERE analysis_id = ?", (analysis_id,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM records")
+
+    def stats(self):
+        with self._connection() as conn:
+            return {"entries": conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]}
+
+class AnalysisDeduplicator:
+    """
+    Makes analysis submissions idempotent. A request is identified by its Idempotency-Key
+    and by the user and image content; the first request runs the analysis and records the
+    response under each identity, concurrent duplicates wait for that same run (single-flight),
+    and later duplicates get the recorded response without inference or another stored row.
+    """
+
+    def __init__(
+        self,
+        store,
+        key_ttl=IDEMPOTENCY_KEY_TTL_SECONDS,
+        dedup_window=IDEMPOTENCY_DEDUP_WINDOW_SECONDS,
+        enabled=IDEMPOTENCY_ENABLED
+    ):
+        self.store = store
+        self.key_ttl = key_ttl
+        self.dedup_window = dedup_window
+        self.enabled = enabled
+        self.coalesced = 0
+        self.replayed = 0
+        self._flights = {}
+
+    def identities(self, user_id, fingerprint, idempotency_key=None):
+        """(store key, ttl) pairs a submission is recorded under"""
+        identities = []
+        if idempotency_key:
+            identities.append((f"key:{user_id}:{idempotency_key}", self.key_ttl))
+        if self.dedup_window > 0:
+            identities.append((f"content:{user_id}:{fingerprint}", self.dedup_window))
+        return identities
+
+    async def _call(self, method, *args):
+        if self.store.shared:
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+
+    def _in_flight(self, keys, fingerprint):
+        for key in keys:
+            flight = self._flights.get(key)
+            if flight is not None:
+                if flight[0] != fingerprint:
+                    raise IdempotencyConflict("Idempotency-Key was already used for a different image")
+                return flight[1]
+        return None
+
+    async def _recorded(self, keys, fingerprint):
+        for key in keys:
+            try:
+                record = await self._call(self.store.get, key)
+            except Exception as e:
+                logger.warning(f"Idempotency store read error: {str(e)}")
+                return None
+            if record is not None:
+                if record["fingerprint"] != fingerprint:
+                    raise IdempotencyConflict("Idempotency-Key was already used for a different image")
+                return record
+        return None
+
+    async def run(self, user_id, fingerprint, idempotency_key, analyze):
+        """
+        Return (response, replayed) for a submission, calling analyze() to produce
+        {"id": ..., **response fields} only if no identical submission is running or recorded
+        """
+        identities = self.identities(user_id, fingerprint, idempotency_key)
+        if not self.enabled or not identities:
+            return await analyze(), False
+        keys = [key for key, _ in identities]
+
+        while True:
+            flight = self._in_flight(keys, fingerprint)
+            if flight is None:
+                break
+            try:
+                response = await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                # The leading request was cancelled before finishing; run it here instead
+                if not flight.cancelled():
+                    raise
+                continue
+            self.coalesced += 1
+            return response, True
+
+        # Registered before the first await so concurrent duplicates find it
+        flight = asyncio.get_running_loop().create_future()
+        flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+        for key in keys:
+            self._flights[key] = (fingerprint, flight)
+        try:
+            record = await self._recorded(keys, fingerprint)
+            if record is not None:
+                self.replayed += 1
+                flight.set_result(record["response"])
+                return record["response"], True
+
+            response = await analyze()
+            record = {"fingerprint": fingerprint, "analysis_id": response["id"], "response": response}
+            # Degraded results are shared with concurrent duplicates but not recorded, so a retry
+            # once the models are back gets a full analysis
+            for key, ttl in ([] if response.get("degraded") else identities):
+                try:
+                    await self._call(self.store.set, key, record, ttl)
+                except Exception as e:
+                    logger.warning(f"Idempotency store write error: {str(e)}")
+            flight.set_result(response)
+            return response, False
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            # Duplicates waiting on this run fail the same way
+            flight.set_exception(e)
+            raise
+        finally:
+            for key in keys:
+                if self._flights.get(key, (None, None))[1] is flight:
+                    del self._flights[key]
+
+    async def forget_analysis(self, analysis_id):
+        """Stop replaying a deleted analysis"""
+        try:
+            await self._call(self.store.forget_analysis, analysis_id)
+        except Exception as e:
+            logger.warning(f"Idempotency store delete error: {str(e)}")
+
+    def stats(self):
+        stats = {
+            "enabled": self.enabled,
+            "backend": type(self.store).__name__,
+            "in_flight": len({id(flight) for _, flight in self._flights.values()}),
+            "coalesced": self.coalesced,
+            "replayed": self.replayed
+        }
+        try:
+            stats.update(self.store.stats())
+        except Exception as e:
+            stats["error"] = str(e)
+        return stats
+
+def create_deduplicator(backend=IDEMPOTENCY_BACKEND):
+    """Create the deduplicator configured through environment variables"""
+    store = SQLiteIdempotencyStore() if backend == "sqlite" else MemoryIdempotencyStore()
+    return AnalysisDeduplicator(store)
+
+# Global deduplicator instance
+analysis_deduplicator = create_deduplicator()
@@ -0,0 +1,160 @@
+import io
+import logging
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps, ExifTags
+
+from app.config import UPLOAD_MAX_BYTES, IMAGE_MAX_PIXELS, IMAGE_WORKING_MAX_SIDE, BATCH_MAX_FILES
+from app.services.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Scale denominators libjpeg can decode at directly
+DCT_REDUCTIONS = (1, 2, 4, 8)
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Allowance per file for multipart boundaries, part headers and other form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Upload endpoints: (method, path) -> largest request body accepted
+UPLOAD_LIMITS = {
+    ("POST", "/skinprocessing"): UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES,
+    ("POST", "/skinprocessing/jobs"): UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES,
+    ("POST", "/skinprocessing/batch"): BATCH_MAX_FILES * (UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES)
+}
+
+class ImageTooLarge(ValueError):
+    """Raised when an image has more source pixels than allowed"""
+
+@dataclass
+class IngestedImage:
+    """Upright working image plus the size of the upright original it was decoded from"""
+    image: Image.Image
+    original_size: tuple
+
+    @property
+    def scale(self):
+        """Per-axis factors from working-image pixels to original-frame pixels"""
+        width, height = self.image.size
+        return self.original_size[0] / width, self.original_size[1] / height
+
+    def working_side(self, original_side):
+        """Side in working-image pixels of a square spanning original_side original pixels"""
+        return max(1, round(original_side / max(self.scale)))
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware bounding upload request bodies before the form is parsed. A Content-Length
+    over the endpoint's limit gets 413 without the body being read; a body sent without one
+    stops being read as soon as it passes the limit.
+    """
+
+    def __init__(self, app, limits=UPLOAD_LIMITS):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http":
+            limit = self.limits.get((scope["method"], scope["path"].rstrip("/") or "/"))
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = next((value for name, value in scope["headers"] if name == b"content-length"), None)
+        if length is not None and length.isdigit() and int(length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Seen as a disconnect by the form parser, so nothing more is read
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def limited_send(message):
+            nonlocal rejected
+            if not exceeded:
+                await send(message)
+            elif message["type"] == "http.response.start" and not rejected:
+                # Whatever error the interrupted parse produced is replaced by the 413
+                rejected = True
+                await self._reject(send, limit)
+
+        await self.app(scope, limited_receive, limited_send)
+        if exceeded and not rejected:
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit):
+        body = f'{{"detail":"Request body exceeds {limit} bytes"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+async def read_upload(file, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Read a parsed upload in chunks, rejecting files over max_bytes. The request body was
+    already bounded by UploadLimitMiddleware before parsing; this caps each file of it.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds {max_bytes} bytes")
+
+    chunks, total = [], 0
+    with stage("upload_read"):
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            total += len(chunk)
+            if total > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File exceeds {max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+def decode_image(image_bytes, max_side=IMAGE_WORKING_MAX_SIDE, max_pixels=IMAGE_MAX_PIXELS):
+    """
+    Decode uploaded bytes into an upright RGB working image no larger than max_side.
+    JPEGs are decoded at a reduced DCT scale, so the full-resolution buffer is never built.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image has {width * height} pixels, limit is {max_pixels}")
+
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    original_size = (height, width) if orientation in TRANSPOSED_ORIENTATIONS else (width, height)
+
+    if max_side and max(width, height) > max_side:
+        # Smallest DCT reduction that fits, so most JPEGs need no resampling afterwards
+        reduction = next((r for r in DCT_REDUCTIONS if -(-max(width, height) // r) <= max_side), DCT_REDUCTIONS[-1])
+        image.draft("RGB", (max(1, width // reduction), max(1, height // reduction)))
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side))
+
+    # Orientation is applied once, on the already reduced image
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    return IngestedImage(image=image, original_size=original_size)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import numpy as np
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import MODEL_HEDGE_DELAY_SECONDS, ACNE_TILING_ENABLED
+from app.models import AnalysisResponse
+from app.services.inference import run_model_async, resolve_models
+from app.services.backends import TiledDetectionBackend
+from app.services.image_processing import EncodedImageSet
+from app.services.features import extract_acne_features
+from app.services.image_stats import redness_stats
+from app.services.metrics import stage, ANALYSES_IN_FLIGHT
+from app.services.resilience import Deadline
+from app.analysis.ingest import decode_image, ImageTooLarge
+from app.images.store import image_store
+from app.analysis.idempotency import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Analysis fields returned to clients but not stored in skin_analyses
+RESPONSE_ONLY_FIELDS = ("degraded", "unavailable_models")
+# Analysis fields stored in the result JSON column rather than columns of their own
+RESULT_FIELDS = ("region_redness", "redness_histogram")
+
+def validate_content_type(file):
+    """Reject uploads that are not images"""
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+async def analyze_image(image_bytes, deadline=None, image_hash=None):
+    """
+    Decode an image, run all models and return the analysis fields.
+    If a classifier fails or runs out of time, the result is marked degraded instead of failing.
+    The original is not stored here; call store_original once the analysis row is saved.
+    Pass image_hash when the content hash of image_bytes is already known.
+    """
+    with ANALYSES_IN_FLIGHT.track_inprogress():
+        return await _analyze_image(image_bytes, deadline or Deadline(), image_hash)
+
+async def store_original(image_bytes):
+    """Keep the original of a saved analysis (deduplicated by content); its thumbnail is generated in the background"""
+    try:
+        with stage("store_image"):
+            await image_store.save(image_bytes)
+    except Exception as e:
+        # The analysis stays valid; its image endpoints return 404
+        logger.error(f"Failed to store image: {str(e)}")
+
+async def _analyze_image(image_bytes, deadline, image_hash):
+    try:
+        with stage("decode"):
+            ingested = await run_in_threadpool(decode_image, image_bytes)
+    except ImageTooLarge as e:
+        logger.warning(f"Rejected oversized image: {str(e)}")
+        raise HTTPException(status_code=413, detail="Image resolution is too large")
+    except Exception as e:
+        logger.error(f"Image processing error: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid image file")
+
+    # Run all three models concurrently on the working image. The classifiers' center patches
+    # span the same original pixels as at native resolution, resized to the model input.
+    images = EncodedImageSet(ingested.image)
+    acne_model, skin_disease_model, skin_class_model = await resolve_models(
+        "acne_model", "skin_disease_model", "skin_class_model"
+    )
+    if ACNE_TILING_ENABLED and acne_model is not None:
+        acne_model = TiledDetectionBackend(acne_model)
+    acne_results, skin_disease_results, skin_class_results = await asyncio.gather(
+        run_model_async(
+            acne_model,
+            images,
+            task_type="detection",
+            name="acne_model",
+            deadline=deadline
+        ),
+        run_model_async(
+            skin_disease_model,
+            images,
+            input_size=300,
+            task_type="classification",
+            patch_size=ingested.working_side(300),
+            name="skin_disease_model",
+            deadline=deadline,
+            hedge_after=MODEL_HEDGE_DELAY_SECONDS
+        ),
+        run_model_async(
+            skin_class_model,
+            images,
+            input_size=640,
+            task_type="classification",
+            patch_size=ingested.working_side(640),
+            name="skin_class_model",
+            deadline=deadline,
+            hedge_after=MODEL_HEDGE_DELAY_SECONDS
+        )
+    )
+
+    # Acne detection model; there is no useful result without it
+    if "error" in acne_results:
+        logger.error(f"Acne model error: {acne_results['error']}")
+        if acne_results.get("unavailable"):
+            raise HTTPException(
+                status_code=503,
+                detail="Acne detection is temporarily unavailable",
+                headers={"Retry-After": "15"}
+            )
+        raise HTTPException(status_code=500, detail="Acne detection model failed")
+
+    # Classifier failures degrade the response instead of failing it
+    unavailable_models = []
+    for label, results in (("skin_disease", skin_disease_results), ("skin_class", skin_class_results)):
+        if "error" in results:
+            logger.warning(f"{label} model unavailable, returning degraded analysis: {results['error']}")
+            unavailable_models.append(label)
+
+    # One pass over the pixels gives global, per-lesion and per-region redness
+    preds = acne_results.get("predictions", []) or []
+    with stage("redness"):
+        pixels = await run_in_threadpool(np.asarray, ingested.image)
+        redness = await run_in_threadpool(redness_stats, pixels, preds)
+    with stage("features"):
+        acne_features = await run_in_threadpool(
+            extract_acne_features, pixels, preds, ingested.scale, lesion_redness=redness.lesion_redness
+        )
+    acne_count = acne_features["acne_count"]
+
+    # Skin disease classification model
+    skin_preds = skin_disease_results.get("predictions", [])
+    if skin_preds and skin_preds[0].get("predictions"):
+        top_disease = skin_preds[0]["predictions"][0]
+        disease_label = top_disease.get("class")
+        disease_confidence = top_disease.get("confidence")
+    else:
+        disease_label = None
+        disease_confidence = None
+
+    # Skin general classification model
+    class_labels = [p.get("class", "Unknown") for p in skin_class_results.get("predictions", [])] or ["Unknown"]
+    if "skin_class" in unavailable_models:
+        class_labels = []
+
+    # Originals are addressed by content hash, so the row can reference one before it is stored
+    if not image_store.enabled:
+        image_hash = None
+    elif image_hash is None:
+        image_hash = await run_in_threadpool(content_hash, image_bytes)
+
+    return {
+        **acne_features,
+        "global_redness": redness.global_redness,
+        "region_redness": redness.region_redness,
+        "redness_histogram": redness.histogram,
+        "skin_disease_label": disease_label,
+        "skin_disease_confidence": disease_confidence,
+        "skin_classification_labels": ",".join(class_labels),
+        "acne_detected": acne_count > 0,
+        "image_hash": image_hash,
+        "degraded": bool(unavailable_models),
+        "unavailable_models": unavailable_models
+    }
+
+def build_analysis_row(user_id, filename, features, analysis_id=None):
+    """Build the skin_analyses row for a finished analysis"""
+    row = {
+        "user_id": user_id,
+        "filename": filename,
+        **{k: v for k, v in features.items() if k not in RESPONSE_ONLY_FIELDS + RESULT_FIELDS},
+        "result": {k: features[k] for k in RESULT_FIELDS if features.get(k) is not None} or None
+    }
+    if analysis_id:
+        row["id"] = analysis_id
+    return row
+
+def build_analysis_response(analysis_id, filename, features):
+    """Build the API response for a finished analysis"""
+    return AnalysisResponse(id=analysis_id, filename=filename, **features)
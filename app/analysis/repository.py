@@ -0,0 +1,356 @@
+import asyncio
+import base64
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from app.services.metrics import stage
+from app.analysis.trends import ROLLUP_TABLE, rollup_deltas, apply_delta, empty_rollup
+from app.config import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    ANALYSIS_REPOSITORY,
+    SUPABASE_HTTP_TIMEOUT_SECONDS,
+    SUPABASE_HTTP_MAX_CONNECTIONS,
+    SUPABASE_HTTP_RETRIES,
+    SUPABASE_HTTP_BACKOFF_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+TABLE = "skin_analyses"
+
+# Upstream statuses worth retrying with backoff
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Columns clients may request with a projection
+ANALYSIS_COLUMNS = (
+    "id", "user_id", "filename", "created_at",
+    "acne_count", "avg_acne_width", "avg_acne_height", "avg_acne_area",
+    "papules_count", "pustules_count", "comedone_count", "nodules_count",
+    "avg_redness", "global_redness",
+    "skin_disease_label", "skin_disease_confidence", "skin_classification_labels",
+    "acne_detected", "image_hash", "result"
+)
+
+# Compact default for history lists; full rows are available from get()
+SUMMARY_COLUMNS = (
+    "id", "filename", "created_at", "acne_count", "acne_detected",
+    "avg_redness", "global_redness", "skin_disease_label", "image_hash"
+)
+
+# Keyset pagination needs the sort key in every returned row
+CURSOR_COLUMNS = ("created_at", "id")
+
+class RepositoryError(Exception):
+    """Raised when the analysis store cannot complete a request"""
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+def encode_cursor(row):
+    """Opaque token pointing just past a row in (created_at desc, id desc) order"""
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    """
+    Return (created_at, id) from a cursor token. Both are checked to be a timestamp and
+    a UUID, since they end up in a PostgREST filter
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, analysis_id = json.loads(raw)
+        datetime.fromisoformat(created_at)
+        analysis_id = str(uuid.UUID(analysis_id))
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    return created_at, analysis_id
+
+def projection(fields=None):
+    """
+    Resolve a comma-separated fields parameter ("*" for every column) into columns,
+    always including the pagination key
+    """
+    if not fields:
+        columns = SUMMARY_COLUMNS
+    elif fields.strip() == "*":
+        columns = ANALYSIS_COLUMNS
+    else:
+        columns = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [c for c in columns if c not in ANALYSIS_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(CURSOR_COLUMNS + columns))
+
+class PostgrestAnalysisRepository:
+    """skin_analyses access over PostgREST with a pooled, keep-alive async HTTP client"""
+
+    def __init__(
+        self,
+        base_url=f"{SUPABASE_URL}/rest/v1",
+        api_key=SUPABASE_KEY,
+        timeout=SUPABASE_HTTP_TIMEOUT_SECONDS,
+        max_connections=SUPABASE_HTTP_MAX_CONNECTIONS,
+        retries=SUPABASE_HTTP_RETRIES,
+        backoff=SUPABASE_HTTP_BACKOFF_SECONDS,
+        transport=None
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.transport = transport
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"apikey": self.api_key, "Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                transport=self.transport
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method, path=f"/{TABLE}", params=None, json=None, headers=None):
+        """Send a request, retrying transient failures with exponential backoff"""
+        # Inserts are only retried when the request never reached the server
+        idempotent = method != "POST"
+        for attempt in range(self.retries + 1):
+            try:
+                resp = await self.client.request(method, path, params=params, json=json, headers=headers)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error, retryable = repr(e), True
+            except httpx.TransportError as e:
+                error, retryable = repr(e), idempotent
+            else:
+                if resp.status_code < 400:
+                    return resp.json() if resp.content else None
+                error = f"{resp.status_code} from PostgREST: {resp.text}"
+                retryable = resp.status_code in RETRY_STATUSES and (idempotent or resp.status_code == 429)
+
+            if not retryable or attempt >= self.retries:
+                raise RepositoryError(error)
+            delay = self.backoff * (2 ** attempt)
+            logger.warning(f"Retrying {method} {path} in {delay:.2f}s: {error}")
+            await asyncio.sleep(delay)
+
+    async def insert(self, row):
+        """Insert one analysis and return the stored row"""
+        return (await self.insert_many([row]))[0]
+
+    async def insert_many(self, rows):
+        """Insert analyses in one request and return the stored rows"""
+        with stage("db_insert"):
+            data = await self._request("POST", json=rows, headers={"Prefer": "return=representation"})
+        if not data:
+            raise RepositoryError("Insert returned no rows")
+        await self.update_rollups(data, 1)
+        return data
+
+    async def list_for_user(
+        self,
+        user_id,
+        limit=50,
+        offset=0,
+        cursor=None,
+        columns=ANALYSIS_COLUMNS,
+        since=None,
+        until=None
+    ):
+        """
+        Return a user's analyses, newest first, optionally created in [since, until).
+        With a cursor, seeks past it on (created_at, id) instead of scanning offset rows;
+        served by the (user_id, created_at desc, id desc) index.
+        """
+        params = {
+            "select": ",".join(columns),
+            "user_id": f"eq.{user_id}",
+            "order": "created_at.desc,id.desc",
+            "limit": limit
+        }
+        bounds = []
+        if since is not None:
+            bounds.append(f'created_at.gte."{since.isoformat()}"')
+        if until is not None:
+            bounds.append(f'created_at.lt."{until.isoformat()}"')
+        if bounds:
+            params["and"] = f"({','.join(bounds)})"
+        if cursor is not None:
+            created_at, analysis_id = decode_cursor(cursor)
+            params["or"] = (
+                f'(created_at.lt."{created_at}",'
+                f'and(created_at.eq."{created_at}",id.lt."{analysis_id}"))'
+            )
+        elif offset:
+            params["offset"] = offset
+        return await self._request("GET", params=params)
+
+    async def get(self, user_id, analysis_id):
+        """Return one of a user's analyses or None"""
+        rows = await self._request("GET", params={
+            "select": "*",
+            "id": f"eq.{analysis_id}",
+            "user_id": f"eq.{user_id}",
+            "limit": 1
+        })
+        return rows[0] if rows else None
+
+    async def has_image(self, user_id, image_hash):
+        """Whether any of a user's analyses was made from the stored image"""
+        rows = await self._request("GET", params={
+            "select": "id",
+            "user_id": f"eq.{user_id}",
+            "image_hash": f"eq.{image_hash}",
+            "limit": 1
+        })
+        return bool(rows)
+
+    async def delete(self, user_id, analysis_id):
+        """Delete one of a user's analyses and return it, or None if it did not exist"""
+        rows = await self._request(
+            "DELETE",
+            params={"id": f"eq.{analysis_id}", "user_id": f"eq.{user_id}"},
+            headers={"Prefer": "return=representation"}
+        )
+        if not rows:
+            return None
+        await self.update_rollups(rows, -1)
+        return rows[0]
+
+    async def update_rollups(self, rows, sign):
+        """
+        Apply inserted (sign=1) or deleted (sign=-1) rows to the trend rollups in one atomic call.
+        A failure is logged rather than raised: the analysis itself is already stored, and the
+        rollups can be rebuilt from skin_analyses (see docs/DATABASE.md).
+        """
+        try:
+            with stage("db_rollup"):
+                await self._request("POST", path="/rpc/apply_analysis_rollups", json={"deltas": rollup_deltas(rows, sign)})
+        except Exception as e:
+            logger.error(f"Failed to update trend rollups: {str(e)}")
+
+    async def list_rollups(self, user_id, period, since, until):
+        """Return a user's rollups for a period between two bucket starts, oldest first"""
+        return await self._request("GET", path=f"/{ROLLUP_TABLE}", params={
+            "select": "*",
+            "user_id": f"eq.{user_id}",
+            "period": f"eq.{period}",
+            "and": f"(bucket_start.gte.{since.isoformat()},bucket_start.lte.{until.isoformat()})",
+            "order": "bucket_start.asc"
+        })
+
+class InMemoryAnalysisRepository:
+    """In-process stand-in for local development and tests"""
+
+    def __init__(self):
+        self._rows = {}
+        self._rollups = {}
+        self._lock = threading.Lock()
+
+    async def close(self):
+        pass
+
+    async def insert(self, row):
+        return (await self.insert_many([row]))[0]
+
+    async def insert_many(self, rows):
+        stored = []
+        with stage("db_insert"), self._lock:
+            for row in rows:
+                row = {
+                    "id": str(uuid.uuid4()),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    **row
+                }
+                self._rows[row["id"]] = row
+                stored.append(dict(row))
+            self._update_rollups(stored, 1)
+        return stored
+
+    def _update_rollups(self, rows, sign):
+        for delta in rollup_deltas(rows, sign):
+            key = (delta["user_id"], delta["period"], delta["bucket_start"])
+            rollup = self._rollups.get(key)
+            if rollup is None:
+                rollup = self._rollups[key] = empty_rollup(*key[:2], datetime.fromisoformat(key[2]).date())
+            if apply_delta(rollup, delta)["analyses"] <= 0:
+                del self._rollups[key]
+
+    async def list_rollups(self, user_id, period, since, until):
+        with self._lock:
+            rollups = [
+                dict(r) for (uid, p, start), r in self._rollups.items()
+                if uid == user_id and p == period and since.isoformat() <= start <= until.isoformat()
+            ]
+        return sorted(rollups, key=lambda r: r["bucket_start"])
+
+    def _user_rows(self, user_id):
+        rows = [r for r in self._rows.values() if r["user_id"] == user_id]
+        return sorted(rows, key=lambda r: (r["created_at"], r["id"]), reverse=True)
+
+    async def list_for_user(
+        self,
+        user_id,
+        limit=50,
+        offset=0,
+        cursor=None,
+        columns=ANALYSIS_COLUMNS,
+        since=None,
+        until=None
+    ):
+        with self._lock:
+            rows = self._user_rows(user_id)
+            if since is not None:
+                rows = [r for r in rows if datetime.fromisoformat(r["created_at"]) >= since]
+            if until is not None:
+                rows = [r for r in rows if datetime.fromisoformat(r["created_at"]) < until]
+            if cursor is not None:
+                key = decode_cursor(cursor)
+                rows = [r for r in rows if (r["created_at"], r["id"]) < key]
+            else:
+                rows = rows[offset:]
+            return [{c: r.get(c) for c in columns} for r in rows[:limit]]
+
+    async def get(self, user_id, analysis_id):
+        with self._lock:
+            row = self._rows.get(analysis_id)
+            return dict(row) if row and row["user_id"] == user_id else None
+
+    async def has_image(self, user_id, image_hash):
+        with self._lock:
+            return any(r["user_id"] == user_id and r.get("image_hash") == image_hash for r in self._rows.values())
+
+    async def delete(self, user_id, analysis_id):
+        with self._lock:
+            row = self._rows.get(analysis_id)
+            if not row or row["user_id"] != user_id:
+                return None
+            self._update_rollups([row], -1)
+            return self._rows.pop(analysis_id)
+
+def create_analysis_repository(kind=ANALYSIS_REPOSITORY):
+    """Create the analysis repository selected by configuration"""
+    if kind == "memory":
+        return InMemoryAnalysisRepository()
+    return PostgrestAnalysisRepository()
+
+# Global analysis repository instance
+analysis_repository = create_analysis_repository()
@@ -1,224 +1,303 @@
+import asyncio
 import logging
-import io
-from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Request
-from PIL import Image
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-
-from app.database import supabase
+import uuid
+from datetime import date
+from typing import List, Literal
+from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Query, Header, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from app.config import BATCH_MAX_FILES, BATCH_MAX_CONCURRENCY, ANALYSES_MAX_PAGE_SIZE
+from app.services.responses import ORJSONResponse, dumps
+from app.analysis.repository import (
+    analysis_repository,
+    projection,
+    encode_cursor,
+    InvalidCursor
+)
 from app.models import AnalysisResponse
 from app.auth.dependencies import get_current_user
-from app.services.ml_models import model_manager
-from app.services.image_processing import (
-    run_model,
-    crop_center_patch,
-    compute_redness,
-    compute_global_redness
+from app.analysis.ingest import read_upload
+from app.analysis.export import EXPORT_WRITERS, iter_chunks, date_bounds
+from app.analysis.trends import default_range, build_trends, etag, etag_matches
+from app.analysis.idempotency import (
+    analysis_deduplicator,
+    content_hash,
+    IdempotencyConflict,
+    MAX_KEY_LENGTH
+)
+from app.analysis.pipeline import (
+    analyze_image,
+    validate_content_type,
+    build_analysis_row,
+    build_analysis_response,
+    store_original
 )
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["Analysis"])
-limiter = Limiter(key_func=get_remote_address)
 
 @router.post("/skinprocessing", response_model=AnalysisResponse)
-@limiter.limit("30/minute")
 async def analyze_skin(
-    request: Request,
     file: UploadFile = File(...),
+    idempotency_key: str | None = Header(None),
     user=Depends(get_current_user)
 ):
     """
     Analyze skin image for acne detection and skin disease classification.
     Requires authentication via Bearer token.
+    Retries with the same Idempotency-Key, or the same image shortly after, return the
+    original analysis instead of analyzing and saving it again.
     """
     logger.info(f"Processing skin analysis for user: {user.email}, file: {file.filename}")
 
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
     try:
         # Validate file type
-        if not file.content_type or not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-
-        # Load image
-        image_bytes = await file.read()
-        try:
-            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        except Exception as e:
-            logger.error(f"Image processing error: {str(e)}")
-            raise HTTPException(status_code=400, detail="Invalid image file")
-
-        # Acne detection model
-        acne_results = run_model(model_manager.acne_model, image, task_type="detection")
-
-        if "error" in acne_results:
-            logger.error(f"Acne model error: {acne_results['error']}")
-            raise HTTPException(status_code=500, detail="Acne detection model failed")
-
-        preds = acne_results.get("predictions", []) or []
-        acne_count = len(preds)
-        total_width = total_height = total_area = total_redness = 0
-        papules = pustules = comedones = nodules = 0
-
-        for pred in preds:
-            x, y, w, h = float(pred["x"]), float(pred["y"]), float(pred["width"]), float(pred["height"])
-            left, upper, right, lower = int(x - w/2), int(y - h/2), int(x + w/2), int(y + h/2)
-
-            # Ensure bounds are within image
-            left = max(0, left)
-            upper = max(0, upper)
-            right = min(image.width, right)
-            lower = min(image.height, lower)
-
-            patch = image.crop((left, upper, right, lower))
-            total_redness += compute_redness(patch)
-            total_width += w
-            total_height += h
-            total_area += w * h
-
-            lesion_type = str(pred.get("class", "")).lower()
-            if "papule" in lesion_type:
-                papules += 1
-            elif "pustule" in lesion_type:
-                pustules += 1
-            elif "comedone" in lesion_type:
-                comedones += 1
-            elif "nodule" in lesion_type:
-                nodules += 1
-
-        # Classify unknown lesions as comedones
-        unknown_count = acne_count - (papules + pustules + comedones + nodules)
-        if unknown_count > 0:
-            comedones += unknown_count
-
-        acne_features = {
-            "acne_count": acne_count,
-            "avg_acne_width": total_width / acne_count if acne_count else 0,
-            "avg_acne_height": total_height / acne_count if acne_count else 0,
-            "avg_acne_area": total_area / acne_count if acne_count else 0,
-            "avg_redness": total_redness / acne_count if acne_count else 0,
-            "papules_count": papules,
-            "pustules_count": pustules,
-            "comedone_count": comedones,
-            "nodules_count": nodules
-        }
-
-        # Skin disease classification model
-        skin_patch = crop_center_patch(image, 300)
-        skin_disease_results = run_model(
-            model_manager.skin_disease_model,
-            skin_patch,
-            input_size=300,
-            task_type="classification"
-        )
-
-        skin_preds = skin_disease_results.get("predictions", [])
-        if skin_preds and skin_preds[0].get("predictions"):
-            top_disease = skin_preds[0]["predictions"][0]
-            disease_label = top_disease.get("class")
-            disease_confidence = top_disease.get("confidence")
-        else:
-            disease_label = None
-            disease_confidence = None
-
-        # Skin general classification model
-        skin_class_patch = crop_center_patch(image, 640)
-        skin_class_results = run_model(
-            model_manager.skin_class_model,
-            skin_class_patch,
-            input_size=640,
-            task_type="classification"
-        )
-        class_labels = [p.get("class", "Unknown") for p in skin_class_results.get("predictions", [])] or ["Unknown"]
-
-        # Global redness
-        global_red = compute_global_redness(image)
-
-        # Save to Supabase database
-        analysis_data = {
-            "user_id": user.id,
-            "filename": file.filename,
-            **acne_features,
-            "global_redness": global_red,
-            "skin_disease_label": disease_label,
-            "skin_disease_confidence": disease_confidence,
-            "skin_classification_labels": ",".join(class_labels),
-            "acne_detected": acne_count > 0,
-            "result": None
-        }
-
-        result = supabase.table("skin_analyses").insert(analysis_data).execute()
-
-        if not result.data:
-            logger.error("Failed to save analysis to database")
-            raise HTTPException(status_code=500, detail="Failed to save analysis")
-
-        saved_analysis = result.data[0]
-        logger.info(f"Analysis saved successfully with ID: {saved_analysis['id']}")
-
-        return AnalysisResponse(
-            id=saved_analysis["id"],
-            filename=file.filename,
-            acne_count=acne_features["acne_count"],
-            avg_acne_width=acne_features["avg_acne_width"],
-            avg_acne_height=acne_features["avg_acne_height"],
-            avg_acne_area=acne_features["avg_acne_area"],
-            papules_count=acne_features["papules_count"],
-            pustules_count=acne_features["pustules_count"],
-            comedone_count=acne_features["comedone_count"],
-            nodules_count=acne_features["nodules_count"],
-            avg_redness=acne_features["avg_redness"],
-            global_redness=global_red,
-            skin_disease_label=disease_label,
-            skin_disease_confidence=disease_confidence,
-            skin_classification_labels=",".join(class_labels),
-            acne_detected=acne_count > 0
-        )
-
+        validate_content_type(file)
+        image_bytes = await read_upload(file)
+
+        fingerprint = await run_in_threadpool(content_hash, image_bytes)
+
+        async def analyze():
+            # Load image and run the analysis pipeline
+            features = await analyze_image(image_bytes, image_hash=fingerprint)
+
+            # Save to Supabase database
+            analysis_data = build_analysis_row(user.id, file.filename, features)
+            try:
+                saved_analysis = await analysis_repository.insert(analysis_data)
+            except Exception as e:
+                logger.error(f"Failed to save analysis to database: {str(e)}")
+                raise HTTPException(status_code=500, detail="Failed to save analysis")
+
+            logger.info(f"Analysis saved successfully with ID: {saved_analysis['id']}")
+            await store_original(image_bytes)
+            return build_analysis_response(saved_analysis["id"], file.filename, features).model_dump()
+
+        result, replayed = await analysis_deduplicator.run(user.id, fingerprint, idempotency_key, analyze)
+        headers = {}
+        if replayed:
+            logger.info(f"Returning existing analysis {result['id']} for duplicate submission")
+            headers["Idempotent-Replayed"] = "true"
+        # Already validated when the AnalysisResponse was built, so skip response_model validation
+        return ORJSONResponse(result, headers=headers)
+
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred during analysis")
 
+@router.post("/skinprocessing/batch")
+async def analyze_skin_batch(
+    files: List[UploadFile] = File(...),
+    user=Depends(get_current_user)
+):
+    """
+    Analyze several skin images in one request.
+    Streams one NDJSON line per image as soon as it finishes, then a summary line
+    once all successful analyses are saved with a single bulk insert.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {BATCH_MAX_FILES} files")
+
+    logger.info(f"Processing batch of {len(files)} images for user: {user.email}")
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def process(index, file):
+        async with semaphore:
+            try:
+                validate_content_type(file)
+                features = await analyze_image(await read_upload(file))
+                return index, file.filename, features, None
+            except HTTPException as e:
+                return index, file.filename, None, e.detail
+            except Exception as e:
+                logger.error(f"Batch analysis error for {file.filename}: {str(e)}")
+                return index, file.filename, None, "An error occurred during analysis"
+
+    async def stream():
+        rows = []
+        # Uploads of the analyses in rows; their originals are stored once the rows are saved
+        uploads = []
+        tasks = [asyncio.create_task(process(i, f)) for i, f in enumerate(files)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, filename, features, error = await next_done
+                if error:
+                    line = {"index": index, "filename": filename, "status": "error", "detail": error}
+                else:
+                    # IDs are assigned here so results can stream before the bulk insert
+                    analysis_id = str(uuid.uuid4())
+                    rows.append(build_analysis_row(user.id, filename, features, analysis_id))
+                    uploads.append(files[index])
+                    response = build_analysis_response(analysis_id, filename, features)
+                    line = {"index": index, "filename": filename, "status": "ok", "result": response.model_dump()}
+                yield dumps(line) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        summary = {"status": "complete", "saved": 0, "failed": len(files) - len(rows)}
+        if rows:
+            try:
+                saved = await analysis_repository.insert_many(rows)
+                summary["saved"] = len(saved)
+                for upload in uploads:
+                    # Read back from the spooled upload rather than keeping every image in memory
+                    await upload.seek(0)
+                    await store_original(await upload.read())
+            except Exception as e:
+                logger.error(f"Batch insert error: {str(e)}")
+                summary.update(status="error", detail="Failed to save analyses")
+        logger.info(f"Batch finished for user {user.email}: {summary}")
+        yield dumps(summary) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @router.get("/analyses")
-@limiter.limit("60/minute")
 async def get_user_analyses(
-    request: Request,
     user=Depends(get_current_user),
-    limit: int = 50,
-    offset: int = 0
+    limit: int = Query(50, ge=1, le=ANALYSES_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    cursor: str | None = None,
+    fields: str | None = None
 ):
-    """Get current user's analysis history"""
+    """
+    Get current user's analysis history, newest first.
+    Pass the returned next_cursor back as cursor to fetch the following page.
+    Returns summary fields unless fields lists columns (comma-separated) or is "*".
+    """
+    if cursor and offset:
+        raise HTTPException(status_code=400, detail="Use either cursor or offset, not both")
+
+    try:
+        columns = projection(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        result = supabase.table("skin_analyses") \
-            .select("*") \
-            .eq("user_id", user.id) \
-            .order("created_at", desc=True) \
-            .range(offset, offset + limit - 1) \
-            .execute()
-
-        return {
-            "analyses": result.data,
-            "count": len(result.data)
-        }
+        # One extra row tells whether another page exists
+        rows = await analysis_repository.list_for_user(
+            user.id, limit=limit + 1, offset=offset, cursor=cursor, columns=columns
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching analyses: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch analyses")
 
+    # Rows are plain JSON values from the store, so they are serialized as they are
+    analyses = rows[:limit]
+    return ORJSONResponse({
+        "analyses": analyses,
+        "count": len(analyses),
+        "next_cursor": encode_cursor(analyses[-1]) if len(rows) > limit else None
+    })
+
+@router.get("/analyses/trends")
+async def get_analysis_trends(
+    user=Depends(get_current_user),
+    period: Literal["day", "week"] = "week",
+    since: date | None = None,
+    until: date | None = None,
+    if_none_match: str | None = Header(None)
+):
+    """
+    Get the current user's daily or weekly trend buckets (UTC), oldest first.
+    Defaults to the last 90 days or 52 weeks. Send the returned ETag as If-None-Match
+    to get 304 Not Modified while nothing in the range has changed.
+    """
+    since, until = default_range(period, since, until)
+    if since > until:
+        raise HTTPException(status_code=400, detail="since must not be after until")
+
+    try:
+        rollups = await analysis_repository.list_rollups(user.id, period, since, until)
+    except Exception as e:
+        logger.error(f"Error fetching trends: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch trends")
+
+    trends = build_trends(period, rollups, since, until)
+    tag = etag(trends)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(trends, headers=headers)
+
+@router.get("/analyses/export")
+async def export_analyses(
+    user=Depends(get_current_user),
+    format: Literal["csv", "parquet"] = "csv",
+    since: date | None = None,
+    until: date | None = None,
+    fields: str | None = None
+):
+    """
+    Download the current user's complete analysis history, newest first, as CSV or Parquet.
+    since and until are inclusive UTC dates; fields lists columns (comma-separated), default all.
+    Rows are fetched and written in chunks, so exports of any size stream in constant memory.
+    """
+    if since and until and since > until:
+        raise HTTPException(status_code=400, detail="since must not be after until")
+    try:
+        columns = projection(fields or "*")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        writer = EXPORT_WRITERS[format](columns)
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export requires the pyarrow package")
+
+    start, end = date_bounds(since, until)
+    chunks = iter_chunks(analysis_repository, user.id, columns, since=start, until=end)
+    try:
+        # Fetched before responding so a failing store still gets an error status
+        first = await anext(chunks, None)
+    except Exception as e:
+        logger.error(f"Error exporting analyses: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to export analyses")
+
+    async def stream():
+        exported = 0
+        try:
+            if first is not None:
+                exported += len(first)
+                yield await run_in_threadpool(writer.write, first)
+                async for rows in chunks:
+                    exported += len(rows)
+                    yield await run_in_threadpool(writer.write, rows)
+            yield await run_in_threadpool(writer.close)
+        except Exception as e:
+            # Headers are already sent; ending the stream early marks the download as failed
+            logger.error(f"Export failed after {exported} rows for user {user.email}: {str(e)}")
+            raise
+        finally:
+            await chunks.aclose()
+        logger.info(f"Exported {exported} analyses as {format} for user {user.email}")
+
+    filename = f"skin-analyses-{date.today():%Y%m%d}.{writer.extension}"
+    return StreamingResponse(
+        stream(),
+        media_type=writer.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @router.get("/analyses/{analysis_id}")
 async def get_analysis(analysis_id: str, user=Depends(get_current_user)):
     """Get a specific analysis by ID"""
     try:
-        result = supabase.table("skin_analyses") \
-            .select("*") \
-            .eq("id", analysis_id) \
-            .eq("user_id", user.id) \
-            .single() \
-            .execute()
-
-        if not result.data:
+        analysis = await analysis_repository.get(user.id, analysis_id)
+
+        if not analysis:
             raise HTTPException(status_code=404, detail="Analysis not found")
 
-        return result.data
+        return ORJSONResponse(analysis)
     except HTTPException:
         raise
     except Exception as e:
@@ -229,14 +308,11 @@ async def get_analysis(analysis_id: str, user=Depends(get_current_user)):
 async def delete_analysis(analysis_id: str, user=Depends(get_current_user)):
     """Delete a specific analysis"""
     try:
-        result = supabase.table("skin_analyses") \
-            .delete() \
-            .eq("id", analysis_id) \
-            .eq("user_id", user.id) \
-            .execute()
+        deleted = await analysis_repository.delete(user.id, analysis_id)
 
-        if not result.data:
+        if not deleted:
             raise HTTPException(status_code=404, detail="Analysis not found")
+        await analysis_deduplicator.forget_analysis(analysis_id)
 
         logger.info(f"Analysis {analysis_id} deleted by user {user.email}")
         return {"message": "Analysis deleted successfully"}
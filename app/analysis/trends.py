@@ -0,0 +1,115 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+ROLLUP_TABLE = "skin_analysis_rollups"
+
+PERIODS = ("day", "week")
+
+# Range returned when the client does not pass `since`
+DEFAULT_RANGE = {"day": timedelta(days=90), "week": timedelta(weeks=52)}
+
+# Lesion totals kept per bucket: rollup column -> analysis column
+COUNT_COLUMNS = {
+    "acne_count": "acne_count",
+    "papules_count": "papules_count",
+    "pustules_count": "pustules_count",
+    "comedone_count": "comedone_count",
+    "nodules_count": "nodules_count"
+}
+
+# Means are kept as a sum and the number of analyses that had a value
+MEAN_COLUMNS = ("avg_redness", "global_redness")
+
+def bucket_start(created_at, period):
+    """First day (UTC) of the day or ISO week (Monday) containing created_at"""
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    day = created_at.date()
+    if period == "week":
+        day -= timedelta(days=day.weekday())
+    return day
+
+def empty_rollup(user_id, period, start):
+    rollup = {"user_id": user_id, "period": period, "bucket_start": start.isoformat(), "analyses": 0, "acne_detected": 0}
+    rollup.update({column: 0 for column in COUNT_COLUMNS})
+    for column in MEAN_COLUMNS:
+        rollup[f"{column}_sum"] = 0.0
+        rollup[f"{column}_n"] = 0
+    return rollup
+
+def rollup_deltas(rows, sign=1):
+    """
+    Per-bucket increments for inserted (sign=1) or deleted (sign=-1) analysis rows,
+    one entry per (user, period, bucket) touched
+    """
+    deltas = {}
+    for row in rows:
+        for period in PERIODS:
+            start = bucket_start(row["created_at"], period)
+            key = (row["user_id"], period, start)
+            delta = deltas.get(key)
+            if delta is None:
+                delta = deltas[key] = empty_rollup(row["user_id"], period, start)
+            delta["analyses"] += sign
+            delta["acne_detected"] += sign * bool(row.get("acne_detected"))
+            for column, source in COUNT_COLUMNS.items():
+                delta[column] += sign * (row.get(source) or 0)
+            for column in MEAN_COLUMNS:
+                if row.get(column) is not None:
+                    delta[f"{column}_sum"] += sign * float(row[column])
+                    delta[f"{column}_n"] += sign
+    return list(deltas.values())
+
+def apply_delta(rollup, delta):
+    """Add a delta to a stored rollup in place"""
+    for key, value in delta.items():
+        if key not in ("user_id", "period", "bucket_start"):
+            rollup[key] += value
+    return rollup
+
+def default_range(period, since=None, until=None, today=None):
+    """Fill in the bucket range for a trends query"""
+    today = today or datetime.now(timezone.utc).date()
+    until = until or today
+    since = since or until - DEFAULT_RANGE[period]
+    return bucket_start(datetime.combine(since, datetime.min.time()), period), until
+
+def summarize(rollup):
+    """Client-facing bucket with totals and means"""
+    analyses = rollup["analyses"]
+    bucket = {
+        "start": rollup["bucket_start"],
+        "analyses": analyses,
+        "acne_detected": rollup["acne_detected"],
+        "acne_count_total": rollup["acne_count"],
+        "acne_count_mean": rollup["acne_count"] / analyses if analyses else None,
+        "lesions": {
+            "papules": rollup["papules_count"],
+            "pustules": rollup["pustules_count"],
+            "comedones": rollup["comedone_count"],
+            "nodules": rollup["nodules_count"]
+        }
+    }
+    for column in MEAN_COLUMNS:
+        n = rollup[f"{column}_n"]
+        bucket[f"{column}_mean"] = rollup[f"{column}_sum"] / n if n else None
+    return bucket
+
+def build_trends(period, rollups, since, until):
+    """Trend response for rollups ordered by bucket start"""
+    buckets = [summarize(r) for r in rollups if r["analyses"] > 0]
+    return {"period": period, "since": since.isoformat(), "until": until.isoformat(), "buckets": buckets}
+
+def etag(payload):
+    """Strong validator for a trends payload"""
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+def etag_matches(if_none_match, tag):
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or tag in candidates or f"W/{tag}" in candidates
@@ -1,4 +1,4 @@
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_user, get_current_user_profile
 from app.auth.routes import router as auth_router
 
-__all__ = ["get_current_user", "auth_router"]
+__all__ = ["get_current_user", "get_current_user_profile", "auth_router"]
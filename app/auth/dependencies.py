@@ -1,24 +1,88 @@
 import logging
+import jwt
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.database import supabase
+from app.services.metrics import stage
+from app.auth.tokens import (
+    AuthenticatedUser,
+    LocalVerificationUnavailable,
+    needs_revocation_check,
+    token_cache,
+    token_verifier
+)
 
 logger = logging.getLogger(__name__)
 security = HTTPBearer()
 
+async def verify_remote(token, claims=None):
+    """Verify token with Supabase Auth; used as fallback and for revocation checks"""
+    user_response = await run_in_threadpool(supabase.auth.get_user, token)
+
+    if not user_response or not user_response.user:
+        logger.warning("Invalid token provided")
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    if claims is None:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    return AuthenticatedUser.from_remote(user_response.user, claims)
+
+async def verify_token(token):
+    """Verify token locally, falling back to Supabase when no local key is available"""
+    try:
+        if token_verifier.needs_network(token):
+            claims = await run_in_threadpool(token_verifier.verify, token)
+        else:
+            claims = token_verifier.verify(token)
+    except LocalVerificationUnavailable as e:
+        logger.debug(f"Local token verification unavailable, using Supabase: {str(e)}")
+        return await verify_remote(token)
+    except jwt.InvalidTokenError:
+        logger.warning("Invalid token provided")
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    if needs_revocation_check(claims):
+        return await verify_remote(token, claims)
+    return AuthenticatedUser.from_claims(claims)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token and return current user"""
-    try:
-        token = credentials.credentials
-        user_response = supabase.auth.get_user(token)
+    with stage("auth"):
+        return await _authenticate(credentials.credentials)
 
-        if not user_response or not user_response.user:
-            logger.warning("Invalid token provided")
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
+async def _authenticate(token):
+    if await token_cache.is_revoked_async(token):
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user = token_cache.get(token)
+    if user is not None:
+        return user
 
-        return user_response.user
+    try:
+        user = await verify_token(token)
     except HTTPException:
+        token_cache.discard(token)
         raise
     except Exception as e:
         logger.error(f"Authentication error: {str(e)}")
         raise HTTPException(status_code=401, detail="Authentication failed")
+
+    token_cache.set(token, user)
+    return user
+
+async def get_current_user_profile(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    user=Depends(get_current_user)
+):
+    """Return current user with profile fields that are not carried in the token"""
+    if user.created_at is None:
+        try:
+            remote = await verify_remote(credentials.credentials, user.claims)
+        except HTTPException:
+            token_cache.discard(credentials.credentials)
+            raise
+        except Exception as e:
+            logger.error(f"Authentication error: {str(e)}")
+            raise HTTPException(status_code=401, detail="Authentication failed")
+        user.created_at = remote.created_at
+    return user
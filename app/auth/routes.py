@@ -1,21 +1,21 @@
 import logging
-from fastapi import APIRouter, HTTPException, Request, Depends
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import time
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
 from app.database import supabase
 from app.models import AuthRequest
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_user, security
+from app.auth.tokens import token_cache
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=["Authentication"])
-limiter = Limiter(key_func=get_remote_address)
 
 @router.post("/signup")
-@limiter.limit("5/minute")
-async def signup(request: Request, auth_request: AuthRequest):
+async def signup(auth_request: AuthRequest):
     """Register a new user"""
     try:
-        response = supabase.auth.sign_up({
+        response = await run_in_threadpool(supabase.auth.sign_up, {
             "email": auth_request.email,
             "password": auth_request.password
         })
@@ -36,11 +36,10 @@ async def signup(request: Request, auth_request: AuthRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/login")
-@limiter.limit("10/minute")
-async def login(request: Request, auth_request: AuthRequest):
+async def login(auth_request: AuthRequest):
     """Login and get access token"""
     try:
-        response = supabase.auth.sign_in_with_password({
+        response = await run_in_threadpool(supabase.auth.sign_in_with_password, {
             "email": auth_request.email,
             "password": auth_request.password
         })
@@ -67,10 +66,16 @@ async def login(request: Request, auth_request: AuthRequest):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @router.post("/logout")
-async def logout(user=Depends(get_current_user)):
-    """Logout current user"""
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    user=Depends(get_current_user)
+):
+    """Logout current user: ends their Supabase session and stops accepting this access token"""
+    token = credentials.credentials
     try:
-        supabase.auth.sign_out()
+        # Refused locally first: the JWT itself stays valid until it expires
+        await run_in_threadpool(token_cache.revoke, token, user.claims.get("exp", time.time() + token_cache.ttl))
+        await run_in_threadpool(supabase.auth.admin.sign_out, token, "local")
         logger.info(f"User logged out: {user.email}")
         return {"message": "Logged out successfully"}
     except Exception as e:
@@ -78,11 +83,10 @@ async def logout(user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail="Logout failed")
 
 @router.post("/refresh")
-@limiter.limit("20/minute")
-async def refresh_token(request: Request, refresh_token: str):
+async def refresh_token(refresh_token: str):
     """Refresh access token"""
     try:
-        response = supabase.auth.refresh_session(refresh_token)
+        response = await run_in_threadpool(supabase.auth.refresh_session, refresh_token)
 
         if response.session:
             return {
@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import jwt
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import (
+    SUPABASE_URL,
+    SUPABASE_JWT_SECRET,
+    AUTH_TOKEN_CACHE_TTL_SECONDS,
+    AUTH_TOKEN_CACHE_MAX_ENTRIES,
+    AUTH_REVALIDATE_SECONDS,
+    AUTH_JWKS_CACHE_SECONDS,
+    AUTH_REVOCATION_BACKEND,
+    AUTH_REVOCATION_SQLITE_PATH,
+    AUTH_REVOCATION_REDIS_URL
+)
+
+logger = logging.getLogger(__name__)
+
+JWT_AUDIENCE = "authenticated"
+# Asymmetric algorithms accepted for keys from the JWKS; symmetric tokens use the configured secret
+JWKS_ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512", "EdDSA")
+
+@dataclass
+class AuthenticatedUser:
+    """Lightweight user decoded from verified access token claims"""
+    id: str
+    email: str | None = None
+    role: str | None = None
+    created_at: str | None = None
+    claims: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_claims(cls, claims):
+        return cls(id=claims["sub"], email=claims.get("email"), role=claims.get("role"), claims=claims)
+
+    @classmethod
+    def from_remote(cls, user, claims=None):
+        """Build from a Supabase Auth user object"""
+        created_at = user.created_at.isoformat() if hasattr(user.created_at, "isoformat") else user.created_at
+        return cls(id=user.id, email=user.email, role=getattr(user, "role", None), created_at=created_at, claims=claims or {})
+
+class LocalVerificationUnavailable(Exception):
+    """Raised when a token cannot be verified without calling Supabase"""
+
+class TokenVerifier:
+    """Verifies Supabase access tokens locally against the JWT secret or cached JWKS"""
+
+    def __init__(self, secret=SUPABASE_JWT_SECRET, jwks_url=f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json"):
+        self.secret = secret
+        self._jwks = jwt.PyJWKClient(jwks_url, cache_keys=True, lifespan=AUTH_JWKS_CACHE_SECONDS, timeout=5)
+
+    def needs_network(self, token):
+        """Whether verifying this token may fetch signing keys"""
+        try:
+            return jwt.get_unverified_header(token).get("alg") != "HS256"
+        except jwt.InvalidTokenError:
+            return False
+
+    def verify(self, token):
+        """Return verified claims or raise jwt.InvalidTokenError"""
+        if jwt.get_unverified_header(token).get("alg") == "HS256":
+            if not self.secret:
+                raise LocalVerificationUnavailable("SUPABASE_JWT_SECRET is not configured")
+            key, algorithm = self.secret, "HS256"
+        else:
+            try:
+                signing_key = self._jwks.get_signing_key_from_jwt(token)
+            except jwt.PyJWKClientError as e:
+                raise LocalVerificationUnavailable(str(e))
+            # The algorithm comes from the published key, never from the token's own header
+            algorithm = signing_key.algorithm_name
+            if algorithm not in JWKS_ALGORITHMS:
+                raise jwt.InvalidAlgorithmError(f"Signing key algorithm {algorithm} is not accepted")
+            key = signing_key.key
+
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=JWT_AUDIENCE,
+            options={"require": ["exp", "sub"]}
+        )
+
+def token_digest(token):
+    """Shared stores keep a hash of each token, never the bearer token itself"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class MemoryRevocationStore:
+    """Logged-out tokens in process memory; revocations apply per process"""
+
+    shared = False
+
+    def __init__(self):
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, token, expires_at):
+        now = time.time()
+        with self._lock:
+            self._revoked[token] = expires_at
+            for revoked in [t for t, exp in self._revoked.items() if exp <= now]:
+                del self._revoked[revoked]
+
+    def is_revoked(self, token):
+        expires_at = self._revoked.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+class SQLiteRevocationStore:
+    """Logged-out tokens shared between processes on one host through a SQLite file"""
+
+    shared = True
+
+    def __init__(self, path=AUTH_REVOCATION_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS revoked (digest TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # SQLite connections must not be shared with forked server workers
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def revoke(self, token, expires_at):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO revoked (digest, expires_at) VALUES (?, ?)", (token_digest(token), expires_at)
+            )
+            conn.execute("DELETE FROM revoked WHERE expires_at <= ?", (time.time(),))
+
+    def is_revoked(self, token):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM revoked WHERE digest = ? AND expires_at > ?", (token_digest(token), time.time())
+            ).fetchone()
+        return row is not None
+
+class RedisRevocationStore:
+    """Logged-out tokens shared by every process and host through Redis; requires the redis package"""
+
+    shared = True
+
+    def __init__(self, url=AUTH_REVOCATION_REDIS_URL, prefix="skinintel:revoked:"):
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
+
+    def revoke(self, token, expires_at):
+        # Redis drops the entry when the token would have expired anyway
+        if expires_at > time.time():
+            self._client.set(self.prefix + token_digest(token), 1, exat=int(expires_at) + 1)
+
+    def is_revoked(self, token):
+        return bool(self._client.exists(self.prefix + token_digest(token)))
+
+def create_revocation_store(backend=AUTH_REVOCATION_BACKEND):
+    if backend == "sqlite":
+        return SQLiteRevocationStore()
+    if backend == "redis":
+        return RedisRevocationStore()
+    return MemoryRevocationStore()
+
+class VerifiedTokenCache:
+    """Short-lived LRU of verified users, bounded by each token's expiry"""
+
+    def __init__(self, ttl=AUTH_TOKEN_CACHE_TTL_SECONDS, max_entries=AUTH_TOKEN_CACHE_MAX_ENTRIES, revocations=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Logged-out tokens and their expiry; access tokens stay valid JWTs until then
+        self.revocations = revocations or create_revocation_store()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """Return the cached user for a still-valid token, or None"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def set(self, token, user):
+        exp = user.claims.get("exp", time.time() + self.ttl)
+        with self._lock:
+            self._entries[token] = (user, min(time.time() + self.ttl, exp))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def revoke(self, token, expires_at):
+        """Evict a token and refuse it until it expires, e.g. after logout"""
+        self.discard(token)
+        self.revocations.revoke(token, expires_at)
+
+    def is_revoked(self, token):
+        try:
+            return self.revocations.is_revoked(token)
+        except Exception as e:
+            # Fail open like the other shared stores; the token is still a valid, unexpired JWT
+            logger.warning(f"Token revocation store error: {str(e)}")
+            return False
+
+    async def is_revoked_async(self, token):
+        """is_revoked without blocking the event loop on a shared store"""
+        if self.revocations.shared:
+            return await run_in_threadpool(self.is_revoked, token)
+        return self.is_revoked(token)
+
+def needs_revocation_check(claims):
+    """Tokens issued longer ago than the revalidation window are also checked with Supabase"""
+    if AUTH_REVALIDATE_SECONDS <= 0:
+        return False
+    return time.time() - claims.get("iat", 0) > AUTH_REVALIDATE_SECONDS
+
+# Global verifier and token cache instances
+token_verifier = TokenVerifier()
+token_cache = VerifiedTokenCache()
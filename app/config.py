@@ -16,6 +16,7 @@ logger = logging.getLogger(__name__)
 ROBOFLOW_API_KEY = os.getenv("API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 
 # Validate required environment variables
 def validate_config():
@@ -34,9 +35,187 @@ CORS_ORIGINS = [
     # Add your production frontend URL here
 ]
 
-# Rate limiting settings
-RATE_LIMIT_SIGNUP = "5/minute"
-RATE_LIMIT_LOGIN = "10/minute"
-RATE_LIMIT_REFRESH = "20/minute"
-RATE_LIMIT_ANALYSIS = "30/minute"
-RATE_LIMIT_FETCH = "60/minute"
+# Rate limiting settings: token buckets per user (or client IP when unauthenticated) and endpoint
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_SIGNUP = os.getenv("RATE_LIMIT_SIGNUP", "5/minute")
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/minute")
+RATE_LIMIT_REFRESH = os.getenv("RATE_LIMIT_REFRESH", "20/minute")
+RATE_LIMIT_ANALYSIS = os.getenv("RATE_LIMIT_ANALYSIS", "30/minute")
+RATE_LIMIT_BATCH = os.getenv("RATE_LIMIT_BATCH", "10/minute")
+RATE_LIMIT_JOBS = os.getenv("RATE_LIMIT_JOBS", "30/minute")
+RATE_LIMIT_FETCH = os.getenv("RATE_LIMIT_FETCH", "60/minute")
+RATE_LIMIT_EXPORT = os.getenv("RATE_LIMIT_EXPORT", "5/minute")
+# Bucket store: "memory" (per process), "sqlite" (shared on one host) or "redis" (shared everywhere)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", ".cache/ratelimit.sqlite")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Number of proxies in front of the API whose X-Forwarded-For entries are trusted
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+# Server settings for `python main.py`; more than one worker runs the pre-fork server
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", os.getenv("WEB_PORT", "8000")))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Load models in the master before forking so workers share them copy-on-write
+WEB_PRELOAD_MODELS = os.getenv("WEB_PRELOAD_MODELS", "true").lower() == "true"
+# On shutdown, workers stop accepting connections and finish in-flight requests for up to this long
+WEB_DRAIN_SECONDS = int(os.getenv("WEB_DRAIN_SECONDS", "30"))
+
+# Database settings: "postgrest" (Supabase REST API) or "memory" (local stand-in)
+ANALYSIS_REPOSITORY = os.getenv("ANALYSIS_REPOSITORY", "postgrest")
+SUPABASE_HTTP_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_HTTP_TIMEOUT_SECONDS", "10"))
+SUPABASE_HTTP_MAX_CONNECTIONS = int(os.getenv("SUPABASE_HTTP_MAX_CONNECTIONS", "20"))
+SUPABASE_HTTP_RETRIES = int(os.getenv("SUPABASE_HTTP_RETRIES", "3"))
+SUPABASE_HTTP_BACKOFF_SECONDS = float(os.getenv("SUPABASE_HTTP_BACKOFF_SECONDS", "0.2"))
+ANALYSES_MAX_PAGE_SIZE = int(os.getenv("ANALYSES_MAX_PAGE_SIZE", "100"))
+# Rows fetched and written per chunk by GET /analyses/export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+# Authentication settings
+AUTH_TOKEN_CACHE_TTL_SECONDS = int(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", "60"))
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+# Tokens older than this are also checked against Supabase Auth for revocation (0 disables)
+AUTH_REVALIDATE_SECONDS = int(os.getenv("AUTH_REVALIDATE_SECONDS", "600"))
+AUTH_JWKS_CACHE_SECONDS = int(os.getenv("AUTH_JWKS_CACHE_SECONDS", "600"))
+# Where logged-out tokens are recorded: memory (per process), sqlite (per host) or redis
+AUTH_REVOCATION_BACKEND = os.getenv("AUTH_REVOCATION_BACKEND", "memory")
+AUTH_REVOCATION_SQLITE_PATH = os.getenv("AUTH_REVOCATION_SQLITE_PATH", ".cache/revoked_tokens.sqlite")
+AUTH_REVOCATION_REDIS_URL = os.getenv("AUTH_REVOCATION_REDIS_URL", "redis://localhost:6379/0")
+
+# Batch analysis settings
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "20"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+# Upload ingestion settings
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Images with more source pixels than this are rejected before decoding
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "60000000"))
+# Longest side of the working image models run on (0 keeps native resolution)
+IMAGE_WORKING_MAX_SIDE = int(os.getenv("IMAGE_WORKING_MAX_SIDE", "2048"))
+
+# Image store settings: "local" (filesystem), "memory" (object-store stand-in) or "none"
+IMAGE_STORE_BACKEND = os.getenv("IMAGE_STORE_BACKEND", "local")
+IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", ".data/images")
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+IMAGE_THUMBNAIL_QUALITY = int(os.getenv("IMAGE_THUMBNAIL_QUALITY", "80"))
+# Thumbnails generated at the same time in the background
+IMAGE_THUMBNAIL_CONCURRENCY = int(os.getenv("IMAGE_THUMBNAIL_CONCURRENCY", "2"))
+
+# Analysis job queue settings: "memory" (single process) or "sqlite" (shared between processes on one host)
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+JOB_QUEUE_SQLITE_PATH = os.getenv("JOB_QUEUE_SQLITE_PATH", ".cache/jobs.sqlite")
+# Jobs processed concurrently by this process (0 leaves processing to `python -m app.jobs.worker`)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# New jobs are refused once this many are waiting, or a user has this many unfinished
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "100"))
+JOB_MAX_PENDING_PER_USER = int(os.getenv("JOB_MAX_PENDING_PER_USER", "10"))
+# A running job whose worker has not finished within this time is failed or picked up again
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", "300"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "86400"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+# Completion webhooks are signed with HMAC-SHA256 when set
+JOB_WEBHOOK_SECRET = os.getenv("JOB_WEBHOOK_SECRET")
+JOB_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("JOB_WEBHOOK_TIMEOUT_SECONDS", "10"))
+JOB_WEBHOOK_RETRIES = int(os.getenv("JOB_WEBHOOK_RETRIES", "3"))
+# Comma-separated hosts webhooks may be sent to (exact or *.domain); empty allows any public host.
+# Hosts resolving to loopback, private or link-local addresses are always refused.
+JOB_WEBHOOK_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
+# Inference settings
+INFERENCE_MAX_WORKERS = int(os.getenv("INFERENCE_MAX_WORKERS", "8"))
+# Group concurrent calls to local models into micro-batches (backends without batch support run singly)
+INFERENCE_BATCHING_ENABLED = os.getenv("INFERENCE_BATCHING_ENABLED", "true").lower() == "true"
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "16"))
+# Longest a call waits for a busy model before its batch is sent anyway
+INFERENCE_BATCH_MAX_WAIT_MS = float(os.getenv("INFERENCE_BATCH_MAX_WAIT_MS", "10"))
+ROBOFLOW_INFERENCE_URL = os.getenv("ROBOFLOW_INFERENCE_URL", "https://serverless.roboflow.com")
+# Run acne detection on overlapping tiles of the working image instead of one downscaled frame
+ACNE_TILING_ENABLED = os.getenv("ACNE_TILING_ENABLED", "false").lower() == "true"
+ACNE_TILE_SIZE = int(os.getenv("ACNE_TILE_SIZE", "640"))
+# Fraction of each tile shared with its neighbour; should exceed the largest lesion
+ACNE_TILE_OVERLAP = float(os.getenv("ACNE_TILE_OVERLAP", "0.2"))
+# Boxes from neighbouring tiles covering more than this fraction of the smaller one are merged
+ACNE_TILE_MERGE_THRESHOLD = float(os.getenv("ACNE_TILE_MERGE_THRESHOLD", "0.5"))
+# Concurrent tile calls for one image
+ACNE_TILE_MAX_WORKERS = int(os.getenv("ACNE_TILE_MAX_WORKERS", "4"))
+
+# Encoding used for images sent to the model backend (JPEG, PNG or WEBP)
+IMAGE_ENCODE_FORMAT = os.getenv("IMAGE_ENCODE_FORMAT", "JPEG")
+IMAGE_ENCODE_QUALITY = int(os.getenv("IMAGE_ENCODE_QUALITY", "95"))
+
+# Model call resilience settings
+# Total time budget for one image's analysis; model calls get what is left minus the reserve
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv("ANALYSIS_DEADLINE_SECONDS", "30"))
+# Part of the budget kept for feature extraction and storage after the models return
+ANALYSIS_DEADLINE_RESERVE_SECONDS = float(os.getenv("ANALYSIS_DEADLINE_RESERVE_SECONDS", "2"))
+# Upper bound for any single model call, including the hosted HTTP request
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "15"))
+# Start a duplicate classification call if the first has not returned after this long (0 disables)
+MODEL_HEDGE_DELAY_SECONDS = float(os.getenv("MODEL_HEDGE_DELAY_SECONDS", "0"))
+# A model's circuit opens when at least CIRCUIT_MIN_CALLS calls in the window fail at this rate
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+# How long an open circuit fails fast before letting a trial call through
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "15"))
+
+# Inference result cache settings
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")  # memory or sqlite
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_SQLITE_PATH = os.getenv("RESULT_CACHE_SQLITE_PATH", ".cache/results.sqlite")
+
+# Idempotent analysis settings
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")  # memory or sqlite
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", ".cache/idempotency.sqlite")
+# How long a response is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "86400"))
+# How long the same image from the same user returns the earlier analysis (0 disables)
+IDEMPOTENCY_DEDUP_WINDOW_SECONDS = int(os.getenv("IDEMPOTENCY_DEDUP_WINDOW_SECONDS", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000"))
+
+# Response compression settings: brotli (when installed) or gzip, negotiated per request
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+# Complete responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Metrics settings
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Fraction of requests whose per-stage timings are logged (0 disables trace logging)
+METRICS_TRACE_SAMPLE_RATE = float(os.getenv("METRICS_TRACE_SAMPLE_RATE", "0"))
+# Where workers write their metric values when WEB_WORKERS > 1, so /metrics adds up all of them
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", ".cache/prometheus")
+METRICS_MULTIPROCESS = METRICS_ENABLED and WEB_WORKERS > 1
+if METRICS_MULTIPROCESS:
+    # prometheus_client picks where values are stored when it is first imported, so this has to
+    # happen before that; main.py and app.server import app.config ahead of it
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = METRICS_MULTIPROC_DIR
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+
+# Model backend settings: "roboflow" (hosted) or "onnx" (local CPU) per model
+MODEL_BACKENDS = {
+    "acne_model": os.getenv("ACNE_MODEL_BACKEND", "roboflow"),
+    "skin_disease_model": os.getenv("SKIN_DISEASE_MODEL_BACKEND", "roboflow"),
+    "skin_class_model": os.getenv("SKIN_CLASS_MODEL_BACKEND", "roboflow")
+}
+MODEL_PATHS = {
+    "acne_model": os.getenv("ACNE_MODEL_PATH"),
+    "skin_disease_model": os.getenv("SKIN_DISEASE_MODEL_PATH"),
+    "skin_class_model": os.getenv("SKIN_CLASS_MODEL_PATH")
+}
+# Hosted model metadata is cached here so restarts skip the Roboflow lookups (TTL 0 disables)
+MODEL_METADATA_CACHE_PATH = os.getenv("MODEL_METADATA_CACHE_PATH", ".cache/models.json")
+MODEL_METADATA_CACHE_TTL_SECONDS = int(os.getenv("MODEL_METADATA_CACHE_TTL_SECONDS", "604800"))
+# Load each model on first use instead of at startup
+MODEL_LAZY_INIT = os.getenv("MODEL_LAZY_INIT", "false").lower() == "true"
+# Wait this long before retrying a model that failed to load
+MODEL_LOAD_RETRY_SECONDS = int(os.getenv("MODEL_LOAD_RETRY_SECONDS", "30"))
+# How often local model files are checked for a new version (0 disables)
+MODEL_RELOAD_INTERVAL_SECONDS = int(os.getenv("MODEL_RELOAD_INTERVAL_SECONDS", "30"))
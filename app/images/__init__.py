@@ -0,0 +1,4 @@
+from app.images.routes import router as images_router
+from app.images.store import image_store
+
+__all__ = ["images_router", "image_store"]
@@ -0,0 +1,125 @@
+import logging
+import os
+import re
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+from app.auth.dependencies import get_current_user
+from app.analysis.repository import analysis_repository
+from app.analysis.trends import etag_matches
+from app.images.store import image_store
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/images", tags=["Images"])
+
+# Stored objects never change under their key, so clients may cache them indefinitely
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+HASH_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+def parse_range(header, size):
+    """
+    Resolve a single "bytes=" range into (start, end) with end exclusive.
+    Returns None for headers that should be ignored (serve the full body) and raises
+    ValueError for ranges that cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    if not sep or not (first + last).isdigit():
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size
+    start = int(first)
+    end = min(size, int(last) + 1) if last else size
+    if start >= size or end <= start:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+async def _authorize(user, image_hash):
+    """404 unless the hash names an image from one of the user's analyses"""
+    if not image_store.enabled or not HASH_PATTERN.fullmatch(image_hash):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        owned = await analysis_repository.has_image(user.id, image_hash)
+    except Exception as e:
+        logger.error(f"Error checking image ownership: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch image")
+    if not owned:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+async def _serve(key, tag, content_type, range_header, if_none_match):
+    """Serve a stored object with validators and byte-range support"""
+    headers = {"ETag": tag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers=headers)
+
+    file_path = getattr(image_store.objects, "file_path", None)
+    if file_path is not None:
+        path = file_path(key)
+        try:
+            stat_result = await run_in_threadpool(os.stat, path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Image not found")
+        # Streamed from disk in chunks; Range and If-Range are handled by FileResponse
+        return FileResponse(path, media_type=content_type, headers=headers, stat_result=stat_result)
+
+    # Stores without local files are read into memory, with single-range support
+    size = await run_in_threadpool(image_store.objects.size, key)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        body = await run_in_threadpool(image_store.objects.read, key)
+        return Response(content=body, media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    body = await run_in_threadpool(image_store.objects.read, key, start, end)
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return Response(content=body, status_code=206, media_type=content_type, headers=headers)
+
+@router.get("/{image_hash}")
+async def get_image(
+    image_hash: str,
+    user=Depends(get_current_user),
+    range_header: str | None = Header(None, alias="Range"),
+    if_none_match: str | None = Header(None)
+):
+    """Get the original image of one of the current user's analyses; supports Range requests"""
+    await _authorize(user, image_hash)
+    try:
+        content_type = await run_in_threadpool(image_store.original_content_type, image_hash)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await _serve(
+        image_store.original_key(image_hash), f'"{image_hash}"', content_type, range_header, if_none_match
+    )
+
+@router.get("/{image_hash}/thumbnail")
+async def get_thumbnail(
+    image_hash: str,
+    user=Depends(get_current_user),
+    range_header: str | None = Header(None, alias="Range"),
+    if_none_match: str | None = Header(None)
+):
+    """Get a WebP thumbnail of one of the current user's analysis images"""
+    await _authorize(user, image_hash)
+    try:
+        # Normally generated after the analysis; covers requests that arrive first
+        key = await run_in_threadpool(image_store.ensure_thumbnail, image_hash)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except Exception as e:
+        logger.error(f"Thumbnail generation failed for {image_hash}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to create thumbnail")
+    tag = f'"{image_hash}-{image_store.thumbnail_size}"'
+    return await _serve(key, tag, "image/webp", range_header, if_none_match)
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, ImageOps
+
+from app.config import (
+    IMAGE_STORE_BACKEND,
+    IMAGE_STORE_PATH,
+    IMAGE_THUMBNAIL_SIZE,
+    IMAGE_THUMBNAIL_QUALITY,
+    IMAGE_THUMBNAIL_CONCURRENCY
+)
+
+logger = logging.getLogger(__name__)
+
+# Enough of an original to identify its format, including large EXIF blocks
+SNIFF_BYTES = 64 * 1024
+
+class LocalObjectStore:
+    """Objects as files under a root directory"""
+
+    def __init__(self, root=IMAGE_STORE_PATH):
+        self.root = root
+
+    def file_path(self, key):
+        """Local file holding an object, so it can be streamed from disk"""
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.exists(self.file_path(key))
+
+    def size(self, key):
+        """Object size in bytes, or None if it does not exist"""
+        try:
+            return os.path.getsize(self.file_path(key))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        # Write to a temporary file and rename so readers never see a partial object
+        path = self.file_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def read(self, key, start=0, end=None):
+        """Bytes [start, end) of an object"""
+        with open(self.file_path(key), "rb") as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start)
+
+class InMemoryObjectStore:
+    """In-process stand-in for an object store bucket"""
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def exists(self, key):
+        return key in self._objects
+
+    def size(self, key):
+        data = self._objects.get(key)
+        return None if data is None else len(data)
+
+    def put(self, key, data):
+        with self._lock:
+            self._objects[key] = bytes(data)
+
+    def read(self, key, start=0, end=None):
+        try:
+            return self._objects[key][start:end]
+        except KeyError:
+            raise FileNotFoundError(key)
+
+def sniff_content_type(prefix):
+    """MIME type of an encoded image from its first bytes"""
+    try:
+        with Image.open(io.BytesIO(prefix)) as image:
+            return Image.MIME.get(image.format, "application/octet-stream")
+    except Exception:
+        return "application/octet-stream"
+
+def make_thumbnail(data, size=IMAGE_THUMBNAIL_SIZE, quality=IMAGE_THUMBNAIL_QUALITY):
+    """Upright WebP thumbnail whose longest side is at most size"""
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG decodes straight to a reduced scale, which is most of the work saved
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((size, size))
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=quality)
+    return buffer.getvalue()
+
+class ImageStore:
+    """
+    Content-addressed originals plus WebP thumbnails on top of an object store.
+    Originals are keyed by the SHA-256 of their bytes, so a duplicate upload is stored once.
+    """
+
+    def __init__(
+        self,
+        objects,
+        thumbnail_size=IMAGE_THUMBNAIL_SIZE,
+        thumbnail_quality=IMAGE_THUMBNAIL_QUALITY,
+        concurrency=IMAGE_THUMBNAIL_CONCURRENCY
+    ):
+        self.objects = objects
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._tasks = set()
+
+    @property
+    def enabled(self):
+        return self.objects is not None
+
+    @staticmethod
+    def original_key(image_hash):
+        return f"originals/{image_hash[:2]}/{image_hash}"
+
+    def thumbnail_key(self, image_hash):
+        return f"thumbnails/{image_hash[:2]}/{image_hash}-{self.thumbnail_size}.webp"
+
+    def put_original(self, data):
+        """Store an original unless it is already present; returns its hash"""
+        image_hash = hashlib.sha256(data).hexdigest()
+        key = self.original_key(image_hash)
+        if not self.objects.exists(key):
+            self.objects.put(key, data)
+        return image_hash
+
+    def ensure_thumbnail(self, image_hash):
+        """Generate the thumbnail if it does not exist yet; returns its key"""
+        key = self.thumbnail_key(image_hash)
+        if not self.objects.exists(key):
+            original = self.objects.read(self.original_key(image_hash))
+            self.objects.put(key, make_thumbnail(original, self.thumbnail_size, self.thumbnail_quality))
+        return key
+
+    def original_content_type(self, image_hash):
+        return sniff_content_type(self.objects.read(self.original_key(image_hash), 0, SNIFF_BYTES))
+
+    async def save(self, data):
+        """Store an original and generate its thumbnail in the background; returns the hash or None"""
+        if not self.enabled:
+            return None
+        image_hash = await run_in_threadpool(self.put_original, data)
+        self._schedule_thumbnail(image_hash)
+        return image_hash
+
+    def _schedule_thumbnail(self, image_hash):
+        task = asyncio.create_task(self._generate_thumbnail(image_hash))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _generate_thumbnail(self, image_hash):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                await run_in_threadpool(self.ensure_thumbnail, image_hash)
+            except Exception as e:
+                # Served requests regenerate it on demand
+                logger.warning(f"Thumbnail generation failed for {image_hash}: {str(e)}")
+
+    async def drain(self, timeout=30):
+        """Wait for pending thumbnails on shutdown"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+def create_image_store(backend=IMAGE_STORE_BACKEND):
+    """Create the image store selected by configuration"""
+    if backend == "local":
+        return ImageStore(LocalObjectStore())
+    if backend == "memory":
+        return ImageStore(InMemoryObjectStore())
+    return ImageStore(None)
+
+# Global image store instance
+image_store = create_image_store()
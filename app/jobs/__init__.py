@@ -0,0 +1,4 @@
+from app.jobs.routes import router as jobs_router
+from app.jobs.worker import job_workers
+
+__all__ = ["jobs_router", "job_workers"]
@@ -0,0 +1,269 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from app.config import (
+    JOB_QUEUE_BACKEND,
+    JOB_QUEUE_SQLITE_PATH,
+    JOB_QUEUE_MAX_DEPTH,
+    JOB_MAX_PENDING_PER_USER,
+    JOB_TIMEOUT_SECONDS,
+    JOB_RESULT_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Times a job is handed out before an expired lease fails it instead
+MAX_ATTEMPTS = 2
+
+class JobQueueError(Exception):
+    """Base class for job submission errors"""
+
+class QueueFull(JobQueueError):
+    """Raised when the queue is at its maximum depth"""
+
+class TooManyPendingJobs(JobQueueError):
+    """Raised when a user already has the maximum number of unfinished jobs"""
+
+def new_job(user_id, filename, webhook_url=None):
+    now = time.time()
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "filename": filename,
+        "status": QUEUED,
+        "webhook_url": webhook_url,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now
+    }
+
+class InMemoryJobQueue:
+    """Single-process job queue for local development and tests"""
+
+    def __init__(self, max_depth=JOB_QUEUE_MAX_DEPTH, max_pending_per_user=JOB_MAX_PENDING_PER_USER, result_ttl=JOB_RESULT_TTL_SECONDS):
+        self.max_depth = max_depth
+        self.max_pending_per_user = max_pending_per_user
+        self.result_ttl = result_ttl
+        self._jobs = {}
+        self._payloads = {}
+        self._pending = deque()
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, user_id, filename, payload, webhook_url=None):
+        """Add a job and return it, or raise if the queue or the user is at capacity"""
+        with self._lock:
+            if len(self._pending) >= self.max_depth:
+                raise QueueFull("Analysis queue is full")
+            unfinished = sum(1 for j in self._jobs.values() if j["user_id"] == user_id and j["status"] in (QUEUED, RUNNING))
+            if unfinished >= self.max_pending_per_user:
+                raise TooManyPendingJobs("Too many unfinished analysis jobs")
+            job = new_job(user_id, filename, webhook_url)
+            self._jobs[job["id"]] = job
+            self._payloads[job["id"]] = payload
+            self._pending.append(job["id"])
+            return dict(job)
+
+    def claim(self):
+        """Mark the oldest queued job running and return (job, payload), or None"""
+        with self._lock:
+            if not self._pending:
+                return None
+            job_id = self._pending.popleft()
+            job = self._jobs[job_id]
+            job.update(status=RUNNING, updated_at=time.time())
+            return dict(job), self._payloads.pop(job_id)
+
+    def _finish(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            now = time.time()
+            job.update(updated_at=now, **fields)
+            self._expires[job_id] = now + self.result_ttl
+
+    def complete(self, job_id, result):
+        self._finish(job_id, status=SUCCEEDED, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, status=FAILED, error=error)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def purge(self):
+        """Drop finished jobs past their retention time"""
+        now = time.time()
+        with self._lock:
+            for job_id in [j for j, expires_at in self._expires.items() if expires_at < now]:
+                del self._expires[job_id]
+                self._jobs.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for j in self._jobs.values() if j["status"] == RUNNING)
+            return {"backend": "memory", "queued": len(self._pending), "running": running}
+
+class SQLiteJobQueue:
+    """Job queue shared between processes on one host through a SQLite file"""
+
+    def __init__(
+        self,
+        path=JOB_QUEUE_SQLITE_PATH,
+        max_depth=JOB_QUEUE_MAX_DEPTH,
+        max_pending_per_user=JOB_MAX_PENDING_PER_USER,
+        lease_seconds=JOB_TIMEOUT_SECONDS,
+        result_ttl=JOB_RESULT_TTL_SECONDS
+    ):
+        self.path = path
+        self.max_depth = max_depth
+        self.max_pending_per_user = max_pending_per_user
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, filename TEXT, status TEXT NOT NULL, "
+            "webhook_url TEXT, payload BLOB, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_expires_at REAL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_user_status ON jobs (user_id, status)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # SQLite connections must not be shared with forked server workers
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit mode so claims can take the write lock up front with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    @staticmethod
+    def _to_job(row):
+        return {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "filename": row["filename"],
+            "status": row["status"],
+            "webhook_url": row["webhook_url"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"]
+        }
+
+    def enqueue(self, user_id, filename, payload, webhook_url=None):
+        job = new_job(user_id, filename, webhook_url)
+        conn = self._transaction()
+        try:
+            (depth,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()
+            if depth >= self.max_depth:
+                raise QueueFull("Analysis queue is full")
+            (unfinished,) = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN (?, ?)", (user_id, QUEUED, RUNNING)
+            ).fetchone()
+            if unfinished >= self.max_pending_per_user:
+                raise TooManyPendingJobs("Too many unfinished analysis jobs")
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, filename, status, webhook_url, payload, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], user_id, filename, QUEUED, webhook_url, payload, job["created_at"], job["updated_at"])
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def claim(self):
+        """
+        Lease the oldest runnable job to this worker and return (job, payload), or None.
+        Jobs whose worker died are picked up again once their lease expires.
+        """
+        now = time.time()
+        conn = self._transaction()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = 'Job timed out', payload = NULL, updated_at = ?, expires_at = ? "
+                "WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                (FAILED, now, now + self.result_ttl, RUNNING, now, MAX_ATTEMPTS)
+            )
+            row = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, lease_expires_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_expires_at < ?) "
+                "ORDER BY created_at LIMIT 1) RETURNING *",
+                (RUNNING, now, now + self.lease_seconds, QUEUED, RUNNING, now)
+            ).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return self._to_job(row), row["payload"]
+
+    def _finish(self, job_id, status, result=None, error=None):
+        now = time.time()
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, updated_at = ?, expires_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, now, now + self.result_ttl, job_id)
+        )
+
+    def complete(self, job_id, result):
+        self._finish(job_id, SUCCEEDED, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=error)
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            "SELECT id, user_id, filename, status, webhook_url, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        return self._to_job(row) if row else None
+
+    def purge(self):
+        self._connection().execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),))
+
+    def stats(self):
+        counts = dict(self._connection().execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status", (QUEUED, RUNNING)
+        ).fetchall())
+        return {"backend": "sqlite", "queued": counts.get(QUEUED, 0), "running": counts.get(RUNNING, 0)}
+
+def create_job_queue(kind=JOB_QUEUE_BACKEND):
+    """Create the job queue selected by configuration"""
+    if kind == "sqlite":
+        return SQLiteJobQueue()
+    return InMemoryJobQueue()
+
+# Global job queue instance
+job_queue = create_job_queue()
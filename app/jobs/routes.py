@@ -0,0 +1,80 @@
+import logging
+from datetime import datetime, timezone
+from fastapi import APIRouter, File, Form, UploadFile, Depends, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import JOB_POLL_INTERVAL_SECONDS
+from app.models import JobSubmittedResponse, JobStatusResponse
+from app.auth.dependencies import get_current_user
+from app.analysis.ingest import read_upload
+from app.analysis.pipeline import validate_content_type
+from app.jobs.queue import job_queue, QueueFull, TooManyPendingJobs, QUEUED, RUNNING
+from app.jobs.worker import job_workers
+from app.jobs.webhooks import resolve_webhook, UnsafeWebhookUrl
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/skinprocessing/jobs", tags=["Analysis Jobs"])
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, tz=timezone.utc).isoformat()
+
+@router.post("", status_code=202, response_model=JobSubmittedResponse)
+async def submit_analysis_job(
+    response: Response,
+    file: UploadFile = File(...),
+    webhook_url: str | None = Form(None),
+    user=Depends(get_current_user)
+):
+    """
+    Queue a skin image for analysis and return a job id immediately.
+    Poll the status URL, or pass webhook_url to receive the result by POST when the job finishes.
+    """
+    validate_content_type(file)
+    if webhook_url:
+        try:
+            await resolve_webhook(webhook_url)
+        except UnsafeWebhookUrl as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    image_bytes = await read_upload(file)
+    try:
+        job = await run_in_threadpool(job_queue.enqueue, user.id, file.filename, image_bytes, webhook_url)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except TooManyPendingJobs as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to enqueue analysis job: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to queue analysis")
+
+    job_workers.notify()
+    logger.info(f"Queued analysis job {job['id']} for user: {user.email}, file: {file.filename}")
+
+    status_url = f"{router.prefix}/{job['id']}"
+    response.headers["Location"] = status_url
+    return JobSubmittedResponse(job_id=job["id"], status=job["status"], status_url=status_url)
+
+@router.get("/{job_id}", response_model=JobStatusResponse)
+async def get_analysis_job(job_id: str, response: Response, user=Depends(get_current_user)):
+    """Get the status of an analysis job, including its result once it has succeeded"""
+    try:
+        job = await run_in_threadpool(job_queue.get, job_id)
+    except Exception as e:
+        logger.error(f"Error fetching analysis job: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch analysis job")
+
+    if not job or job["user_id"] != user.id:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+
+    if job["status"] in (QUEUED, RUNNING):
+        response.headers["Retry-After"] = str(max(1, round(JOB_POLL_INTERVAL_SECONDS)))
+
+    return JobStatusResponse(
+        job_id=job["id"],
+        status=job["status"],
+        filename=job["filename"],
+        created_at=_timestamp(job["created_at"]),
+        updated_at=_timestamp(job["updated_at"]),
+        result=job["result"],
+        error=job["error"]
+    )
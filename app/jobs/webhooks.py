@@ -0,0 +1,61 @@
+import asyncio
+import ipaddress
+import socket
+
+import httpx
+
+from app.config import JOB_WEBHOOK_ALLOWED_HOSTS
+
+class UnsafeWebhookUrl(ValueError):
+    """Raised for webhook URLs the worker must not call"""
+
+class WebhookHostUnresolved(UnsafeWebhookUrl):
+    """Raised when a webhook host does not resolve, which may be temporary"""
+
+def host_allowed(host, allowed_hosts=JOB_WEBHOOK_ALLOWED_HOSTS):
+    """Whether a host matches the allowlist; entries are exact hosts or *.domain wildcards"""
+    if not allowed_hosts:
+        return True
+    return any(host == entry or (entry.startswith("*.") and host.endswith(entry[1:])) for entry in allowed_hosts)
+
+def is_public_address(address):
+    """True for globally routable unicast addresses; loopback, private, link-local and the like are not"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+async def resolve_webhook(url, allowed_hosts=JOB_WEBHOOK_ALLOWED_HOSTS):
+    """
+    Check a webhook URL and return the address to deliver to. Every address the host
+    resolves to must be public, so the worker cannot be pointed at internal services.
+    """
+    try:
+        parsed = httpx.URL(url)
+    except Exception:
+        raise UnsafeWebhookUrl("webhook_url is not a valid URL")
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise UnsafeWebhookUrl("webhook_url must be an http(s) URL")
+    host = parsed.host.lower()
+    if not host_allowed(host, allowed_hosts):
+        raise UnsafeWebhookUrl("webhook_url host is not allowed")
+
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise WebhookHostUnresolved("webhook_url host cannot be resolved")
+    addresses = [info[4][0] for info in infos]
+    if not addresses or not all(is_public_address(address) for address in addresses):
+        raise UnsafeWebhookUrl("webhook_url must point to a public address")
+    return addresses[0]
+
+def pinned_request(url, address):
+    """
+    URL, headers and extensions that connect to the checked address while keeping the
+    original host for the Host header and TLS certificate verification, so a DNS change
+    between check and delivery cannot redirect the request
+    """
+    parsed = httpx.URL(url)
+    extensions = {"sni_hostname": parsed.host} if parsed.scheme == "https" else {}
+    return parsed.copy_with(host=address), {"Host": parsed.netloc.decode("ascii")}, extensions
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import signal
+
+import httpx
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import (
+    validate_config,
+    JOB_WORKERS,
+    JOB_TIMEOUT_SECONDS,
+    JOB_POLL_INTERVAL_SECONDS,
+    JOB_WEBHOOK_SECRET,
+    JOB_WEBHOOK_TIMEOUT_SECONDS,
+    JOB_WEBHOOK_RETRIES
+)
+from app.jobs.queue import job_queue, InMemoryJobQueue, SUCCEEDED, FAILED
+from app.jobs.webhooks import resolve_webhook, pinned_request, UnsafeWebhookUrl, WebhookHostUnresolved
+from app.analysis.repository import analysis_repository
+from app.services.ml_models import model_manager
+from app.services.inference import shutdown_executor
+from app.analysis.pipeline import analyze_image, build_analysis_row, build_analysis_response, store_original
+
+logger = logging.getLogger(__name__)
+
+# Seconds between purges of expired finished jobs
+PURGE_INTERVAL_SECONDS = 60
+
+def sign_webhook(body, secret=JOB_WEBHOOK_SECRET):
+    """HMAC-SHA256 signature header value for a webhook body"""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+class JobWorkerPool:
+    """Runs queued analysis jobs with a fixed number of concurrent workers"""
+
+    def __init__(self, queue=job_queue, workers=JOB_WORKERS, timeout=JOB_TIMEOUT_SECONDS, poll_interval=JOB_POLL_INTERVAL_SECONDS):
+        self.queue = queue
+        self.workers = workers
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._purge_task = None
+        self._wakeup = None
+        self._stopping = False
+        self._client = None
+
+    def notify(self):
+        """Wake an idle worker after a job is enqueued in this process"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self.workers <= 0 or self._tasks:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        # Redirects could lead to addresses the webhook check refused
+        self._client = httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT_SECONDS, follow_redirects=False)
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.workers)]
+        self._purge_task = asyncio.create_task(self._purge_expired())
+        logger.info(f"Started {self.workers} analysis job workers")
+
+    async def stop(self, drain_timeout=None):
+        """Stop taking new jobs and wait for running ones, cancelling any left after drain_timeout"""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._purge_task.cancel()
+        done, pending = await asyncio.wait(self._tasks, timeout=drain_timeout or self.timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        await self._client.aclose()
+        self._client = None
+
+    async def _run(self, index):
+        while not self._stopping:
+            try:
+                claimed = await run_in_threadpool(self.queue.claim)
+            except Exception as e:
+                logger.error(f"Job queue claim error: {str(e)}")
+                claimed = None
+
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job, payload = claimed
+            await self.process(job, payload)
+
+    async def _purge_expired(self):
+        while True:
+            try:
+                await run_in_threadpool(self.queue.purge)
+            except Exception as e:
+                logger.warning(f"Job purge error: {str(e)}")
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+
+    async def process(self, job, payload):
+        """Run the analysis pipeline for one job and record its outcome"""
+        job_id = job["id"]
+        logger.info(f"Running analysis job {job_id} for user {job['user_id']}")
+        try:
+            result = await asyncio.wait_for(self._analyze(job, payload), timeout=self.timeout)
+        except HTTPException as e:
+            await self._finish(job, error=e.detail)
+        except asyncio.TimeoutError:
+            await self._finish(job, error="Analysis timed out")
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} failed: {str(e)}")
+            await self._finish(job, error="An error occurred during analysis")
+        else:
+            await self._finish(job, result=result)
+
+    async def _analyze(self, job, payload):
+        features = await analyze_image(payload)
+        row = build_analysis_row(job["user_id"], job["filename"], features)
+        try:
+            saved = await analysis_repository.insert(row)
+        except Exception as e:
+            logger.error(f"Failed to save analysis for job {job['id']}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to save analysis")
+        await store_original(payload)
+        return build_analysis_response(saved["id"], job["filename"], features).model_dump()
+
+    async def _finish(self, job, result=None, error=None):
+        try:
+            if error is None:
+                await run_in_threadpool(self.queue.complete, job["id"], result)
+            else:
+                await run_in_threadpool(self.queue.fail, job["id"], error)
+        except Exception as e:
+            logger.error(f"Failed to record outcome of job {job['id']}: {str(e)}")
+
+        if job.get("webhook_url"):
+            status = SUCCEEDED if error is None else FAILED
+            await self._send_webhook(job["webhook_url"], {"job_id": job["id"], "status": status, "result": result, "error": error})
+
+    async def _send_webhook(self, url, event):
+        """POST the completion event, retrying transient failures; delivery is best effort"""
+        body = json.dumps(event).encode()
+        headers = {"Content-Type": "application/json"}
+        if JOB_WEBHOOK_SECRET:
+            headers["X-SkinIntel-Signature"] = sign_webhook(body)
+
+        for attempt in range(JOB_WEBHOOK_RETRIES + 1):
+            try:
+                # Checked again at delivery: the host may resolve differently than at submission
+                address = await resolve_webhook(url)
+                target, host_header, extensions = pinned_request(url, address)
+                resp = await self._client.post(
+                    target, content=body, headers={**headers, **host_header}, extensions=extensions
+                )
+                if resp.status_code < 500:
+                    if resp.status_code >= 400:
+                        logger.warning(f"Webhook for job {event['job_id']} rejected with {resp.status_code}")
+                    return
+                error = f"status {resp.status_code}"
+            except WebhookHostUnresolved as e:
+                error = str(e)
+            except UnsafeWebhookUrl as e:
+                logger.warning(f"Webhook for job {event['job_id']} refused: {str(e)}")
+                return
+            except httpx.HTTPError as e:
+                error = repr(e)
+            if attempt < JOB_WEBHOOK_RETRIES:
+                await asyncio.sleep(2 ** attempt)
+        logger.warning(f"Webhook for job {event['job_id']} failed: {error}")
+
+# Global worker pool instance
+job_workers = JobWorkerPool()
+
+async def main():
+    """Run a dedicated worker process against a shared (SQLite) queue"""
+    validate_config()
+    if isinstance(job_queue, InMemoryJobQueue):
+        logger.warning("JOB_QUEUE_BACKEND is memory; a separate worker process will never see API jobs")
+
+    await run_in_threadpool(model_manager.initialize)
+    pool = JobWorkerPool(workers=max(JOB_WORKERS, 1))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    pool.start()
+    await stop.wait()
+    logger.info("Draining analysis job workers...")
+    await pool.stop()
+    await analysis_repository.close()
+    shutdown_executor()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -27,3 +27,26 @@ class AnalysisResponse(BaseModel):
     skin_disease_confidence: float | None
     skin_classification_labels: str
     acne_detected: bool
+    # Mean redness per face zone (forehead, cheeks, nose, chin) and fraction of pixels per redness bin
+    region_redness: dict[str, float] | None = None
+    redness_histogram: list[float] | None = None
+    # SHA-256 of the stored original, served from /images/{image_hash}
+    image_hash: str | None = None
+    # Set when a classifier was unavailable; its fields are then empty
+    degraded: bool = False
+    unavailable_models: list[str] = []
+
+# Analysis job models
+class JobSubmittedResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    filename: str | None
+    created_at: str
+    updated_at: str
+    result: AnalysisResponse | None = None
+    error: str | None = None
@@ -0,0 +1,189 @@
+"""
+Production server. With WEB_WORKERS > 1 a pre-fork master loads the app (and, with
+WEB_PRELOAD_MODELS, the models) once, then forks uvicorn workers that share one listening
+socket and the preloaded memory copy-on-write.
+
+    python main.py
+    WEB_WORKERS=4 python -m app.server
+"""
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+from prometheus_client import multiprocess
+
+from app.config import (
+    WEB_HOST,
+    WEB_PORT,
+    WEB_WORKERS,
+    WEB_PRELOAD_MODELS,
+    WEB_DRAIN_SECONDS,
+    MODEL_LAZY_INIT,
+    RATE_LIMIT_BACKEND,
+    RESULT_CACHE_BACKEND,
+    JOB_QUEUE_BACKEND,
+    IDEMPOTENCY_BACKEND,
+    AUTH_REVOCATION_BACKEND,
+    METRICS_MULTIPROCESS,
+    METRICS_MULTIPROC_DIR
+)
+from app.services.ml_models import model_manager
+
+logger = logging.getLogger(__name__)
+
+# Workers that exit sooner than this after starting are restarted with a delay
+MIN_WORKER_UPTIME_SECONDS = 5
+
+def uvicorn_config(app, host=WEB_HOST, port=WEB_PORT):
+    return uvicorn.Config(app, host=host, port=port, timeout_graceful_shutdown=WEB_DRAIN_SECONDS)
+
+def warn_unshared_state(workers):
+    """State kept in process memory is per worker once there is more than one"""
+    if workers <= 1:
+        return
+    if RATE_LIMIT_BACKEND == "memory":
+        logger.warning(f"RATE_LIMIT_BACKEND is memory; effective rate limits are {workers}x the configured ones")
+    if JOB_QUEUE_BACKEND == "memory":
+        logger.warning("JOB_QUEUE_BACKEND is memory; jobs are only visible to the worker that accepted them")
+    if RESULT_CACHE_BACKEND == "memory":
+        logger.info("RESULT_CACHE_BACKEND is memory; each worker keeps its own result cache")
+    if IDEMPOTENCY_BACKEND == "memory":
+        logger.warning("IDEMPOTENCY_BACKEND is memory; retries routed to another worker are analyzed again")
+    if AUTH_REVOCATION_BACKEND == "memory":
+        logger.warning("AUTH_REVOCATION_BACKEND is memory; logged-out tokens stay valid on other workers until they expire")
+
+def reset_metrics_dir(path=METRICS_MULTIPROC_DIR):
+    """Remove metric files left by earlier runs, which would otherwise be added to this one's"""
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+
+class PreforkServer:
+    """Forks uvicorn workers on a shared socket, restarts ones that die and drains them on shutdown"""
+
+    def __init__(self, app, workers=WEB_WORKERS, host=WEB_HOST, port=WEB_PORT, drain_seconds=WEB_DRAIN_SECONDS):
+        self.app = app
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.drain_seconds = drain_seconds
+        self.children = {}
+        self.stopping = False
+        self.sock = None
+
+    def bind(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def preload(self):
+        """Load models once in the master; workers then find them already initialized"""
+        if WEB_PRELOAD_MODELS and not MODEL_LAZY_INIT:
+            model_manager.initialize()
+        # Keep the garbage collector from touching (and so copying) preloaded objects in workers
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (index, time.monotonic())
+            return
+
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # uvicorn installs its own SIGTERM/SIGINT handlers: stop accepting, finish
+            # in-flight requests for up to WEB_DRAIN_SECONDS, then run lifespan shutdown
+            uvicorn.Server(uvicorn_config(self.app, self.host, self.port)).run(sockets=[self.sock])
+        except BaseException:
+            logger.exception(f"Worker {index} crashed")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        warn_unshared_state(self.workers)
+        self.sock = self.bind()
+        self.preload()
+        if METRICS_MULTIPROCESS:
+            reset_metrics_dir()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        logger.info(f"Starting {self.workers} workers on {self.host}:{self.port}")
+        for index in range(self.workers):
+            self.spawn(index)
+
+        try:
+            while not self.stopping:
+                self.reap_and_respawn()
+                time.sleep(0.5)
+        finally:
+            self.shutdown()
+            self.sock.close()
+
+    def reap_and_respawn(self):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            index, started = self.children.pop(pid)
+            if METRICS_MULTIPROCESS:
+                # Drop the dead worker's in-flight gauges; its counters and histograms still count
+                multiprocess.mark_process_dead(pid)
+            if self.stopping:
+                continue
+            logger.warning(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+            if time.monotonic() - started < MIN_WORKER_UPTIME_SECONDS:
+                time.sleep(1)
+            self.spawn(index)
+
+    def shutdown(self):
+        """Ask every worker to drain, then kill any still running after the drain period"""
+        logger.info(f"Draining {len(self.children)} workers...")
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.drain_seconds + 5
+        while self.children and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in list(self.children):
+            logger.warning(f"Worker pid {pid} did not drain in time; killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.children.pop(pid)
+
+def serve(app, workers=WEB_WORKERS):
+    """Run a single uvicorn process, or the pre-fork server when workers > 1"""
+    if workers <= 1:
+        uvicorn.Server(uvicorn_config(app)).run()
+    else:
+        PreforkServer(app, workers=workers).run()
+
+if __name__ == "__main__":
+    from main import app
+    serve(app)
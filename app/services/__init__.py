@@ -1,15 +1,28 @@
 from app.services.ml_models import ModelManager
+from app.services.backends import RoboflowBackend, OnnxBackend
 from app.services.image_processing import (
+    EncodedImageSet,
+    encode_image,
     run_model,
     crop_center_patch,
     compute_redness,
     compute_global_redness
 )
+from app.services.features import extract_acne_features
+from app.services.image_stats import redness_stats
+from app.services.inference import run_model_async
 
 __all__ = [
     "ModelManager",
+    "RoboflowBackend",
+    "OnnxBackend",
+    "EncodedImageSet",
+    "encode_image",
     "run_model",
     "crop_center_patch",
     "compute_redness",
-    "compute_global_redness"
+    "compute_global_redness",
+    "extract_acne_features",
+    "redness_stats",
+    "run_model_async"
 ]
@@ -0,0 +1,359 @@
+import ast
+import base64
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config import (
+    ROBOFLOW_API_KEY,
+    ROBOFLOW_INFERENCE_URL,
+    INFERENCE_MAX_WORKERS,
+    MODEL_TIMEOUT_SECONDS,
+    ACNE_TILE_SIZE,
+    ACNE_TILE_OVERLAP,
+    ACNE_TILE_MERGE_THRESHOLD,
+    ACNE_TILE_MAX_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+# Shared keep-alive session for hosted inference calls
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_maxsize=INFERENCE_MAX_WORKERS + ACNE_TILE_MAX_WORKERS))
+_session.mount("http://", HTTPAdapter(pool_maxsize=INFERENCE_MAX_WORKERS + ACNE_TILE_MAX_WORKERS))
+
+# Tile calls run here rather than in the inference executor, whose threads wait on them
+_tile_executor = ThreadPoolExecutor(max_workers=ACNE_TILE_MAX_WORKERS, thread_name_prefix="tile")
+
+def non_max_suppression(boxes, scores, iou_threshold, by_smaller=False):
+    """
+    Return indices of boxes kept by greedy NMS; boxes are (N, 4) x1, y1, x2, y2.
+    With by_smaller, overlap is measured against the smaller box instead of the union,
+    so a box mostly contained in a better one is suppressed too.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        inter_h = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = inter_w * inter_h
+        if by_smaller:
+            iou = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+        else:
+            iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+
+    return np.asarray(keep, dtype=np.int64)
+
+class RoboflowBackend:
+    """Hosted Roboflow model called over HTTPS"""
+
+    def __init__(self, model, task_type):
+        self.model = model
+        self.task_type = task_type
+        self.dataset_id = model.dataset_id
+        self.version = str(model.version)
+        self.preprocessing = getattr(model, "preprocessing", None) or {}
+        self.identity = f"{self.dataset_id}/{self.version}"
+
+    @classmethod
+    def from_metadata(cls, metadata, task_type):
+        """Build from cached metadata() without resolving the SDK model"""
+        return cls(SimpleNamespace(**metadata), task_type)
+
+    def metadata(self):
+        """Everything needed to call the hosted model, as JSON-serializable data"""
+        return {"dataset_id": self.dataset_id, "version": self.version, "preprocessing": self.preprocessing}
+
+    def _post(self, payload, params=""):
+        """Send base64 encoded image bytes to the hosted model endpoint"""
+        url = f"{ROBOFLOW_INFERENCE_URL}/{self.dataset_id}/{self.version}?api_key={ROBOFLOW_API_KEY}&name=YOUR_IMAGE.jpg{params}"
+        resp = _session.post(
+            url,
+            data=base64.b64encode(payload).decode("ascii"),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=MODEL_TIMEOUT_SECONDS
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def _stretch_size(self):
+        """Return the model's stretch-resize dimensions, if any"""
+        resize = self.preprocessing.get("resize")
+        if resize and "Stretch" in resize.get("format", ""):
+            return int(resize["width"]), int(resize["height"])
+        return None
+
+    def infer(self, images, patch_size=None, size=None):
+        """Run the hosted model on an EncodedImageSet and return Roboflow-shaped JSON"""
+        image = images.prepare(patch_size, size)
+        width, height = image.size
+        image_dims = {"width": str(width), "height": str(height)}
+
+        if self.task_type != "detection":
+            response = self._post(images.get(patch_size, size))
+            return {"predictions": [response], "image": image_dims}
+
+        # Downscale to the model's input size before upload and map boxes back
+        stretch = self._stretch_size()
+        if stretch and (width > stretch[0] or height > stretch[1]):
+            size = stretch
+        else:
+            stretch = None
+
+        response = self._post(
+            images.get(patch_size, size),
+            "&overlap=0.5&confidence=0.3&stroke=1&labels=false&format=json"
+        )
+
+        predictions = response.get("predictions", [])
+        if stretch:
+            scale_x, scale_y = width / stretch[0], height / stretch[1]
+            for p in predictions:
+                p["x"] = int(p["x"] * scale_x)
+                p["y"] = int(p["y"] * scale_y)
+                p["width"] = int(p["width"] * scale_x)
+                p["height"] = int(p["height"] * scale_y)
+
+        return {"predictions": predictions, "image": image_dims}
+
+class OnnxBackend:
+    """Local CPU model loaded from exported ONNX weights
+
+    An optional sidecar JSON next to the weights (``model.onnx.json``) may set
+    ``classes``, ``version``, ``input_size`` and ``mean``/``std`` normalization.
+    """
+
+    def __init__(self, path, task_type, confidence=0.3, overlap=0.5):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("onnxruntime is required for the onnx model backend: pip install onnxruntime")
+
+        self.path = path
+        self.task_type = task_type
+        self.confidence = confidence
+        self.overlap = overlap
+
+        self.mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            weights = f.read()
+        self.checksum = hashlib.sha256(weights).hexdigest()
+
+        self.session = onnxruntime.InferenceSession(weights, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.max_batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+        meta = self._load_sidecar(path)
+        self.classes = meta.get("classes") or self._metadata_classes()
+        self.version = str(meta.get("version", self.checksum[:12]))
+        self.identity = f"onnx:{os.path.basename(path)}/{meta.get('version', 'local')}@{self.checksum[:12]}"
+
+        height, width = model_input.shape[2], model_input.shape[3]
+        input_size = meta.get("input_size")
+        if not isinstance(height, int) or not isinstance(width, int):
+            height = width = int(input_size or 640)
+        self.input_shape = (width, height)
+
+        self.mean = np.asarray(meta["mean"], dtype=np.float32).reshape(1, 3, 1, 1) if "mean" in meta else None
+        self.std = np.asarray(meta["std"], dtype=np.float32).reshape(1, 3, 1, 1) if "std" in meta else None
+
+    @staticmethod
+    def _load_sidecar(path):
+        sidecar = f"{path}.json"
+        if not os.path.exists(sidecar):
+            return {}
+        with open(sidecar) as f:
+            return json.load(f)
+
+    def _metadata_classes(self):
+        """Read class names embedded in the ONNX metadata by YOLO-style exporters"""
+        names = self.session.get_modelmeta().custom_metadata_map.get("names")
+        if not names:
+            return []
+        try:
+            parsed = ast.literal_eval(names)
+        except (ValueError, SyntaxError):
+            return []
+        if isinstance(parsed, dict):
+            return [parsed[k] for k in sorted(parsed, key=int)]
+        return list(parsed)
+
+    def _class_name(self, class_id):
+        return self.classes[class_id] if class_id < len(self.classes) else str(class_id)
+
+    def _to_tensor(self, images):
+        """Stack PIL images into a normalized NCHW float32 batch"""
+        batch = np.stack([
+            np.asarray(image.resize(self.input_shape), dtype=np.float32) for image in images
+        ]).transpose(0, 3, 1, 2) / 255.0
+        if self.mean is not None:
+            batch = (batch - self.mean) / self.std
+        return batch
+
+    def _decode_detection(self, output, width, height):
+        """Decode one YOLO-style (4 + num_classes, N) output into Roboflow predictions"""
+        channels = 4 + len(self.classes) if self.classes else min(output.shape)
+        output = output.T if output.shape[0] == channels else output
+        class_scores = output[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+
+        mask = scores >= self.confidence
+        boxes, scores, class_ids = output[mask, :4], scores[mask], class_ids[mask]
+
+        # Scale from model input space to the submitted image
+        scale = np.array([width / self.input_shape[0], height / self.input_shape[1]] * 2, dtype=np.float32)
+        boxes = boxes * scale
+        corners = np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+        keep = non_max_suppression(corners, scores, self.overlap)
+
+        return [
+            {
+                "x": float(boxes[i, 0]),
+                "y": float(boxes[i, 1]),
+                "width": float(boxes[i, 2]),
+                "height": float(boxes[i, 3]),
+                "confidence": float(scores[i]),
+                "class": self._class_name(int(class_ids[i])),
+                "class_id": int(class_ids[i])
+            }
+            for i in keep
+        ]
+
+    def _decode_classification(self, logits):
+        """Turn one row of logits or probabilities into a Roboflow classification response"""
+        probs = logits.astype(np.float64)
+        if probs.min() < 0 or not np.isclose(probs.sum(), 1.0, atol=1e-3):
+            probs = np.exp(probs - probs.max())
+            probs /= probs.sum()
+
+        order = np.argsort(-probs)
+        predictions = [
+            {"class": self._class_name(int(i)), "class_id": int(i), "confidence": float(probs[i])}
+            for i in order
+        ]
+        return {"predictions": predictions, "top": predictions[0]["class"], "confidence": predictions[0]["confidence"]}
+
+    def infer_batch(self, images_list, patch_size=None, size=None):
+        """Run the local model on several EncodedImageSets in one session call"""
+        prepared = [images.prepare(patch_size, size) for images in images_list]
+        step = self.max_batch_size or len(prepared)
+        outputs = np.concatenate([
+            self.session.run(None, {self.input_name: self._to_tensor(prepared[i:i + step])})[0]
+            for i in range(0, len(prepared), step)
+        ])
+
+        results = []
+        for image, output in zip(prepared, outputs):
+            width, height = image.size
+            image_dims = {"width": str(width), "height": str(height)}
+            if self.task_type == "detection":
+                results.append({"predictions": self._decode_detection(output, width, height), "image": image_dims})
+            else:
+                results.append({"predictions": [self._decode_classification(output.reshape(-1))], "image": image_dims})
+        return results
+
+    def infer(self, images, patch_size=None, size=None):
+        """Run the local model on an EncodedImageSet and return Roboflow-shaped JSON"""
+        return self.infer_batch([images], patch_size, size)[0]
+
+def tile_origins(length, tile, overlap):
+    """Start offsets covering [0, length) with tiles of the given size and overlap fraction"""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    origins = list(range(0, length - tile, stride))
+    return origins + [length - tile]
+
+class TiledDetectionBackend:
+    """
+    Runs a detection backend on overlapping tiles of the full image and merges the boxes,
+    so small lesions are not lost to the model's input downscaling
+    """
+
+    def __init__(self, model, tile_size=ACNE_TILE_SIZE, overlap=ACNE_TILE_OVERLAP, merge_threshold=ACNE_TILE_MERGE_THRESHOLD):
+        self.model = model
+        self.task_type = model.task_type
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.merge_threshold = merge_threshold
+        self.identity = f"{model.identity}@tiles{tile_size}/{overlap:g}"
+
+    def tiles(self, width, height):
+        """(left, upper, right, lower) boxes of every tile"""
+        return [
+            (x, y, min(x + self.tile_size, width), min(y + self.tile_size, height))
+            for y in tile_origins(height, self.tile_size, self.overlap)
+            for x in tile_origins(width, self.tile_size, self.overlap)
+        ]
+
+    def infer(self, images, patch_size=None, size=None):
+        """Run the wrapped model on every tile in parallel and return merged Roboflow-shaped JSON"""
+        from app.services.image_processing import EncodedImageSet
+
+        image = images.prepare(patch_size, size)
+        width, height = image.size
+        tiles = self.tiles(width, height)
+        if len(tiles) == 1:
+            return self.model.infer(images, patch_size, size)
+
+        tile_images = [EncodedImageSet(image.crop(box), images.format, images.quality) for box in tiles]
+        if hasattr(self.model, "infer_batch"):
+            results = self.model.infer_batch(tile_images)
+        else:
+            results = list(_tile_executor.map(self.model.infer, tile_images))
+
+        predictions = self.merge(tiles, [result.get("predictions", []) for result in results], width, height)
+        return {"predictions": predictions, "image": {"width": str(width), "height": str(height)}}
+
+    def merge(self, tiles, tile_predictions, width, height, edge_margin=2):
+        """Map tile boxes to image coordinates and drop duplicates from overlapping tiles"""
+        flat = [(box, p) for box, predictions in zip(tiles, tile_predictions) for p in predictions]
+        if not flat:
+            return []
+
+        origins = np.array([box[:2] for box, _ in flat], dtype=np.float64)
+        extents = np.array([box[2:] for box, _ in flat], dtype=np.float64)
+        centers = np.array([(p["x"], p["y"]) for _, p in flat], dtype=np.float64) + origins
+        sizes = np.array([(p["width"], p["height"]) for _, p in flat], dtype=np.float64)
+        corners = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+        scores = np.array([p.get("confidence", 0.0) for _, p in flat], dtype=np.float64)
+
+        # A box touching a tile edge inside the image is likely cut off; prefer complete boxes
+        # from the neighbouring tile by ranking them above every truncated one
+        cut = (
+            ((corners[:, 0] <= origins[:, 0] + edge_margin) & (origins[:, 0] > 0))
+            | ((corners[:, 1] <= origins[:, 1] + edge_margin) & (origins[:, 1] > 0))
+            | ((corners[:, 2] >= extents[:, 0] - edge_margin) & (extents[:, 0] < width))
+            | ((corners[:, 3] >= extents[:, 1] - edge_margin) & (extents[:, 1] < height))
+        )
+        priority = scores + (~cut)
+
+        # Class-aware suppression in one pass: shift each class to its own region of the plane
+        classes = {name: i for i, name in enumerate(sorted({str(p.get("class")) for _, p in flat}))}
+        offsets = np.array([classes[str(p.get("class"))] for _, p in flat], dtype=np.float64) * (max(width, height) + 1)
+        keep = non_max_suppression(corners + offsets[:, None], priority, self.merge_threshold, by_smaller=True)
+
+        merged = []
+        for i in keep:
+            prediction = dict(flat[i][1])
+            prediction["x"], prediction["y"] = float(centers[i, 0]), float(centers[i, 1])
+            merged.append(prediction)
+        return merged
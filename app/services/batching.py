@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from collections import deque
+from functools import partial
+
+from app.config import INFERENCE_BATCHING_ENABLED, INFERENCE_BATCH_MAX_SIZE, INFERENCE_BATCH_MAX_WAIT_MS
+from app.services.image_processing import run_model_batch
+from app.services.metrics import observe_batch
+
+logger = logging.getLogger(__name__)
+
+class _ModelQueue:
+    """Calls waiting for one model with one set of input parameters"""
+
+    def __init__(self, model, name, params, max_batch_size):
+        self.model = model
+        self.name = name
+        self.params = params
+        self.max_batch_size = max_batch_size
+        self.pending = deque()
+        self.running = 0
+        self.timer = None
+
+class BatchScheduler:
+    """
+    Adaptive micro-batching of model calls across concurrent requests.
+    A call to an idle model is sent on the next event loop iteration, together with any calls
+    for the same model made in that iteration. While a batch is running, new calls queue and are
+    sent as one batch when it finishes, when max_batch_size calls are waiting, or after max_wait,
+    whichever comes first. Batches grow with load without delaying calls to an idle model.
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_batch_size=INFERENCE_BATCH_MAX_SIZE,
+        max_wait=INFERENCE_BATCH_MAX_WAIT_MS / 1000,
+        enabled=INFERENCE_BATCHING_ENABLED
+    ):
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._queues = {}
+        self._counts = {}
+
+    def can_batch(self, model):
+        """Whether calls to model go through the scheduler rather than running one by one"""
+        if not self.enabled or self.max_batch_size < 2 or not hasattr(model, "infer_batch"):
+            return False
+        # Models exported with a fixed batch dimension of 1 gain nothing from batching
+        return getattr(model, "max_batch_size", None) != 1
+
+    def submit(self, model, images, input_size=None, task_type="detection", patch_size=None, name=None):
+        """Queue one call; returns a future resolving to the same result run_model would return"""
+        loop = asyncio.get_running_loop()
+        params = (input_size, task_type, patch_size)
+        key = (id(model), params)
+        queue = self._queues.get(key)
+        if queue is None:
+            limit = min(self.max_batch_size, getattr(model, "max_batch_size", None) or self.max_batch_size)
+            queue = self._queues[key] = _ModelQueue(model, name or model.identity, params, limit)
+
+        future = loop.create_future()
+        queue.pending.append((images, future))
+        if len(queue.pending) >= queue.max_batch_size:
+            self._dispatch(key)
+        elif queue.timer is None:
+            queue.timer = loop.call_later(self.max_wait if queue.running else 0, self._dispatch, key)
+        return future
+
+    def _dispatch(self, key):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+
+        batch = []
+        while queue.pending and len(batch) < queue.max_batch_size:
+            images, future = queue.pending.popleft()
+            # Calls given up on by a timeout are dropped
+            if not future.done():
+                batch.append((images, future))
+        if queue.pending:
+            queue.timer = asyncio.get_running_loop().call_later(self.max_wait, self._dispatch, key)
+        if not batch:
+            self._release(key, queue)
+            return
+
+        queue.running += 1
+        counts = self._counts.setdefault(queue.name, {"batches": 0, "calls": 0, "largest_batch": 0})
+        counts["batches"] += 1
+        counts["calls"] += len(batch)
+        counts["largest_batch"] = max(counts["largest_batch"], len(batch))
+        observe_batch(queue.name, len(batch))
+
+        input_size, task_type, patch_size = queue.params
+        call = partial(
+            run_model_batch,
+            queue.model,
+            [images for images, _ in batch],
+            input_size=input_size,
+            task_type=task_type,
+            patch_size=patch_size
+        )
+        run = asyncio.get_running_loop().run_in_executor(self.executor, call)
+        run.add_done_callback(partial(self._complete, key, queue, batch))
+
+    def _complete(self, key, queue, batch, run):
+        queue.running -= 1
+        try:
+            results = run.result()
+        except BaseException as e:
+            logger.error(f"Model batch error: {str(e)}")
+            results = [{"error": str(e)}] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+        # Calls that queued while this batch ran go out together now
+        if queue.pending:
+            self._dispatch(key)
+        else:
+            self._release(key, queue)
+
+    def _release(self, key, queue):
+        # Idle queues are dropped so replaced models are not kept alive
+        if not queue.pending and not queue.running and self._queues.get(key) is queue:
+            del self._queues[key]
+
+    def stats(self):
+        models = {
+            name: {**counts, "mean_batch_size": round(counts["calls"] / counts["batches"], 2), "queue_depth": 0}
+            for name, counts in self._counts.items()
+        }
+        for queue in self._queues.values():
+            entry = models.get(queue.name)
+            if entry is not None:
+                entry["queue_depth"] += len(queue.pending)
+        return {
+            "enabled": self.enabled,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": sum(len(queue.pending) for queue in self._queues.values()),
+            "running": sum(queue.running for queue in self._queues.values()),
+            "models": models
+        }
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import (
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_BACKEND,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_SQLITE_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+class MemoryCacheBackend:
+    """In-process LRU cache with TTL and entry/byte limits"""
+
+    def __init__(self, ttl=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+class SQLiteCacheBackend:
+    """Cache shared between processes on one host through a SQLite file"""
+
+    def __init__(self, path=RESULT_CACHE_SQLITE_PATH, ttl=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # SQLite connections must not be shared with forked server workers
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now)
+            )
+            conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM results")
+
+    def stats(self):
+        with self._connection() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM results").fetchone()
+        return {"entries": entries, "bytes": size}
+
+class ResultCache:
+    """Two-tier inference result cache: in-process LRU backed by an optional shared store"""
+
+    def __init__(self, local, shared=None, enabled=True):
+        self.local = local
+        self.shared = shared
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached result for key or None"""
+        if not self.enabled:
+            return None
+
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logger.warning(f"Shared cache read error: {str(e)}")
+            if value is not None:
+                self.local.set(key, value)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, result):
+        """Store result under key in every tier"""
+        if not self.enabled:
+            return
+
+        value = json.dumps(result, separators=(",", ":")).encode()
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                logger.warning(f"Shared cache write error: {str(e)}")
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "enabled": self.enabled,
+            "backend": "memory+sqlite" if self.shared is not None else "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0,
+            "local": self.local.stats()
+        }
+        if self.shared is not None:
+            try:
+                stats["shared"] = self.shared.stats()
+            except Exception as e:
+                stats["shared"] = {"error": str(e)}
+        return stats
+
+def make_cache_key(image_hash, model_identity, task_type, patch_size=None, size=None, encoding=None):
+    """Build a cache key from the pixel hash, model identity and input parameters"""
+    size = "x".join(str(s) for s in size) if size else "-"
+    return f"{task_type}:{model_identity}:{patch_size or '-'}:{size}:{encoding or '-'}:{image_hash}"
+
+def create_result_cache():
+    """Create the result cache configured through environment variables"""
+    shared = SQLiteCacheBackend() if RESULT_CACHE_BACKEND == "sqlite" else None
+    return ResultCache(MemoryCacheBackend(), shared=shared, enabled=RESULT_CACHE_ENABLED)
+
+# Global result cache instance
+result_cache = create_result_cache()
@@ -0,0 +1,119 @@
+import numpy as np
+
+LESION_TYPES = ("papule", "pustule", "comedone", "nodule")
+
+# Fixed per-box cost of direct slicing, expressed in pixels of summed-area table work
+BOX_OVERHEAD_PIXELS = 4096
+
+def redness_map(arr, out=None):
+    """Per-pixel doubled redness 2R - G - B as int16, computed without float channel copies"""
+    if out is None:
+        out = np.empty(arr.shape[:2], dtype=np.int16)
+    np.multiply(arr[:, :, 0], 2, out=out, dtype=np.int16)
+    np.subtract(out, arr[:, :, 1], out=out, dtype=np.int16)
+    np.subtract(out, arr[:, :, 2], out=out, dtype=np.int16)
+    return out
+
+def integral_image(values):
+    """Summed-area table with a zero row and column so box sums need no bounds checks"""
+    table = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.int64)
+    inner = values.astype(np.int64)
+    np.cumsum(inner, axis=1, out=inner)
+    np.cumsum(inner, axis=0, out=inner)
+    table[1:, 1:] = inner
+    return table
+
+def box_bounds(predictions, width, height):
+    """Convert center/size predictions into clamped integer pixel bounds"""
+    coords = np.array(
+        [[float(p["x"]), float(p["y"]), float(p["width"]), float(p["height"])] for p in predictions],
+        dtype=np.float64
+    ).reshape(-1, 4)
+    x, y, w, h = coords.T
+    left = np.clip(np.trunc(x - w / 2), 0, width).astype(np.int64)
+    upper = np.clip(np.trunc(y - h / 2), 0, height).astype(np.int64)
+    right = np.minimum(width, np.trunc(x + w / 2)).astype(np.int64)
+    lower = np.minimum(height, np.trunc(y + h / 2)).astype(np.int64)
+    return coords, left, upper, right, lower
+
+def box_mean_redness(arr, left, upper, right, lower):
+    """Mean redness of every box, clipped at zero and scaled to 0-1, in O(1) per box"""
+    count = len(left)
+    if count == 0:
+        return np.zeros(0)
+
+    # Empty boxes (outside the frame or zero size) have no redness
+    right = np.maximum(right, left)
+    lower = np.maximum(lower, upper)
+    areas = (right - left) * (lower - upper)
+
+    # Only the region covered by lesions needs a summed-area table
+    x0, y0 = int(left.min()), int(upper.min())
+    x1, y1 = max(int(right.max()), x0), max(int(lower.max()), y0)
+
+    # The table pays off once boxes cover or overlap most of that region;
+    # sparse lesions are cheaper to sum directly from the shared array
+    if int(areas.sum()) + count * BOX_OVERHEAD_PIXELS >= (x1 - x0) * (y1 - y0):
+        table = integral_image(redness_map(arr[y0:y1, x0:x1]))
+        l, u, r, b = left - x0, upper - y0, right - x0, lower - y0
+        sums = table[b, r] - table[u, r] - table[b, l] + table[u, l]
+    else:
+        channel_sums = np.array([
+            arr[u:b, l:r].sum(axis=(0, 1), dtype=np.int64)
+            for l, u, r, b in zip(left, upper, right, lower)
+        ]).reshape(-1, 3)
+        sums = 2 * channel_sums[:, 0] - channel_sums[:, 1] - channel_sums[:, 2]
+
+    means = np.divide(sums, 2 * areas, out=np.zeros(count), where=areas > 0)
+    return np.maximum(0, means) / 255
+
+def lesion_type_counts(predictions):
+    """Count lesions per type; unmatched classes are counted as comedones"""
+    classes = np.char.lower(np.array([str(p.get("class", "")) for p in predictions], dtype=str))
+    remaining = np.ones(len(classes), dtype=bool)
+    counts = {}
+    for lesion_type in LESION_TYPES:
+        matched = remaining & (np.char.find(classes, lesion_type) >= 0)
+        counts[lesion_type] = int(matched.sum())
+        remaining &= ~matched
+    counts["comedone"] += int(remaining.sum())
+    return counts
+
+def extract_acne_features(image, predictions, scale=(1.0, 1.0), lesion_redness=None):
+    """
+    Aggregate lesion dimensions, redness and type counts from acne predictions.
+    Predictions are in the image's pixels; scale maps dimensions back to the original frame.
+    lesion_redness, when already computed (see image_stats.redness_stats), skips the pixel pass.
+    """
+    acne_count = len(predictions)
+    if not acne_count:
+        return {
+            "acne_count": 0,
+            "avg_acne_width": 0,
+            "avg_acne_height": 0,
+            "avg_acne_area": 0,
+            "avg_redness": 0,
+            "papules_count": 0,
+            "pustules_count": 0,
+            "comedone_count": 0,
+            "nodules_count": 0
+        }
+
+    arr = image if isinstance(image, np.ndarray) else np.asarray(image)
+    height, width = arr.shape[:2]
+    coords, left, upper, right, lower = box_bounds(predictions, width, height)
+    redness = lesion_redness if lesion_redness is not None else box_mean_redness(arr, left, upper, right, lower)
+    counts = lesion_type_counts(predictions)
+    widths, heights = coords[:, 2] * scale[0], coords[:, 3] * scale[1]
+
+    return {
+        "acne_count": acne_count,
+        "avg_acne_width": float(widths.sum()) / acne_count,
+        "avg_acne_height": float(heights.sum()) / acne_count,
+        "avg_acne_area": float((widths * heights).sum()) / acne_count,
+        "avg_redness": float(redness.sum()) / acne_count,
+        "papules_count": counts["papule"],
+        "pustules_count": counts["pustule"],
+        "comedone_count": counts["comedone"],
+        "nodules_count": counts["nodule"]
+    }
@@ -1,26 +1,139 @@
+import hashlib
+import io
 import logging
-import tempfile
-import numpy as np
+import threading
+
+from app.config import IMAGE_ENCODE_FORMAT, IMAGE_ENCODE_QUALITY
+from app.services.cache import result_cache, make_cache_key
+from app.services.image_stats import mean_redness
 
 logger = logging.getLogger(__name__)
 
-def run_model(model, image, input_size=None, task_type="detection"):
-    """Run ML model on image with optional resizing"""
-    if input_size:
-        image = image.resize((input_size, input_size))
+def encode_image(image, format=IMAGE_ENCODE_FORMAT, quality=IMAGE_ENCODE_QUALITY):
+    """Encode image into an in-memory buffer and return its bytes"""
+    buffer = io.BytesIO()
+    if format.upper() == "PNG":
+        image.save(buffer, format="PNG")
+    else:
+        image.save(buffer, format=format, quality=quality)
+    return buffer.getvalue()
+
+class EncodedImageSet:
+    """Model inputs derived from one source image, cropped, resized and encoded once per parameter set"""
+
+    def __init__(self, image, format=IMAGE_ENCODE_FORMAT, quality=IMAGE_ENCODE_QUALITY):
+        self.image = image
+        self.format = format
+        self.quality = quality
+        self._buffers = {}
+        self._images = {}
+        self._pixel_hash = None
+        self._lock = threading.Lock()
+
+    @property
+    def pixel_hash(self):
+        """SHA-256 of the decoded pixels, independent of the upload's container format"""
+        if self._pixel_hash is None:
+            digest = hashlib.sha256(f"{self.image.mode}:{self.image.size}".encode())
+            digest.update(self.image.tobytes())
+            self._pixel_hash = digest.hexdigest()
+        return self._pixel_hash
+
+    def prepare(self, patch_size=None, size=None):
+        """Return the cropped and resized image for the given parameters, reusing earlier ones"""
+        size = tuple(size) if size else None
+        key = (patch_size, size)
+        with self._lock:
+            if key in self._images:
+                return self._images[key]
+
+        if size:
+            # Every size of one crop is resized from the same cached crop
+            image = self.prepare(patch_size)
+            if image.size != size:
+                image = image.resize(size)
+        elif patch_size:
+            image = crop_center_patch(self.image, patch_size)
+        else:
+            return self.image
+        with self._lock:
+            return self._images.setdefault(key, image)
+
+    def get(self, patch_size=None, size=None):
+        """Return encoded bytes for the given parameters, reusing earlier buffers"""
+        key = (patch_size, tuple(size) if size else None)
+        with self._lock:
+            if key in self._buffers:
+                return self._buffers[key]
+
+        data = encode_image(self.prepare(patch_size, size), self.format, self.quality)
+        with self._lock:
+            return self._buffers.setdefault(key, data)
 
-    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=True) as tmp_file:
-        image.save(tmp_file, format="JPEG", quality=95)
-        tmp_file.flush()
+def _result_cache_key(model, images, task_type, patch_size, size):
+    if not result_cache.enabled:
+        return None
+    return make_cache_key(
+        images.pixel_hash,
+        model.identity,
+        task_type,
+        patch_size,
+        size,
+        f"{images.format}{images.quality}"
+    )
+
+def run_model(model, image, input_size=None, task_type="detection", patch_size=None):
+    """Run ML model on image with optional center crop and resizing"""
+    images = image if isinstance(image, EncodedImageSet) else EncodedImageSet(image)
+    size = (input_size, input_size) if input_size else None
+
+    cache_key = _result_cache_key(model, images, task_type, patch_size, size)
+    if cache_key:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    try:
+        result = model.infer(images, patch_size=patch_size, size=size)
+    except Exception as e:
+        logger.error(f"Model prediction error: {str(e)}")
+        return {"error": str(e)}
+
+    if cache_key:
+        result_cache.set(cache_key, result)
+    return result
+
+def run_model_batch(model, images_list, input_size=None, task_type="detection", patch_size=None):
+    """
+    Run a batch-capable model on several images in one call, returning results in input order.
+    Cached results are reused per image; if the batch call fails, each image is retried alone
+    so one bad input does not fail the others.
+    """
+    images_list = [i if isinstance(i, EncodedImageSet) else EncodedImageSet(i) for i in images_list]
+    size = (input_size, input_size) if input_size else None
+
+    keys = [_result_cache_key(model, images, task_type, patch_size, size) for images in images_list]
+    results = [result_cache.get(key) if key else None for key in keys]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+
+    if len(misses) == 1:
+        outputs = [run_model(model, images_list[misses[0]], input_size, task_type, patch_size)]
+    else:
         try:
-            if task_type == "detection":
-                result = model.predict(tmp_file.name, confidence=0.3, overlap=0.5)
-            else:
-                result = model.predict(tmp_file.name)
-            return result.json()
+            outputs = model.infer_batch([images_list[i] for i in misses], patch_size=patch_size, size=size)
         except Exception as e:
-            logger.error(f"Model prediction error: {str(e)}")
-            return {"error": str(e)}
+            logger.error(f"Model batch prediction error: {str(e)}")
+            outputs = [run_model(model, images_list[i], input_size, task_type, patch_size) for i in misses]
+        else:
+            for i, output in zip(misses, outputs):
+                if keys[i]:
+                    result_cache.set(keys[i], output)
+
+    for i, output in zip(misses, outputs):
+        results[i] = output
+    return results
 
 def crop_center_patch(image, patch_size):
     """Crop center patch from image for classification models"""
@@ -33,18 +146,8 @@ def crop_center_patch(image, patch_size):
 
 def compute_redness(patch):
     """Compute redness metric for a patch"""
-    arr = np.array(patch)
-    red_channel = arr[:, :, 0].astype(float)
-    green_channel = arr[:, :, 1].astype(float)
-    blue_channel = arr[:, :, 2].astype(float)
-    redness = red_channel - (green_channel + blue_channel) / 2
-    return max(0, np.mean(redness)) / 255
+    return mean_redness(patch)
 
 def compute_global_redness(image):
-    """Compute global redness metric for entire image"""
-    arr = np.array(image)
-    red_channel = arr[:, :, 0].astype(float)
-    green_channel = arr[:, :, 1].astype(float)
-    blue_channel = arr[:, :, 2].astype(float)
-    redness = red_channel - (green_channel + blue_channel) / 2
-    return max(0, np.mean(redness)) / 255
+    """Compute global redness metric for entire image or pixel array"""
+    return mean_redness(image)
@@ -0,0 +1,125 @@
+import numpy as np
+
+from app.services.features import redness_map, box_bounds
+
+# Pixels per row strip; bounds the integer temporaries to a few MB whatever the image size
+STRIP_PIXELS = 1 << 18
+
+# Face zones as (left, upper, right, lower) fractions of a centred, upright frontal photo;
+# left and right are as seen in the image
+FACE_REGIONS = {
+    "forehead": (0.2, 0.0, 0.8, 0.3),
+    "left_cheek": (0.0, 0.3, 0.4, 0.75),
+    "nose": (0.4, 0.3, 0.6, 0.75),
+    "right_cheek": (0.6, 0.3, 1.0, 0.75),
+    "chin": (0.3, 0.75, 0.7, 1.0)
+}
+
+# Equal-width bins of per-pixel redness over 0-1
+HISTOGRAM_BINS = 10
+
+# Doubled redness 2R - G - B lies in [-510, 510]
+_LEVELS = 1021
+_LEVEL_OFFSET = 510
+
+def _pixels(image):
+    return image if isinstance(image, np.ndarray) else np.asarray(image)
+
+def _scale(sums, areas):
+    """Mean redness per box from doubled sums, clipped at zero and scaled to 0-1"""
+    means = np.divide(sums, 2 * areas, out=np.zeros(len(sums)), where=areas > 0)
+    return np.maximum(0, means) / 255
+
+def _strip_rows(width, strip_pixels):
+    return max(1, strip_pixels // max(width, 1))
+
+def mean_redness(image, strip_pixels=STRIP_PIXELS):
+    """Mean redness of an image or patch, clipped at zero and scaled to 0-1"""
+    arr = _pixels(image)
+    height, width = arr.shape[:2]
+    if not height or not width:
+        return 0.0
+    rows = _strip_rows(width, strip_pixels)
+    buffer = np.empty((min(rows, height), width), dtype=np.int16)
+    total = 0
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        total += int(redness_map(arr[y0:y1], out=buffer[:y1 - y0]).sum(dtype=np.int64))
+    return max(0, total / (2 * height * width)) / 255
+
+def region_bounds(regions, width, height):
+    """Integer pixel bounds of fractional regions"""
+    fractions = np.array(list(regions.values()), dtype=np.float64).reshape(-1, 4)
+    left, upper, right, lower = (fractions * [width, height, width, height]).round().astype(np.int64).T
+    return left, upper, right, lower
+
+class RednessStats:
+    """Redness statistics of one image, gathered in a single pass over its pixels"""
+
+    def __init__(self, global_redness, lesion_redness, region_redness, histogram):
+        self.global_redness = global_redness
+        # Mean redness of each lesion box, in prediction order
+        self.lesion_redness = lesion_redness
+        # Mean redness per FACE_REGIONS zone
+        self.region_redness = region_redness
+        # Fraction of pixels in each HISTOGRAM_BINS bin
+        self.histogram = histogram
+
+def redness_stats(image, predictions=(), regions=FACE_REGIONS, bins=HISTOGRAM_BINS, strip_pixels=STRIP_PIXELS):
+    """
+    Global, per-lesion and per-region redness plus a redness histogram, from one pass.
+    The doubled redness map is built a strip of rows at a time in int16. Each strip is cut into
+    bands at the top and bottom edges of the boxes; a band's column sums, prefix-summed along the
+    row, give every box covering the band its share in two lookups. A bincount of the strip's
+    levels feeds the histogram. No float copy of the image is made.
+    """
+    arr = _pixels(image)
+    height, width = arr.shape[:2]
+
+    _, left, upper, right, lower = box_bounds(predictions, width, height)
+    lesions = len(left)
+    r_left, r_upper, r_right, r_lower = region_bounds(regions, width, height)
+    left = np.concatenate([left, r_left])
+    upper = np.concatenate([upper, r_upper])
+    # Empty boxes (outside the frame or zero size) have no redness
+    right = np.maximum(np.concatenate([right, r_right]), left)
+    lower = np.maximum(np.concatenate([lower, r_lower]), upper)
+
+    sums = np.zeros(len(left), dtype=np.int64)
+    levels = np.zeros(_LEVELS, dtype=np.int64)
+    total = 0
+    cuts = np.unique(np.concatenate([upper, lower]))
+    prefix = np.zeros(width + 1, dtype=np.int64)
+    rows = _strip_rows(width, strip_pixels)
+    buffer = np.empty((min(rows, height), width), dtype=np.int16)
+
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        strip = redness_map(arr[y0:y1], out=buffer[:y1 - y0])
+
+        bands = [y0, *cuts[(cuts > y0) & (cuts < y1)].tolist(), y1]
+        for b0, b1 in zip(bands, bands[1:]):
+            np.cumsum(strip[b0 - y0:b1 - y0].sum(axis=0, dtype=np.int64), out=prefix[1:])
+            total += int(prefix[-1])
+            covering = (upper <= b0) & (lower >= b1)
+            if covering.any():
+                sums[covering] += prefix[right[covering]] - prefix[left[covering]]
+
+        np.add(strip, _LEVEL_OFFSET, out=strip)
+        levels += np.bincount(strip.ravel(), minlength=_LEVELS)
+
+    means = _scale(sums, (right - left) * (lower - upper))
+    pixels = height * width
+
+    # Non-positive redness counts as zero, so it falls in the first bin
+    redness_levels = np.maximum(np.arange(_LEVELS) - _LEVEL_OFFSET, 0)
+    histogram = np.bincount(
+        np.minimum(redness_levels * bins // (2 * 255), bins - 1), weights=levels, minlength=bins
+    )
+
+    return RednessStats(
+        global_redness=max(0, total / (2 * pixels)) / 255 if pixels else 0.0,
+        lesion_redness=means[:lesions],
+        region_redness={name: float(value) for name, value in zip(regions, means[lesions:])},
+        histogram=(histogram / pixels).tolist() if pixels else [0.0] * bins
+    )
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import INFERENCE_MAX_WORKERS, MODEL_TIMEOUT_SECONDS, ANALYSIS_DEADLINE_RESERVE_SECONDS
+from app.services.batching import BatchScheduler
+from app.services.image_processing import run_model
+from app.services.ml_models import model_manager
+from app.services.metrics import observe_model
+from app.services.resilience import circuit_breakers
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool for blocking model calls so they never run on the event loop
+_executor = ThreadPoolExecutor(max_workers=INFERENCE_MAX_WORKERS, thread_name_prefix="inference")
+
+# Combines concurrent calls to batch-capable models; batches run in the same pool
+batch_scheduler = BatchScheduler(_executor)
+
+def unavailable(reason):
+    """Error result for a model that could not be reached in time, as opposed to one that failed"""
+    return {"error": reason, "unavailable": True}
+
+async def resolve_models(*names):
+    """Loaded models for the given slots, loading missing ones off the event loop (None if unavailable)"""
+    models = [getattr(model_manager, name) for name in names]
+    if all(model is not None for model in models):
+        return models
+    return await asyncio.gather(*(run_in_threadpool(model_manager.get, name) for name in names))
+
+async def run_model_async(
+    model,
+    image,
+    input_size=None,
+    task_type="detection",
+    patch_size=None,
+    name=None,
+    deadline=None,
+    hedge_after=None
+):
+    """
+    Run ML model on image in the inference executor without blocking the event loop.
+    Calls are bounded by MODEL_TIMEOUT_SECONDS and the remaining deadline, fail fast while the
+    model's circuit is open, and with hedge_after start a duplicate call if the first is slow.
+    """
+    if model is None:
+        return unavailable(f"{name or 'Model'} is not loaded")
+    name = name or model.identity
+    timeout = MODEL_TIMEOUT_SECONDS
+    if deadline is not None:
+        timeout = min(timeout, deadline.remaining() - ANALYSIS_DEADLINE_RESERVE_SECONDS)
+    if timeout <= 0:
+        return unavailable("Analysis deadline exceeded")
+
+    breaker = circuit_breakers.get(name)
+    if not breaker.allow():
+        observe_model(name, 0.0, failed=True)
+        return unavailable(f"{name} circuit is open")
+
+    loop = asyncio.get_running_loop()
+    if batch_scheduler.can_batch(model):
+        attempt = partial(
+            batch_scheduler.submit, model, image,
+            input_size=input_size, task_type=task_type, patch_size=patch_size, name=name
+        )
+    else:
+        call = partial(run_model, model, image, input_size=input_size, task_type=task_type, patch_size=patch_size)
+        attempt = partial(loop.run_in_executor, _executor, call)
+    start = time.perf_counter()
+    result = None
+    try:
+        result = await _first_success(loop, attempt, timeout, hedge_after)
+    finally:
+        failed = result is None or "error" in result
+        breaker.record(not failed)
+        observe_model(name, time.perf_counter() - start, failed=failed)
+    return result
+
+async def _first_success(loop, attempt, timeout, hedge_after):
+    """
+    Return the first successful attempt() future; with hedge_after, one duplicate starts
+    if the first is slow or fails
+    """
+    end = loop.time() + timeout
+    attempts = {attempt()}
+    hedged = not hedge_after
+    result = None
+    try:
+        while True:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                return unavailable("Model call timed out")
+            if not attempts:
+                if hedged:
+                    return result
+                hedged = True
+                attempts.add(attempt())
+
+            wait = remaining if hedged else min(remaining, hedge_after)
+            done, attempts = await asyncio.wait(attempts, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                result = finished.result()
+                if "error" not in result:
+                    return result
+            if not done and not hedged:
+                hedged = True
+                attempts.add(attempt())
+    finally:
+        for pending in attempts:
+            pending.cancel()
+
+def shutdown_executor():
+    """Wait for in-flight predictions and release inference threads"""
+    logger.info("Shutting down inference executor...")
+    _executor.shutdown(wait=True)
@@ -0,0 +1,161 @@
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from app.config import METRICS_ENABLED, METRICS_TRACE_SAMPLE_RATE, METRICS_MULTIPROCESS
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "skinintel_stage_duration_seconds",
+    "Time spent in each analysis pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+MODEL_SECONDS = Histogram(
+    "skinintel_model_duration_seconds",
+    "Time from submitting a model call to its result, including executor wait",
+    ["model"],
+    buckets=LATENCY_BUCKETS
+)
+MODEL_ERRORS = Counter("skinintel_model_errors_total", "Model calls that returned an error", ["model"])
+MODEL_BATCH_SIZE = Histogram(
+    "skinintel_model_batch_size",
+    "Calls combined into each micro-batch sent to a model",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+HTTP_SECONDS = Histogram(
+    "skinintel_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+# With several workers, in-flight gauges are summed over the workers that are alive
+HTTP_IN_FLIGHT = Gauge(
+    "skinintel_http_requests_in_flight", "HTTP requests currently being handled", multiprocess_mode="livesum"
+)
+ANALYSES_IN_FLIGHT = Gauge(
+    "skinintel_analyses_in_flight", "Images currently in the analysis pipeline", multiprocess_mode="livesum"
+)
+
+def metrics_registry():
+    """The registry /metrics reads: this process's, or one adding up every worker's metric files"""
+    if not METRICS_MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+METRICS_REGISTRY = metrics_registry()
+
+# Per-request stage timings, set only for sampled requests
+_trace = contextvars.ContextVar("trace", default=None)
+
+@contextmanager
+def stage(name):
+    """Time a block into the stage histogram and the current request's trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if METRICS_ENABLED:
+            STAGE_SECONDS.labels(name).observe(elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+def observe_model(name, elapsed, failed=False):
+    """Record one model call"""
+    if METRICS_ENABLED:
+        MODEL_SECONDS.labels(name).observe(elapsed)
+        if failed:
+            MODEL_ERRORS.labels(name).inc()
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((f"model:{name}", elapsed))
+
+def observe_batch(name, size):
+    """Record one micro-batch sent to a model"""
+    if METRICS_ENABLED:
+        MODEL_BATCH_SIZE.labels(name).observe(size)
+
+class StatsCollector:
+    """
+    Exposes numeric values from stats() dicts (result cache, job queue, ...) as gauges. These are
+    read from the process serving the scrape, so with several workers they describe that worker only.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def collect(self):
+        for prefix, stats in self.sources.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.warning(f"Failed to collect {prefix} stats: {str(e)}")
+                continue
+            for key, value in self._flatten(values, f"skinintel_{prefix}"):
+                yield GaugeMetricFamily(key, f"{prefix} statistic", value=value)
+
+    def _flatten(self, values, prefix):
+        for key, value in values.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                yield from self._flatten(value, name)
+            elif isinstance(value, (int, float)):
+                yield name, float(value)
+
+def register_stats(sources):
+    """Publish stats() callables on /metrics, keyed by metric name prefix"""
+    if METRICS_ENABLED:
+        METRICS_REGISTRY.register(StatsCollector(sources))
+
+def render_metrics():
+    """Metrics in text exposition format, with the content type to serve them as"""
+    return generate_latest(METRICS_REGISTRY), CONTENT_TYPE_LATEST
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency, in-flight requests and sampled stage traces"""
+
+    def __init__(self, app, sample_rate=METRICS_TRACE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        trace = [] if self.sample_rate and random.random() < self.sample_rate else None
+        token = _trace.set(trace)
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            _trace.reset(token)
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            HTTP_SECONDS.labels(scope["method"], route, str(status)).observe(elapsed)
+            if trace is not None:
+                stages = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in trace)
+                logger.info(f"trace {scope['method']} {route} {status} total={elapsed * 1000:.1f}ms {stages}")
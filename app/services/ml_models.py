@@ -1,36 +1,241 @@
 import logging
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from roboflow import Roboflow
-from app.config import ROBOFLOW_API_KEY
+from app.config import (
+    ROBOFLOW_API_KEY,
+    MODEL_BACKENDS,
+    MODEL_PATHS,
+    MODEL_METADATA_CACHE_PATH,
+    MODEL_METADATA_CACHE_TTL_SECONDS,
+    MODEL_LAZY_INIT,
+    MODEL_LOAD_RETRY_SECONDS
+)
+from app.services.backends import RoboflowBackend, OnnxBackend
 
 logger = logging.getLogger(__name__)
 
+# Hosted project and task for each model slot
+MODEL_SPECS = {
+    "acne_model": {"workspace": None, "project": "acnedet-v1", "version": 2, "task_type": "detection"},
+    "skin_disease_model": {"workspace": "kelixo", "project": "skin_disease_ak", "version": 1, "task_type": "classification"},
+    "skin_class_model": {"workspace": "skn-f1vaw", "project": "skn-1", "version": 1, "task_type": "classification"}
+}
+
+# Slots that must be loaded before the server can take analysis traffic; the others degrade
+REQUIRED_MODELS = ("acne_model",)
+
+class ModelMetadataCache:
+    """
+    Hosted model metadata kept in a local JSON file, so warm restarts can build
+    backends without the Roboflow workspace/project/version lookups
+    """
+
+    def __init__(self, path=MODEL_METADATA_CACHE_PATH, ttl=MODEL_METADATA_CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(spec, version):
+        # The default workspace depends on the API key, so it is part of the key
+        account = hashlib.sha256(ROBOFLOW_API_KEY.encode()).hexdigest()[:12]
+        return f"{account}/{spec['workspace'] or ''}/{spec['project']}/{version}"
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable model metadata cache: {str(e)}")
+            return {}
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._read().get(key)
+        if entry is None or time.time() - entry["cached_at"] > self.ttl:
+            return None
+        return entry["metadata"]
+
+    def set(self, key, metadata):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            entries = self._read()
+            entries[key] = {"metadata": metadata, "cached_at": time.time()}
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Failed to write model metadata cache: {str(e)}")
+
 class ModelManager:
-    """Manages Roboflow ML models"""
+    """Manages ML models and their inference backends"""
 
-    def __init__(self):
+    def __init__(self, metadata_cache=None):
         self.acne_model = None
         self.skin_disease_model = None
         self.skin_class_model = None
         self._initialized = False
+        self._roboflow = None
+        self._roboflow_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._slot_locks = {name: threading.Lock() for name in MODEL_SPECS}
+        self._errors = {}
+        self._sources = {}
+        self.metadata_cache = metadata_cache or ModelMetadataCache()
 
     def initialize(self):
-        """Initialize all Roboflow models"""
+        """
+        Load all model slots concurrently. A slot that fails is logged and retried on first
+        use; with MODEL_LAZY_INIT nothing is loaded until a request needs it.
+        """
         if self._initialized:
             return
 
-        logger.info("Initializing Roboflow models...")
-        rf = Roboflow(api_key=ROBOFLOW_API_KEY)
+        if MODEL_LAZY_INIT:
+            logger.info("Lazy model initialization enabled; models load on first use")
+            self._initialized = True
+            return
 
-        self.acne_model = rf.workspace().project("acnedet-v1").version(2).model
-        self.skin_disease_model = rf.workspace("kelixo").project("skin_disease_ak").version(1).model
-        self.skin_class_model = rf.workspace("skn-f1vaw").project("skn-1").version(1).model
+        logger.info("Initializing models...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(MODEL_SPECS), thread_name_prefix="model-init") as pool:
+            models = list(pool.map(self.get, MODEL_SPECS))
 
         self._initialized = True
-        logger.info("Models loaded successfully")
+        loaded = sum(model is not None for model in models)
+        logger.info(f"Loaded {loaded}/{len(MODEL_SPECS)} models in {time.perf_counter() - start:.2f}s")
+
+    def get(self, name):
+        """Return a model slot, loading it first if needed; None if it cannot be loaded right now"""
+        model = getattr(self, name)
+        if model is not None:
+            return model
+
+        with self._slot_locks[name]:
+            model = getattr(self, name)
+            if model is not None:
+                return model
+            failure = self._errors.get(name)
+            if failure and time.monotonic() - failure[1] < MODEL_LOAD_RETRY_SECONDS:
+                return None
+            try:
+                model = self._load(name)
+            except Exception as e:
+                logger.error(f"Failed to load {name}: {str(e)}")
+                self._errors[name] = (str(e), time.monotonic())
+                return None
+            self._errors.pop(name, None)
+            setattr(self, name, model)
+            return model
+
+    def _load(self, name, backend=None, path=None, version=None):
+        """Build the backend for a model slot"""
+        spec = MODEL_SPECS[name]
+        backend = backend or MODEL_BACKENDS[name]
+
+        if backend == "onnx":
+            path = path or MODEL_PATHS[name]
+            if not path:
+                raise ValueError(f"No ONNX model path configured for {name}")
+            logger.info(f"Loading {name} from {path}")
+            self._sources[name] = "onnx"
+            return OnnxBackend(path, spec["task_type"])
+
+        version = version or spec["version"]
+        cache_key = self.metadata_cache.key(spec, version)
+        metadata = self.metadata_cache.get(cache_key)
+        if metadata is not None:
+            logger.info(f"Loading {name} from cached metadata")
+            self._sources[name] = "cache"
+            return RoboflowBackend.from_metadata(metadata, spec["task_type"])
+
+        roboflow = self._client()
+        workspace = roboflow.workspace(spec["workspace"]) if spec["workspace"] else roboflow.workspace()
+        model = RoboflowBackend(workspace.project(spec["project"]).version(version).model, spec["task_type"])
+        self.metadata_cache.set(cache_key, model.metadata())
+        self._sources[name] = "roboflow"
+        return model
+
+    def _client(self):
+        """Shared Roboflow client; creating one validates the API key, so do it once"""
+        with self._roboflow_lock:
+            if self._roboflow is None:
+                self._roboflow = Roboflow(api_key=ROBOFLOW_API_KEY)
+            return self._roboflow
+
+    def reload_model(self, name, backend=None, path=None, version=None):
+        """Load a new model version and atomically swap it in; in-flight requests keep the old one"""
+        if name not in MODEL_SPECS:
+            raise ValueError(f"Unknown model: {name}")
+
+        with self._reload_lock:
+            new_model = self._load(name, backend, path, version)
+            old_model = getattr(self, name)
+            setattr(self, name, new_model)
+
+        logger.info(f"Reloaded {name}: {getattr(old_model, 'identity', None)} -> {new_model.identity}")
+        return new_model
+
+    def reload_changed(self):
+        """Reload local models whose weights changed on disk; returns the reloaded names"""
+        reloaded = []
+        for name in MODEL_SPECS:
+            model = getattr(self, name)
+            if not isinstance(model, OnnxBackend):
+                continue
+            try:
+                mtime = os.path.getmtime(model.path)
+                if mtime == model.mtime:
+                    continue
+                with open(model.path, "rb") as f:
+                    checksum = hashlib.sha256(f.read()).hexdigest()
+                if checksum != model.checksum:
+                    self.reload_model(name, backend="onnx", path=model.path)
+                    reloaded.append(name)
+                else:
+                    model.mtime = mtime
+            except Exception as e:
+                logger.error(f"Failed to reload {name}: {str(e)}")
+        return reloaded
+
+    def model_info(self):
+        """Return readiness, backend and version details for each model slot"""
+        info = {}
+        for name in MODEL_SPECS:
+            model = getattr(self, name)
+            failure = self._errors.get(name)
+            info[name] = {
+                "ready": model is not None,
+                "backend": MODEL_BACKENDS[name] if model is None else ("onnx" if isinstance(model, OnnxBackend) else "roboflow"),
+                "identity": getattr(model, "identity", None),
+                "loaded_from": self._sources.get(name) if model is not None else None,
+                "error": failure[0] if failure else None
+            }
+        return info
 
     @property
     def is_initialized(self):
         return self._initialized
 
+    @property
+    def is_ready(self):
+        """Whether analysis traffic can be served: required models loaded, or loaded on demand"""
+        if MODEL_LAZY_INIT:
+            return True
+        return all(getattr(self, name) is not None for name in REQUIRED_MODELS)
+
 # Global model manager instance
 model_manager = ModelManager()
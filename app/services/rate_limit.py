@@ -0,0 +1,323 @@
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import jwt
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import (
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_SQLITE_PATH,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_TRUSTED_PROXIES,
+    RATE_LIMIT_SIGNUP,
+    RATE_LIMIT_LOGIN,
+    RATE_LIMIT_REFRESH,
+    RATE_LIMIT_ANALYSIS,
+    RATE_LIMIT_BATCH,
+    RATE_LIMIT_JOBS,
+    RATE_LIMIT_FETCH,
+    RATE_LIMIT_EXPORT
+)
+from app.auth.tokens import token_cache, token_verifier, LocalVerificationUnavailable
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+@dataclass(frozen=True)
+class Rate:
+    """A token bucket holding up to `capacity` requests, refilled evenly over `period` seconds"""
+    capacity: int
+    period: int
+
+    @classmethod
+    def parse(cls, value):
+        """Parse limits such as "30/minute" or "100 per hour\""""
+        match = re.fullmatch(r"\s*(\d+)\s*(?:/|per)\s*(second|minute|hour|day)s?\s*", value)
+        if not match:
+            raise ValueError(f"Invalid rate limit: {value!r}")
+        return cls(int(match.group(1)), PERIODS[match.group(2)])
+
+    @property
+    def refill_per_second(self):
+        return self.capacity / self.period
+
+    def __str__(self):
+        unit = next(name for name, seconds in PERIODS.items() if seconds == self.period)
+        return f"{self.capacity}/{unit}"
+
+# Rate limited endpoints: (method, path) -> (bucket name, rate)
+RATE_LIMITS = {
+    ("POST", "/auth/signup"): ("signup", RATE_LIMIT_SIGNUP),
+    ("POST", "/auth/login"): ("login", RATE_LIMIT_LOGIN),
+    ("POST", "/auth/refresh"): ("refresh", RATE_LIMIT_REFRESH),
+    ("POST", "/skinprocessing"): ("analysis", RATE_LIMIT_ANALYSIS),
+    ("POST", "/skinprocessing/batch"): ("batch", RATE_LIMIT_BATCH),
+    ("POST", "/skinprocessing/jobs"): ("jobs", RATE_LIMIT_JOBS),
+    ("GET", "/analyses"): ("fetch", RATE_LIMIT_FETCH),
+    ("GET", "/analyses/trends"): ("fetch", RATE_LIMIT_FETCH),
+    ("GET", "/analyses/export"): ("export", RATE_LIMIT_EXPORT)
+}
+
+def refill(tokens, updated_at, now, rate):
+    return min(rate.capacity, tokens + max(0.0, now - updated_at) * rate.refill_per_second)
+
+def retry_after(tokens, rate):
+    """Seconds until one token is available"""
+    return (1 - tokens) / rate.refill_per_second
+
+class MemoryRateLimitStore:
+    """In-process token buckets; limits apply per process"""
+
+    shared = False
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate):
+        """Take one token; returns (allowed, seconds until the next token if refused)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (rate.capacity, now))
+            tokens = refill(tokens, updated_at, now, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, 0.0 if allowed else retry_after(tokens, rate)
+
+    def _prune(self, now, idle=max(PERIODS.values())):
+        # Buckets idle this long are full again, so forgetting them changes nothing
+        for key in [key for key, (_, updated_at) in self._buckets.items() if now - updated_at > idle]:
+            del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+class SQLiteRateLimitStore:
+    """Token buckets shared between processes on one host through a SQLite file"""
+
+    shared = True
+
+    def __init__(self, path=RATE_LIMIT_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # SQLite connections must not be shared with forked server workers
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = refill(*row, now, rate) if row else rate.capacity
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0.0 if allowed else retry_after(tokens, rate)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM buckets")
+
+class RedisRateLimitStore:
+    """Token buckets shared by every process and host through Redis; requires the redis package"""
+
+    shared = True
+
+    # Refill, take and store atomically, using the Redis clock so hosts need not agree on time
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL, prefix="skinintel:ratelimit:"):
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate):
+        allowed, tokens = self._script(keys=[self.prefix + key], args=[rate.capacity, rate.refill_per_second])
+        allowed = bool(int(allowed))
+        return allowed, 0.0 if allowed else retry_after(float(tokens), rate)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + "*"):
+            self._client.delete(key)
+
+def create_rate_limit_store(backend=RATE_LIMIT_BACKEND):
+    if backend == "sqlite":
+        return SQLiteRateLimitStore()
+    if backend == "redis":
+        return RedisRateLimitStore()
+    return MemoryRateLimitStore()
+
+def client_ip(scope, trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES):
+    """
+    Client address, taken from X-Forwarded-For when behind `trusted_proxies` proxies.
+    Each trusted proxy appends the address it received the request from, so the client is
+    that many entries from the end; anything further left is client-supplied and ignored.
+    """
+    peer = scope["client"][0] if scope.get("client") else "unknown"
+    if trusted_proxies <= 0:
+        return peer
+    forwarded = [
+        address.strip()
+        for name, value in scope["headers"] if name == b"x-forwarded-for"
+        for address in value.decode("latin-1").split(",")
+    ]
+    forwarded = [address for address in forwarded if address]
+    if not forwarded:
+        return peer
+    return forwarded[-min(trusted_proxies, len(forwarded))]
+
+def bearer_token(scope):
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" else None
+    return None
+
+def user_id(token):
+    """
+    User id for a token that has already been verified, or that can be verified locally.
+    Never verifies over the network and never trusts unverified claims; returns None instead.
+    """
+    if token_cache.is_revoked(token):
+        return None
+    user = token_cache.get(token)
+    if user is not None:
+        return user.id
+    if token_verifier.needs_network(token):
+        return None
+    try:
+        return token_verifier.verify(token).get("sub")
+    except (LocalVerificationUnavailable, jwt.InvalidTokenError):
+        return None
+
+def rate_limit_key(scope):
+    """Authenticated user id, falling back to the client address"""
+    token = bearer_token(scope)
+    user = user_id(token) if token else None
+    return f"user:{user}" if user else f"ip:{client_ip(scope)}"
+
+class RateLimiter:
+    """Checks requests against the configured per-endpoint limits"""
+
+    def __init__(self, store=None, limits=RATE_LIMITS, enabled=RATE_LIMIT_ENABLED, key_func=rate_limit_key):
+        self.store = store or create_rate_limit_store()
+        self.limits = {route: (name, Rate.parse(rate)) for route, (name, rate) in limits.items()}
+        self.enabled = enabled
+        self.key_func = key_func
+        self.limited = 0
+
+    async def check(self, scope):
+        """Returns (rate, retry_after) when the request is over its limit, else None"""
+        limit = self.limits.get((scope["method"], scope["path"].rstrip("/") or "/"))
+        if not self.enabled or limit is None:
+            return None
+
+        name, rate = limit
+        try:
+            # The key looks up revoked tokens, which may also live in a shared store
+            if self.store.shared or token_cache.revocations.shared:
+                allowed, wait = await run_in_threadpool(self._take, scope, name, rate)
+            else:
+                allowed, wait = self._take(scope, name, rate)
+        except Exception as e:
+            # Fail open: an unavailable store should not take the API down with it
+            logger.warning(f"Rate limit store error: {str(e)}")
+            return None
+        if allowed:
+            return None
+        self.limited += 1
+        return rate, wait
+
+    def _take(self, scope, name, rate):
+        return self.store.take(f"{name}:{self.key_func(scope)}", rate)
+
+    def stats(self):
+        return {"enabled": self.enabled, "backend": type(self.store).__name__, "limited": self.limited}
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware enforcing rate limits before routing, so refused requests never have
+    their body read or their token verified remotely
+    """
+
+    def __init__(self, app, limiter=None):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limited = await self.limiter.check(scope)
+        if limited is None:
+            await self.app(scope, receive, send)
+            return
+
+        rate, wait = limited
+        body = f'{{"detail":"Rate limit exceeded: {rate}"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(wait))).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
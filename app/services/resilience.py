@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from app.config import (
+    ANALYSIS_DEADLINE_SECONDS,
+    CIRCUIT_FAILURE_RATE,
+    CIRCUIT_MIN_CALLS,
+    CIRCUIT_WINDOW_SECONDS,
+    CIRCUIT_RESET_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class Deadline:
+    """Time budget for one analysis, shared by every stage that runs under it"""
+
+    def __init__(self, seconds=ANALYSIS_DEADLINE_SECONDS):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker for one model.
+    Opens when enough recent calls fail, fails fast while open, then lets a single
+    trial call through; its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_rate=CIRCUIT_FAILURE_RATE,
+        min_calls=CIRCUIT_MIN_CALLS,
+        window=CIRCUIT_WINDOW_SECONDS,
+        reset_timeout=CIRCUIT_RESET_SECONDS
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._calls = deque()
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may proceed now"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success):
+        """Record the outcome of an allowed call"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_running = False
+                if success:
+                    logger.info(f"Circuit for {self.name} closed")
+                    self.state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._calls.append((now, success))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            failures = sum(1 for _, ok in self._calls if not ok)
+            if (
+                self.state == CLOSED
+                and len(self._calls) >= self.min_calls
+                and failures / len(self._calls) >= self.failure_rate
+            ):
+                self._open(now)
+
+    def _open(self, now):
+        logger.warning(f"Circuit for {self.name} opened; failing fast for {self.reset_timeout}s")
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = now
+        self._calls.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "open": int(self.state != CLOSED),
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
+
+class CircuitBreakers:
+    """One breaker per model name, created on first use"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name)
+            return self._breakers[name]
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {name: breaker.stats() for name, breaker in breakers}
+
+# Global circuit breakers for model calls
+circuit_breakers = CircuitBreakers()
@@ -0,0 +1,85 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Exits with status 1 when any metric is worse than the threshold percentage.
+"""
+import argparse
+import json
+import sys
+
+# (path within a scenario result, higher is better)
+SCENARIO_METRICS = (
+    (("throughput_rps",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p99"), False),
+    (("peak_rss_mb",), False),
+    (("response_kb",), False)
+)
+
+# Microbenchmark metrics, lower is better
+MICRO_METRICS = ("median_ms", "peak_alloc_kb")
+
+def lookup(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+def change(old, new, higher_is_better):
+    """Percentage change where positive always means worse"""
+    if not old or new is None:
+        return None
+    delta = (new - old) / old * 100
+    return -delta if higher_is_better else delta
+
+def compare(baseline, candidate, threshold):
+    rows = []
+    for mode, scenarios in candidate.get("scenarios", {}).items():
+        for name, result in scenarios.items():
+            for path, higher_is_better in SCENARIO_METRICS:
+                old = lookup(baseline, ("scenarios", mode, name) + path)
+                new = lookup(result, path)
+                if new is None:
+                    continue
+                rows.append((f"{mode}/{name} {'.'.join(path)}", old, new, change(old, new, higher_is_better)))
+    for name, result in candidate.get("micro", {}).items():
+        for metric in MICRO_METRICS:
+            old = lookup(baseline, ("micro", name, metric))
+            new = result.get(metric)
+            if new is None:
+                continue
+            rows.append((f"micro/{name} {metric}", old, new, change(old, new, False)))
+
+    regressions = 0
+    for label, old, new, worse in rows:
+        if worse is None:
+            print(f"  {label}: {new} (no baseline)")
+            continue
+        flag = "REGRESSION" if worse > threshold else ""
+        regressions += bool(flag)
+        direction = f"{worse:.1f}% worse" if worse > 0 else f"{-worse:.1f}% better"
+        print(f"  {label}: {old:.3f} -> {new:.3f} ({direction}) {flag}".rstrip())
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10, help="Allowed slowdown in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"{baseline['meta'].get('git_revision')} -> {candidate['meta'].get('git_revision')}")
+    regressions = compare(baseline, candidate, args.threshold)
+    print(f"{regressions} regression(s) over {args.threshold}%")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
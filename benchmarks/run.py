@@ -0,0 +1,357 @@
+"""
+Benchmark the analysis API and image processing hot paths against deterministic stubs.
+
+    python -m benchmarks.run                      # everything, results in benchmarks/results/
+    python -m benchmarks.run --mode inprocess --scenarios single,concurrent --no-micro
+    python -m benchmarks.compare old.json new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from benchmarks.stubs import configure_environment, install_stubs, make_token, make_jpeg
+
+configure_environment()
+
+import httpx
+import numpy as np
+import uvicorn
+
+SCENARIOS = {
+    # name: (image width, height, requests, concurrency)
+    "single": (1280, 960, 20, 1),
+    "concurrent": (1280, 960, 64, 16),
+    "large": (8000, 6000, 5, 1)
+}
+
+HISTORY_SCENARIOS = {
+    # name: (rows per page, requests, concurrency)
+    "history": (100, 200, 4)
+}
+
+class PeakRSS:
+    """Samples resident memory in a background thread to find the peak during a block"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # ru_maxrss is a lifetime peak (KiB on Linux, bytes on macOS)
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if platform.system() == "Darwin" else maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.baseline = self.current()
+        self.peak = self.baseline
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+def summarize(latencies, errors, wall, rss, sizes=None):
+    ms = [v * 1000 for v in latencies]
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else None,
+        "latency_ms": {
+            "mean": statistics.fmean(ms) if ms else None,
+            "p50": percentile(ms, 50),
+            "p90": percentile(ms, 90),
+            "p99": percentile(ms, 99),
+            "max": max(ms) if ms else None
+        },
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+        "rss_growth_mb": round((rss.peak - rss.baseline) / 2 ** 20, 1)
+    }
+    if sizes:
+        summary["response_kb"] = round(statistics.fmean(sizes) / 1024, 2)
+    return summary
+
+async def drive(client, image, requests, concurrency, token):
+    """Send requests to /skinprocessing with a fixed number of concurrent clients"""
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def client_loop():
+        nonlocal errors
+        while not queue.empty():
+            i = queue.get_nowait()
+            start = time.perf_counter()
+            resp = await client.post(
+                "/skinprocessing",
+                files={"file": (f"bench-{i}.jpg", image, "image/jpeg")},
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            if resp.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+    return summarize(latencies, errors, wall, rss)
+
+async def seed_history(rows):
+    """Give the benchmark user at least `rows` stored analyses with realistic values"""
+    from app.analysis.repository import analysis_repository
+    from benchmarks.stubs import BENCH_USER_ID
+
+    existing = await analysis_repository.list_for_user(BENCH_USER_ID, limit=rows, columns=("id",))
+    rng = np.random.default_rng(0)
+    await analysis_repository.insert_many([
+        {
+            "user_id": BENCH_USER_ID,
+            "filename": f"history-{i}.jpg",
+            "acne_count": int(rng.integers(0, 40)),
+            "avg_acne_width": float(rng.uniform(5, 30)),
+            "avg_acne_height": float(rng.uniform(5, 30)),
+            "avg_acne_area": float(rng.uniform(25, 900)),
+            "papules_count": int(rng.integers(0, 10)),
+            "pustules_count": int(rng.integers(0, 10)),
+            "comedone_count": int(rng.integers(0, 10)),
+            "nodules_count": int(rng.integers(0, 10)),
+            "avg_redness": float(rng.uniform(0, 1)),
+            "global_redness": float(rng.uniform(0, 1)),
+            "skin_disease_label": "acne",
+            "skin_disease_confidence": float(rng.uniform(0, 1)),
+            "skin_classification_labels": "oily,combination",
+            "acne_detected": True,
+            "result": None
+        }
+        for i in range(rows - len(existing))
+    ])
+
+async def drive_history(client, page_size, requests, concurrency, token):
+    """Fetch full history pages; response_kb is the size on the wire, after any compression"""
+    latencies, sizes, errors = [], [], 0
+    remaining = iter(range(requests))
+
+    async def client_loop():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            resp = await client.get(
+                "/analyses",
+                params={"limit": page_size, "fields": "*"},
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            if resp.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+                sizes.append(resp.num_bytes_downloaded)
+            else:
+                errors += 1
+
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+    return summarize(latencies, errors, wall, rss, sizes)
+
+async def run_all(client, scenarios, history, token, label):
+    results = {}
+    for name, (width, height, requests, concurrency) in scenarios.items():
+        image = make_jpeg(width, height)
+        await drive(client, image, min(2, requests), 1, token)  # warm-up
+        results[name] = await drive(client, image, requests, concurrency, token)
+        print(f"{label}/{name}: {results[name]['throughput_rps']} req/s, p99 {results[name]['latency_ms']['p99']:.1f} ms")
+    for name, (page_size, requests, concurrency) in history.items():
+        await seed_history(page_size)
+        await drive_history(client, page_size, min(5, requests), 1, token)
+        results[name] = await drive_history(client, page_size, requests, concurrency, token)
+        print(
+            f"{label}/{name}: {results[name]['throughput_rps']} req/s, p99 {results[name]['latency_ms']['p99']:.1f} ms, "
+            f"{results[name]['response_kb']} KB per page"
+        )
+    return results
+
+async def run_inprocess(app, scenarios, history, token):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        return await run_all(client, scenarios, history, token, "inprocess")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def run_uvicorn(app, scenarios, history, token):
+    """Same scenarios over real sockets against uvicorn running in a background thread"""
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        limits = httpx.Limits(max_connections=max(c for *_, c in [*scenarios.values(), *history.values()]))
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300, limits=limits) as client:
+            return await run_all(client, scenarios, history, token, "uvicorn")
+    finally:
+        server.should_exit = True
+        thread.join()
+
+def time_call(fn, min_time=0.2, max_runs=200):
+    """Median and best wall time of repeated calls in milliseconds, and peak traced allocations of one call"""
+    fn()
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < max_runs and (len(timings) < 5 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    # Measured separately so tracing does not slow the timed runs; numpy buffers are traced too
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "runs": len(timings),
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "peak_alloc_kb": round(peak / 1024, 1)
+    }
+
+def run_micro(lesions):
+    from app.analysis.ingest import decode_image
+    from app.services.image_processing import (
+        encode_image,
+        crop_center_patch,
+        compute_redness,
+        compute_global_redness,
+        EncodedImageSet
+    )
+    from app.services.features import extract_acne_features
+    from app.services.image_stats import redness_stats
+
+    jpeg = make_jpeg(1280, 960)
+    large_jpeg = make_jpeg(8000, 6000)
+    image = decode_image(jpeg).image
+    pixels = np.asarray(image)
+    rng = np.random.default_rng(0)
+    # A full-resolution 12 MP photo, as analysed with a large IMAGE_WORKING_MAX_SIDE
+    large_pixels = rng.integers(0, 256, (3000, 4000, 3), dtype=np.uint8)
+
+    def predictions(count):
+        return [
+            {"x": float(rng.uniform(0, 1280)), "y": float(rng.uniform(0, 960)), "width": 20.0, "height": 16.0, "class": "papules"}
+            for _ in range(count)
+        ]
+    few, many = predictions(lesions), predictions(lesions * 10)
+    patch = crop_center_patch(image, 64)
+
+    benchmarks = {
+        "decode_image[1280x960]": lambda: decode_image(jpeg),
+        "decode_image[8000x6000]": lambda: decode_image(large_jpeg),
+        "encode_image[1280x960]": lambda: encode_image(image),
+        "crop_center_patch[640]": lambda: crop_center_patch(image, 640),
+        "encoded_image_set[640x640]": lambda: EncodedImageSet(image).get(640, (640, 640)),
+        "compute_redness[64x64]": lambda: compute_redness(patch),
+        "compute_global_redness[1280x960]": lambda: compute_global_redness(pixels),
+        "compute_global_redness[4000x3000]": lambda: compute_global_redness(large_pixels),
+        f"redness_stats[1280x960,{len(few)}]": lambda: redness_stats(pixels, few),
+        f"redness_stats[4000x3000,{len(many)}]": lambda: redness_stats(large_pixels, many),
+        f"extract_acne_features[{len(few)}]": lambda: extract_acne_features(pixels, few),
+        f"extract_acne_features[{len(many)}]": lambda: extract_acne_features(pixels, many)
+    }
+    results = {}
+    for name, fn in benchmarks.items():
+        results[name] = time_call(fn)
+        print(f"micro/{name}: {results[name]['median_ms']:.3f} ms, peak {results[name]['peak_alloc_kb']:.0f} KB")
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="both")
+    names = [*SCENARIOS, *HISTORY_SCENARIOS]
+    parser.add_argument("--scenarios", default=",".join(names), help="Comma-separated subset of: " + ", ".join(names))
+    parser.add_argument("--no-micro", action="store_true", help="Skip image processing microbenchmarks")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub model latency in seconds")
+    parser.add_argument("--lesions", type=int, default=20, help="Lesions returned by the stub detector")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    app = install_stubs(latency=args.latency, lesions=args.lesions)
+    token = make_token()
+    selected = [name for name in args.scenarios.split(",") if name]
+    scenarios = {name: SCENARIOS[name] for name in selected if name in SCENARIOS}
+    history = {name: HISTORY_SCENARIOS[name] for name in selected if name in HISTORY_SCENARIOS}
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "stub_latency_seconds": args.latency,
+            "stub_lesions": args.lesions,
+            "scenarios": {
+                **{name: dict(zip(("width", "height", "requests", "concurrency"), spec)) for name, spec in scenarios.items()},
+                **{name: dict(zip(("page_size", "requests", "concurrency"), spec)) for name, spec in history.items()}
+            }
+        },
+        "scenarios": {},
+        "micro": {}
+    }
+
+    if args.mode in ("inprocess", "both"):
+        report["scenarios"]["inprocess"] = asyncio.run(run_inprocess(app, scenarios, history, token))
+    if args.mode in ("uvicorn", "both"):
+        report["scenarios"]["uvicorn"] = asyncio.run(run_uvicorn(app, scenarios, history, token))
+    if not args.no_micro:
+        report["micro"] = run_micro(args.lesions)
+
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Deterministic stand-ins for the hosted models, Supabase Auth and the analysis table"""
+import base64
+import os
+import time
+
+import numpy as np
+
+BENCH_JWT_SECRET = "benchmark-secret-with-at-least-32-bytes"
+BENCH_USER_ID = "00000000-0000-0000-0000-00000000bench"
+
+LESION_CLASSES = ("papules", "pustules", "comedone", "nodules", "blackheads")
+
+def configure_environment():
+    """Point the app at in-process stand-ins; must run before any app module is imported"""
+    defaults = {
+        "API_KEY": "benchmark",
+        "SUPABASE_URL": "http://localhost:54321",
+        "SUPABASE_KEY": "benchmark",
+        "SUPABASE_JWT_SECRET": BENCH_JWT_SECRET,
+        "AUTH_REVALIDATE_SECONDS": "0",
+        "ANALYSIS_REPOSITORY": "memory",
+        "RESULT_CACHE_ENABLED": "false",
+        "IDEMPOTENCY_ENABLED": "false",
+        "JOB_WORKERS": "0",
+        "MODEL_RELOAD_INTERVAL_SECONDS": "0",
+        "METRICS_TRACE_SAMPLE_RATE": "0",
+        "IMAGE_STORE_BACKEND": "memory"
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+def make_stub_model(dataset_id, version=1, preprocessing=None):
+    """Minimal object with the attributes RoboflowBackend reads from an SDK model"""
+    return type("StubSdkModel", (), {"dataset_id": dataset_id, "version": version, "preprocessing": preprocessing or {}})()
+
+def make_stub_backends(latency=0.05, lesions=20, seed=0):
+    """Build the three model slots; imported lazily so configure_environment runs first"""
+    from app.services.backends import RoboflowBackend
+
+    class StubRoboflowBackend(RoboflowBackend):
+        """Runs the real preprocessing and encoding, then fakes the hosted call with a fixed delay"""
+
+        def _post(self, payload, params=""):
+            base64.b64encode(payload)
+            time.sleep(latency)
+            if self.task_type == "detection":
+                width, height = self._stretch_size() or (640, 640)
+                rng = np.random.default_rng(seed)
+                return {
+                    "predictions": [
+                        {
+                            "x": float(rng.uniform(0, width)),
+                            "y": float(rng.uniform(0, height)),
+                            "width": float(rng.uniform(4, 40)),
+                            "height": float(rng.uniform(4, 40)),
+                            "class": LESION_CLASSES[i % len(LESION_CLASSES)],
+                            "confidence": 0.8
+                        }
+                        for i in range(lesions)
+                    ],
+                    "image": {"width": str(width), "height": str(height)}
+                }
+            return {"predictions": [{"class": "acne", "confidence": 0.9}], "top": "acne"}
+
+    stretch = {"resize": {"format": "Stretch to", "width": 640, "height": 640}}
+    return {
+        "acne_model": StubRoboflowBackend(make_stub_model("acnedet-v1", 2, stretch), "detection"),
+        "skin_disease_model": StubRoboflowBackend(make_stub_model("skin_disease_ak"), "classification"),
+        "skin_class_model": StubRoboflowBackend(make_stub_model("skn-1"), "classification")
+    }
+
+def install_stubs(latency=0.05, lesions=20, seed=0):
+    """Swap in stub models and disable rate limits so load is not throttled"""
+    from app.services.ml_models import model_manager
+    from app.services.rate_limit import rate_limiter
+    import main
+
+    for name, backend in make_stub_backends(latency, lesions, seed).items():
+        setattr(model_manager, name, backend)
+    model_manager._initialized = True
+
+    rate_limiter.enabled = False
+    return main.app
+
+def make_token(user_id=BENCH_USER_ID, ttl=3600):
+    """HS256 access token accepted by local verification"""
+    import jwt
+    now = int(time.time())
+    claims = {"sub": user_id, "email": "bench@example.com", "role": "authenticated", "aud": "authenticated", "iat": now, "exp": now + ttl}
+    return jwt.encode(claims, BENCH_JWT_SECRET, algorithm="HS256")
+
+def make_jpeg(width, height, seed=1, quality=90):
+    """Deterministic skin-toned noise image encoded as JPEG"""
+    import io
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    base = np.array([200, 150, 130], dtype=np.int16)
+    # Generate at low resolution and upscale so large images stay cheap to build
+    small = np.clip(base + rng.integers(-40, 40, (max(1, height // 8), max(1, width // 8), 3)), 0, 255).astype(np.uint8)
+    image = Image.fromarray(small).resize((width, height))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
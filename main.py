@@ -1,43 +1,84 @@
+import asyncio
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
 
-from app.config import validate_config, CORS_ORIGINS, logger
-from app.auth import auth_router, get_current_user
+from app.config import (
+    validate_config,
+    CORS_ORIGINS,
+    MODEL_RELOAD_INTERVAL_SECONDS,
+    METRICS_ENABLED,
+    COMPRESSION_ENABLED,
+    logger
+)
+from app.auth import auth_router, get_current_user_profile
 from app.analysis import analysis_router
+from app.analysis.idempotency import analysis_deduplicator
+from app.analysis.ingest import UploadLimitMiddleware
+from app.jobs import jobs_router, job_workers
+from app.images import images_router, image_store
+from app.jobs.queue import job_queue
 from app.services.ml_models import model_manager
+from app.services.inference import shutdown_executor, batch_scheduler
+from app.services.cache import result_cache
+from app.services.metrics import MetricsMiddleware, register_stats, render_metrics
+from app.services.resilience import circuit_breakers
+from app.services.rate_limit import RateLimitMiddleware, rate_limiter
+from app.services.responses import ORJSONResponse, CompressionMiddleware
+from app.analysis.repository import analysis_repository
 
 # Validate configuration on import
 validate_config()
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+async def watch_model_files():
+    """Periodically hot-reload local models whose weights changed on disk"""
+    while True:
+        await asyncio.sleep(MODEL_RELOAD_INTERVAL_SECONDS)
+        await run_in_threadpool(model_manager.reload_changed)
 
 # Lifespan context manager for startup/shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting SkinIntel API...")
-    model_manager.initialize()
+    # Load models in the background so the server accepts connections (and liveness checks)
+    # immediately; /health/ready reports when analysis traffic can be routed here
+    init_task = asyncio.create_task(run_in_threadpool(model_manager.initialize))
+    reload_task = asyncio.create_task(watch_model_files()) if MODEL_RELOAD_INTERVAL_SECONDS > 0 else None
+    job_workers.start()
     yield
     # Shutdown
     logger.info("Shutting down SkinIntel API...")
+    if reload_task:
+        reload_task.cancel()
+    if not init_task.done():
+        await asyncio.gather(init_task, return_exceptions=True)
+    await job_workers.stop()
+    await image_store.drain()
+    await analysis_repository.close()
+    shutdown_executor()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="SkinIntel API",
     description="AI-powered skin analysis API with user authentication",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
-# Add rate limit exception handler
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+# Negotiated brotli/gzip for JSON, NDJSON and text responses above COMPRESSION_MIN_SIZE
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# Oversized uploads are refused before their body is read or parsed
+app.add_middleware(UploadLimitMiddleware)
+
+# Rate limits run before routing, ahead of body reads and authentication
+app.add_middleware(RateLimitMiddleware)
 
 # CORS middleware configuration
 app.add_middleware(
@@ -48,23 +89,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency and in-flight metrics
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    register_stats({
+        "result_cache": result_cache.stats,
+        "jobs": job_queue.stats,
+        "circuit": circuit_breakers.stats,
+        "rate_limit": rate_limiter.stats,
+        "idempotency": analysis_deduplicator.stats,
+        "batching": batch_scheduler.stats
+    })
+
 # Include routers
 app.include_router(auth_router)
 app.include_router(analysis_router)
+app.include_router(jobs_router)
+app.include_router(images_router)
 
 # Health check endpoint
 @app.get("/health", tags=["System"])
 async def health_check():
-    """Health check endpoint"""
+    """Liveness check: healthy whenever the process is serving, with per-model readiness details"""
     return {
         "status": "healthy",
         "version": "2.0.0",
-        "models_loaded": model_manager.is_initialized
+        "ready": model_manager.is_ready,
+        "models_loaded": model_manager.is_initialized,
+        "models": model_manager.model_info(),
+        "circuits": circuit_breakers.stats(),
+        "result_cache": result_cache.stats(),
+        "jobs": job_queue.stats()
     }
 
+# Readiness check for load balancers
+@app.get("/health/ready", tags=["System"])
+async def readiness_check():
+    """Readiness check: 503 until the models needed for analysis are loaded"""
+    ready = model_manager.is_ready
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "models": {name: info["ready"] for name, info in model_manager.model_info().items()}
+        }
+    )
+
+# Prometheus metrics endpoint
+@app.get("/metrics", tags=["System"], include_in_schema=False)
+async def metrics():
+    """Prometheus metrics in text exposition format"""
+    if not METRICS_ENABLED:
+        return Response(status_code=404)
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
 # User profile endpoint
 @app.get("/me", tags=["User"])
-async def get_current_user_info(user=Depends(get_current_user)):
+async def get_current_user_info(user=Depends(get_current_user_profile)):
     """Get current user information"""
     return {
         "id": user.id,
@@ -73,5 +155,5 @@ async def get_current_user_info(user=Depends(get_current_user)):
     }
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from app.server import serve
+    serve(app)
@@ -0,0 +1,16 @@
+import os
+
+# In-process stand-ins for external services; set before any app module is imported
+os.environ.update({
+    "API_KEY": "test",
+    "SUPABASE_URL": "http://localhost:54321",
+    "SUPABASE_KEY": "test",
+    "SUPABASE_JWT_SECRET": "test-secret-with-at-least-32-bytes!!",
+    "AUTH_REVALIDATE_SECONDS": "0",
+    "ANALYSIS_REPOSITORY": "memory",
+    "RESULT_CACHE_ENABLED": "false",
+    "JOB_WORKERS": "0",
+    "MODEL_RELOAD_INTERVAL_SECONDS": "0",
+    "METRICS_ENABLED": "false",
+    "IMAGE_STORE_BACKEND": "memory"
+})
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.analysis import routes as analysis_routes
+from app.analysis.repository import InMemoryAnalysisRepository, InvalidCursor, decode_cursor, encode_cursor
+from app.auth.dependencies import get_current_user
+from app.auth.tokens import AuthenticatedUser
+
+USER = AuthenticatedUser(id="history-user", email="history@example.com")
+
+@pytest.fixture
+def repository(monkeypatch):
+    repository = InMemoryAnalysisRepository()
+    monkeypatch.setattr(analysis_routes, "analysis_repository", repository)
+    # Pairs of rows share a timestamp, so pages must break ties on id
+    rows = [
+        {"user_id": USER.id, "filename": f"{i}.jpg", "created_at": f"2026-01-0{1 + i // 2}T00:00:00+00:00", "acne_count": i}
+        for i in range(7)
+    ]
+    rows.append({"user_id": "someone-else", "filename": "x.jpg", "created_at": "2026-01-02T00:00:00+00:00"})
+    asyncio.run(repository.insert_many(rows))
+    return repository
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(analysis_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: USER
+    return TestClient(app)
+
+def expected_order(repository):
+    rows = asyncio.run(repository.list_for_user(USER.id, limit=100))
+    return [row["id"] for row in rows]
+
+ANALYSIS_ID = "0b5c2a4e-8d1f-4e6a-9c3b-2f7d1e8a6b40"
+
+def test_cursor_round_trip():
+    row = {"created_at": "2026-01-01T00:00:00+00:00", "id": ANALYSIS_ID}
+    assert decode_cursor(encode_cursor(row)) == ("2026-01-01T00:00:00+00:00", ANALYSIS_ID)
+
+@pytest.mark.parametrize("token", [
+    "not base64!",
+    "bm90IGpzb24",
+    encode_cursor({"created_at": 1, "id": ANALYSIS_ID}),
+    # Values that would break out of the PostgREST filter they are placed in
+    encode_cursor({"created_at": '2026-01-01",id.gt.0)', "id": ANALYSIS_ID}),
+    encode_cursor({"created_at": "2026-01-01T00:00:00+00:00", "id": 'x"),or(user_id.neq.0'})
+])
+def test_invalid_cursors_are_rejected(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token)
+
+def test_pages_follow_the_cursor_without_gaps_or_repeats(repository, client):
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        body = client.get("/analyses", params=params).json()
+        seen += [row["id"] for row in body["analyses"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == 3
+    assert seen == expected_order(repository)
+
+def test_rows_inserted_between_pages_do_not_shift_the_next_page(repository, client):
+    first = client.get("/analyses", params={"limit": 3}).json()
+    asyncio.run(repository.insert({"user_id": USER.id, "filename": "new.jpg", "created_at": "2026-02-01T00:00:00+00:00"}))
+    second = client.get("/analyses", params={"limit": 3, "cursor": first["next_cursor"]}).json()
+    assert [row["id"] for row in second["analyses"]] == expected_order(repository)[4:7]
+
+def test_projection_keeps_the_cursor_columns(repository, client):
+    body = client.get("/analyses", params={"limit": 2, "fields": "acne_count"}).json()
+    assert set(body["analyses"][0]) == {"created_at", "id", "acne_count"}
+    assert body["next_cursor"] is not None
+    assert client.get("/analyses", params={"fields": "password"}).status_code == 400
+
+def test_bad_cursor_requests_are_400(repository, client):
+    assert client.get("/analyses", params={"cursor": "not base64!"}).status_code == 400
+    tampered = encode_cursor({"created_at": "2026-01-01T00:00:00+00:00", "id": "x)"})
+    assert client.get("/analyses", params={"cursor": tampered}).status_code == 400
+    cursor = client.get("/analyses", params={"limit": 1}).json()["next_cursor"]
+    assert client.get("/analyses", params={"cursor": cursor, "offset": 2}).status_code == 400
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth import routes
+from app.auth.tokens import (
+    AuthenticatedUser,
+    MemoryRevocationStore,
+    SQLiteRevocationStore,
+    TokenVerifier,
+    VerifiedTokenCache,
+    token_cache
+)
+from app.services import rate_limit
+
+SECRET = os.environ["SUPABASE_JWT_SECRET"]
+
+def make_token(sub="user-1", **claims):
+    now = int(time.time())
+    payload = {"sub": sub, "aud": "authenticated", "iat": now, "exp": now + 3600, **claims}
+    return jwt.encode(payload, SECRET, algorithm="HS256")
+
+class FakeJwks:
+    def __init__(self, jwk):
+        self.jwk = jwk
+
+    def get_signing_key_from_jwt(self, token):
+        return jwt.PyJWK(self.jwk)
+
+def verifier_with_key(public_key, alg):
+    jwk = json.loads(jwt.algorithms.get_default_algorithms()[alg].to_jwk(public_key))
+    jwk["alg"] = alg
+    verifier = TokenVerifier(secret=SECRET)
+    verifier._jwks = FakeJwks(jwk)
+    return verifier
+
+def test_logout_stops_accepting_the_token(monkeypatch):
+    signed_out = []
+    monkeypatch.setattr(routes.supabase.auth.admin, "sign_out", lambda token, scope: signed_out.append((token, scope)))
+    app = FastAPI()
+    app.include_router(routes.router)
+    client = TestClient(app)
+    token = make_token(sub="logout-user")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.post("/auth/logout", headers=headers).status_code == 200
+    assert signed_out == [(token, "local")]
+    assert token_cache.get(token) is None
+    assert token_cache.is_revoked(token)
+    assert client.post("/auth/logout", headers=headers).status_code == 401
+    # Rate limits fall back to the client address instead of the user
+    assert rate_limit.user_id(token) is None
+
+@pytest.fixture(params=["memory", "sqlite"])
+def revocations(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteRevocationStore(str(tmp_path / "revoked.sqlite"))
+    return MemoryRevocationStore()
+
+def test_revocation_expires_with_the_token(revocations):
+    cache = VerifiedTokenCache(revocations=revocations)
+    cache.revoke("expired", time.time() - 1)
+    cache.revoke("live", time.time() + 60)
+    assert not cache.is_revoked("expired")
+    assert cache.is_revoked("live")
+
+def test_sqlite_revocations_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "revoked.sqlite")
+    # Each worker has its own token cache over the same file
+    worker_a = VerifiedTokenCache(revocations=SQLiteRevocationStore(path))
+    worker_b = VerifiedTokenCache(revocations=SQLiteRevocationStore(path))
+    token = make_token(sub="shared-logout")
+
+    worker_b.set(token, AuthenticatedUser.from_claims(jwt.decode(token, options={"verify_signature": False})))
+    worker_a.revoke(token, time.time() + 60)
+    assert worker_b.is_revoked(token)
+    assert asyncio.run(worker_b.is_revoked_async(token))
+
+    # Only a hash of the token is written to disk
+    assert all(token.encode() not in written.read_bytes() for written in tmp_path.iterdir())
+
+def test_revocation_store_errors_fail_open():
+    class BrokenStore:
+        shared = True
+
+        def is_revoked(self, token):
+            raise sqlite3.OperationalError("database is locked")
+
+    assert not VerifiedTokenCache(revocations=BrokenStore()).is_revoked(make_token())
+
+def test_jwks_algorithm_comes_from_the_key():
+    key = ec.generate_private_key(ec.SECP256R1())
+    verifier = verifier_with_key(key.public_key(), "ES256")
+    token = jwt.encode({"sub": "u", "aud": "authenticated", "exp": time.time() + 60}, key, algorithm="ES256")
+    assert verifier.verify(token)["sub"] == "u"
+
+    # A token claiming a different algorithm than the published key is refused
+    other = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    forged = jwt.encode({"sub": "u", "aud": "authenticated", "exp": time.time() + 60}, other, algorithm="RS256")
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(forged)
+
+def test_symmetric_jwks_keys_are_refused():
+    verifier = TokenVerifier(secret=SECRET)
+    secret = "s" * 64
+    verifier._jwks = FakeJwks({"kty": "oct", "k": jwt.utils.base64url_encode(secret.encode()).decode(), "alg": "HS512"})
+    token = jwt.encode({"sub": "u", "aud": "authenticated", "exp": time.time() + 60}, secret, algorithm="HS512")
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(token)
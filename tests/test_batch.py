@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.analysis import routes as analysis_routes
+from app.analysis.repository import InMemoryAnalysisRepository
+from app.auth.dependencies import get_current_user
+from app.auth.tokens import AuthenticatedUser
+
+USER = AuthenticatedUser(id="batch-user", email="batch@example.com")
+
+FEATURES = {
+    "acne_count": 0, "avg_acne_width": 0, "avg_acne_height": 0, "avg_acne_area": 0,
+    "papules_count": 0, "pustules_count": 0, "comedone_count": 0, "nodules_count": 0,
+    "avg_redness": 0, "global_redness": 0.1, "skin_disease_label": None, "skin_disease_confidence": None,
+    "skin_classification_labels": "", "acne_detected": False, "image_hash": None,
+    "degraded": False, "unavailable_models": []
+}
+
+@pytest.fixture
+def repository(monkeypatch):
+    repository = InMemoryAnalysisRepository()
+    monkeypatch.setattr(analysis_routes, "analysis_repository", repository)
+    return repository
+
+@pytest.fixture
+def client(monkeypatch):
+    async def analyze_image(image_bytes, deadline=None, image_hash=None):
+        # Uploads carry their analysis time in seconds, or "fail"
+        if image_bytes == b"fail":
+            raise RuntimeError("decoder crashed")
+        await asyncio.sleep(float(image_bytes))
+        return dict(FEATURES)
+    monkeypatch.setattr(analysis_routes, "analyze_image", analyze_image)
+
+    app = FastAPI()
+    app.include_router(analysis_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: USER
+    return TestClient(app)
+
+def post_batch(client, *uploads):
+    files = [("files", (f"{i}.jpg", data, content_type)) for i, (data, content_type) in enumerate(uploads)]
+    response = client.post("/skinprocessing/batch", files=files)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_results_stream_as_they_finish_then_a_summary(repository, client):
+    lines = post_batch(client, (b"0.2", "image/jpeg"), (b"0", "image/jpeg"), (b"0.1", "image/jpeg"))
+
+    assert [line.get("index") for line in lines] == [1, 2, 0, None]
+    assert all(line["status"] == "ok" for line in lines[:3])
+    assert lines[-1] == {"status": "complete", "saved": 3, "failed": 0}
+
+    saved = asyncio.run(repository.list_for_user(USER.id))
+    assert {row["id"] for row in saved} == {line["result"]["id"] for line in lines[:3]}
+
+def test_failed_images_do_not_stop_the_batch(repository, client):
+    lines = post_batch(client, (b"0", "image/jpeg"), (b"0", "text/plain"), (b"fail", "image/jpeg"))
+    by_index = {line["index"]: line for line in lines[:-1]}
+
+    assert by_index[0]["status"] == "ok"
+    assert by_index[1] == {"index": 1, "filename": "1.jpg", "status": "error", "detail": "File must be an image"}
+    assert by_index[2]["detail"] == "An error occurred during analysis"
+    assert lines[-1] == {"status": "complete", "saved": 1, "failed": 2}
+    assert len(asyncio.run(repository.list_for_user(USER.id))) == 1
+
+def test_nothing_to_save_skips_the_insert(repository, client, monkeypatch):
+    async def insert_many(rows):
+        raise AssertionError("insert_many should not be called")
+    monkeypatch.setattr(repository, "insert_many", insert_many)
+
+    lines = post_batch(client, (b"fail", "image/jpeg"))
+    assert lines[-1] == {"status": "complete", "saved": 0, "failed": 1}
+
+def test_oversized_batches_are_rejected(repository, client, monkeypatch):
+    monkeypatch.setattr(analysis_routes, "BATCH_MAX_FILES", 2)
+    files = [("files", (f"{i}.jpg", b"0", "image/jpeg")) for i in range(3)]
+    response = client.post("/skinprocessing/batch", files=files)
+    assert response.status_code == 400
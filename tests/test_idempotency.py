@@ -0,0 +1,228 @@
+import asyncio
+import io
+import itertools
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.analysis import routes as analysis_routes
+from app.analysis.idempotency import (
+    AnalysisDeduplicator,
+    IdempotencyConflict,
+    MemoryIdempotencyStore,
+    SQLiteIdempotencyStore
+)
+from app.analysis.repository import analysis_repository
+from app.auth.dependencies import get_current_user
+from app.auth.tokens import AuthenticatedUser
+
+class CountingAnalysis:
+    """analyze() callable that counts its calls, returning a new analysis id after an optional delay"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+        self._ids = itertools.count(1)
+
+    async def __call__(self):
+        self.calls += 1
+        analysis_id = f"analysis-{next(self._ids)}"
+        await asyncio.sleep(self.delay)
+        return {"id": analysis_id, "acne_count": 1}
+
+@pytest.fixture(params=["memory", "sqlite"])
+def deduplicator(request, tmp_path):
+    if request.param == "sqlite":
+        store = SQLiteIdempotencyStore(str(tmp_path / "idempotency.db"))
+    else:
+        store = MemoryIdempotencyStore()
+    return AnalysisDeduplicator(store, key_ttl=60, dedup_window=60, enabled=True)
+
+def test_retry_with_the_same_key_is_replayed(deduplicator):
+    analyze = CountingAnalysis()
+
+    async def scenario():
+        first = await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+        retry = await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+        return first, retry
+
+    (first, first_replayed), (retry, retry_replayed) = asyncio.run(scenario())
+    assert analyze.calls == 1
+    assert not first_replayed and retry_replayed
+    assert retry == first
+    assert deduplicator.replayed == 1
+
+def test_same_image_without_key_is_deduplicated_per_user(deduplicator):
+    analyze = CountingAnalysis()
+
+    async def scenario():
+        await deduplicator.run("user-1", "hash-a", None, analyze)
+        _, replayed = await deduplicator.run("user-1", "hash-a", None, analyze)
+        _, other_user_replayed = await deduplicator.run("user-2", "hash-a", None, analyze)
+        return replayed, other_user_replayed
+
+    replayed, other_user_replayed = asyncio.run(scenario())
+    assert replayed and not other_user_replayed
+    assert analyze.calls == 2
+
+def test_key_reused_for_a_different_image_conflicts(deduplicator):
+    analyze = CountingAnalysis()
+
+    async def scenario():
+        await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+        await deduplicator.run("user-1", "hash-b", "key-1", analyze)
+
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(scenario())
+    assert analyze.calls == 1
+
+def test_concurrent_duplicates_share_one_run(deduplicator):
+    analyze = CountingAnalysis(delay=0.05)
+
+    async def scenario():
+        return await asyncio.gather(*[deduplicator.run("user-1", "hash-a", "key-1", analyze) for _ in range(5)])
+
+    results = asyncio.run(scenario())
+    assert analyze.calls == 1
+    assert len({response["id"] for response, _ in results}) == 1
+    assert [replayed for _, replayed in results].count(False) == 1
+    assert deduplicator.coalesced == 4
+    assert deduplicator.stats()["in_flight"] == 0
+
+def test_concurrent_key_conflict_is_refused_while_in_flight(deduplicator):
+    analyze = CountingAnalysis(delay=0.05)
+
+    async def scenario():
+        leader = asyncio.ensure_future(deduplicator.run("user-1", "hash-a", "key-1", analyze))
+        await asyncio.sleep(0)
+        with pytest.raises(IdempotencyConflict):
+            await deduplicator.run("user-1", "hash-b", "key-1", analyze)
+        return await leader
+
+    response, replayed = asyncio.run(scenario())
+    assert response["id"] == "analysis-1" and not replayed
+
+def test_waiter_takes_over_when_the_leader_is_cancelled(deduplicator):
+    analyze = CountingAnalysis(delay=0.05)
+
+    async def scenario():
+        leader = asyncio.ensure_future(deduplicator.run("user-1", "hash-a", "key-1", analyze))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(deduplicator.run("user-1", "hash-a", "key-1", analyze))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter
+
+    response, replayed = asyncio.run(scenario())
+    assert analyze.calls == 2
+    assert response["id"] == "analysis-2" and not replayed
+
+def test_failed_run_is_not_recorded(deduplicator):
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise RuntimeError("model unavailable")
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await deduplicator.run("user-1", "hash-a", "key-1", failing)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+def test_degraded_run_is_not_recorded(deduplicator):
+    calls = []
+
+    async def analyze():
+        calls.append(1)
+        # The classifiers were down for the first attempt only
+        return {"id": f"analysis-{len(calls)}", "degraded": len(calls) == 1}
+
+    async def scenario():
+        first = await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+        retry = await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+        return first, retry
+
+    (first, first_replayed), (retry, retry_replayed) = asyncio.run(scenario())
+    assert first["degraded"] and not first_replayed
+    assert retry == {"id": "analysis-2", "degraded": False} and not retry_replayed
+    assert deduplicator.replayed == 0
+
+def test_deleted_analysis_is_no_longer_replayed(deduplicator):
+    analyze = CountingAnalysis()
+
+    async def scenario():
+        first, _ = await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+        await deduplicator.forget_analysis(first["id"])
+        return await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+
+    response, replayed = asyncio.run(scenario())
+    assert not replayed
+    assert response["id"] == "analysis-2"
+
+def test_disabled_deduplicator_always_analyzes():
+    deduplicator = AnalysisDeduplicator(MemoryIdempotencyStore(), key_ttl=60, dedup_window=60, enabled=False)
+    analyze = CountingAnalysis()
+
+    async def scenario():
+        for _ in range(2):
+            await deduplicator.run("user-1", "hash-a", "key-1", analyze)
+
+    asyncio.run(scenario())
+    assert analyze.calls == 2
+
+def test_memory_store_evicts_oldest_entries():
+    store = MemoryIdempotencyStore(max_entries=2)
+    for i in range(3):
+        store.set(f"key-{i}", {"analysis_id": str(i)}, ttl=60)
+    assert store.get("key-0") is None
+    assert store.get("key-2") == {"analysis_id": "2"}
+
+def test_expired_records_are_not_replayed(tmp_path):
+    for store in (MemoryIdempotencyStore(), SQLiteIdempotencyStore(str(tmp_path / "idempotency.db"))):
+        store.set("key", {"analysis_id": "1"}, ttl=-1)
+        assert store.get("key") is None
+
+def test_endpoint_replays_and_rejects_conflicting_keys(monkeypatch):
+    deduplicator = AnalysisDeduplicator(MemoryIdempotencyStore(), key_ttl=60, dedup_window=0, enabled=True)
+    monkeypatch.setattr(analysis_routes, "analysis_deduplicator", deduplicator)
+    analyzed = []
+
+    async def analyze_image(image_bytes, deadline=None, image_hash=None):
+        analyzed.append(image_hash)
+        return {
+            "acne_count": 0, "avg_acne_width": 0, "avg_acne_height": 0, "avg_acne_area": 0,
+            "papules_count": 0, "pustules_count": 0, "comedone_count": 0, "nodules_count": 0,
+            "avg_redness": 0, "global_redness": 0.1, "skin_disease_label": None, "skin_disease_confidence": None,
+            "skin_classification_labels": "", "acne_detected": False, "image_hash": image_hash,
+            "degraded": False, "unavailable_models": []
+        }
+    monkeypatch.setattr(analysis_routes, "analyze_image", analyze_image)
+
+    def upload(color):
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 32), color).save(buffer, format="JPEG")
+        return {"file": ("face.jpg", buffer.getvalue(), "image/jpeg")}
+
+    app = FastAPI()
+    app.include_router(analysis_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: AuthenticatedUser(id="idem-user", email="idem@example.com")
+    client = TestClient(app)
+    headers = {"Idempotency-Key": "retry-1"}
+
+    first = client.post("/skinprocessing", files=upload((200, 80, 80)), headers=headers)
+    retry = client.post("/skinprocessing", files=upload((200, 80, 80)), headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json()["id"] == first.json()["id"]
+    assert len(analyzed) == 1
+    assert len(asyncio.run(analysis_repository.list_for_user("idem-user"))) == 1
+
+    conflict = client.post("/skinprocessing", files=upload((80, 200, 80)), headers=headers)
+    assert conflict.status_code == 422
+    assert client.post("/skinprocessing", files=upload((0, 0, 0)), headers={"Idempotency-Key": ""}).status_code == 400
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from PIL import Image
+
+from app.services import image_processing
+from app.services.backends import RoboflowBackend
+from app.services.image_processing import EncodedImageSet
+
+def counting_crops(monkeypatch):
+    calls = []
+    crop = image_processing.crop_center_patch
+
+    def counted(image, patch_size):
+        calls.append(patch_size)
+        return crop(image, patch_size)
+    monkeypatch.setattr(image_processing, "crop_center_patch", counted)
+    return calls
+
+def test_prepared_images_are_reused(monkeypatch):
+    crops = counting_crops(monkeypatch)
+    images = EncodedImageSet(Image.new("RGB", (800, 600), (180, 90, 90)))
+
+    patch = images.prepare(300)
+    assert patch.size == (300, 300)
+    assert images.prepare(300) is patch
+    assert images.prepare(300, (224, 224)).size == (224, 224)
+    assert images.prepare(300, [224, 224]) is images.prepare(300, (224, 224))
+    # Same size as the crop: no resize, the crop itself
+    assert images.prepare(300, (300, 300)) is patch
+    assert images.prepare() is images.image
+    assert crops == [300]
+
+def test_hosted_classifier_crops_once(monkeypatch):
+    crops = counting_crops(monkeypatch)
+    posted = []
+    backend = RoboflowBackend(SimpleNamespace(dataset_id="skin", version=1), "classification")
+    monkeypatch.setattr(backend, "_post", lambda payload, params="": posted.append(payload) or {"top": "acne"})
+    images = EncodedImageSet(Image.new("RGB", (800, 600), (180, 90, 90)))
+
+    result = backend.infer(images, patch_size=300, size=(300, 300))
+    assert result["image"] == {"width": "300", "height": "300"}
+    assert posted == [images.get(300, (300, 300))]
+    assert crops == [300]
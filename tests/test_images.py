@@ -0,0 +1,149 @@
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.auth.dependencies import get_current_user
+from app.auth.tokens import AuthenticatedUser
+from app.analysis import routes as analysis_routes
+from app.analysis.repository import analysis_repository
+from app.images import routes as image_routes
+from app.images.store import ImageStore, LocalObjectStore, InMemoryObjectStore
+
+USER = AuthenticatedUser(id="image-user", email="image@example.com")
+
+def jpeg_bytes(size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (180, 90, 90)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def make_client(*routers):
+    app = FastAPI()
+    for router in routers:
+        app.include_router(router)
+    app.dependency_overrides[get_current_user] = lambda: USER
+    return TestClient(app)
+
+@pytest.fixture
+def owned(monkeypatch):
+    async def has_image(user_id, image_hash):
+        return user_id == USER.id
+    monkeypatch.setattr(analysis_repository, "has_image", has_image)
+
+@pytest.fixture(params=["local", "memory"])
+def store(request, tmp_path, monkeypatch):
+    objects = LocalObjectStore(str(tmp_path)) if request.param == "local" else InMemoryObjectStore()
+    store = ImageStore(objects)
+    monkeypatch.setattr(image_routes, "image_store", store)
+    return store
+
+def test_original_full_and_ranges(store, owned):
+    data = jpeg_bytes()
+    image_hash = store.put_original(data)
+    client = make_client(image_routes.router)
+
+    full = client.get(f"/images/{image_hash}")
+    assert full.status_code == 200
+    assert full.content == data
+    assert full.headers["content-type"] == "image/jpeg"
+    assert full.headers["etag"] == f'"{image_hash}"'
+    if isinstance(store.objects, LocalObjectStore):
+        # Streamed from disk by FileResponse
+        assert "last-modified" in full.headers
+
+    partial = client.get(f"/images/{image_hash}", headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.content == data[10:20]
+    assert partial.headers["content-range"] == f"bytes 10-19/{len(data)}"
+
+    suffix = client.get(f"/images/{image_hash}", headers={"Range": "bytes=-5"})
+    assert suffix.status_code == 206
+    assert suffix.content == data[-5:]
+
+    assert client.get(f"/images/{image_hash}", headers={"Range": f"bytes={len(data) + 10}-"}).status_code == 416
+    assert client.get(f"/images/{image_hash}", headers={"If-None-Match": f'"{image_hash}"'}).status_code == 304
+
+def test_unknown_or_unowned_images_are_404(store, monkeypatch):
+    image_hash = store.put_original(jpeg_bytes())
+    client = make_client(image_routes.router)
+
+    async def not_owned(user_id, image_hash):
+        return False
+    monkeypatch.setattr(analysis_repository, "has_image", not_owned)
+    assert client.get(f"/images/{image_hash}").status_code == 404
+    assert client.get("/images/not-a-hash").status_code == 404
+
+def test_thumbnail(store, owned):
+    image_hash = store.put_original(jpeg_bytes((800, 600)))
+    response = make_client(image_routes.router).get(f"/images/{image_hash}/thumbnail")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert max(Image.open(io.BytesIO(response.content)).size) <= store.thumbnail_size
+
+def features_for(image_hash):
+    return {
+        "acne_count": 0, "avg_acne_width": 0, "avg_acne_height": 0, "avg_acne_area": 0,
+        "papules_count": 0, "pustules_count": 0, "comedone_count": 0, "nodules_count": 0,
+        "avg_redness": 0, "global_redness": 0.1, "skin_disease_label": None, "skin_disease_confidence": None,
+        "skin_classification_labels": "", "acne_detected": False, "image_hash": image_hash,
+        "degraded": False, "unavailable_models": []
+    }
+
+@pytest.fixture
+def memory_store(monkeypatch):
+    from app.analysis import pipeline
+    store = ImageStore(InMemoryObjectStore())
+    monkeypatch.setattr(pipeline, "image_store", store)
+    return store
+
+@pytest.fixture
+def fake_analysis(monkeypatch):
+    async def analyze_image(image_bytes, deadline=None, image_hash=None):
+        return features_for(image_hash)
+    monkeypatch.setattr(analysis_routes, "analyze_image", analyze_image)
+    monkeypatch.setattr(analysis_routes.analysis_deduplicator, "enabled", False)
+
+def test_original_is_not_stored_when_insert_fails(memory_store, fake_analysis, monkeypatch):
+    async def failing_insert(row):
+        raise RuntimeError("database down")
+    monkeypatch.setattr(analysis_repository, "insert", failing_insert)
+
+    data = jpeg_bytes()
+    response = make_client(analysis_routes.router).post("/skinprocessing", files={"file": ("a.jpg", data, "image/jpeg")})
+    assert response.status_code == 500
+    assert not memory_store.objects.exists(memory_store.original_key(hashlib.sha256(data).hexdigest()))
+
+def test_original_is_stored_after_insert(memory_store, fake_analysis):
+    data = jpeg_bytes()
+    response = make_client(analysis_routes.router).post("/skinprocessing", files={"file": ("a.jpg", data, "image/jpeg")})
+    assert response.status_code == 200
+    image_hash = response.json()["image_hash"]
+    assert image_hash == hashlib.sha256(data).hexdigest()
+    assert memory_store.objects.exists(memory_store.original_key(image_hash))
+
+@pytest.mark.parametrize("insert_fails", [True, False])
+def test_batch_stores_originals_only_after_bulk_insert(memory_store, monkeypatch, insert_fails):
+    async def analyze_image(image_bytes, deadline=None, image_hash=None):
+        return features_for(hashlib.sha256(image_bytes).hexdigest())
+    monkeypatch.setattr(analysis_routes, "analyze_image", analyze_image)
+
+    async def insert_many(rows):
+        if insert_fails:
+            raise RuntimeError("database down")
+        return rows
+    monkeypatch.setattr(analysis_repository, "insert_many", insert_many)
+
+    images = [jpeg_bytes((32 + i, 32)) for i in range(3)]
+    uploads = [("files", (f"{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+    response = make_client(analysis_routes.router).post("/skinprocessing/batch", files=uploads)
+    assert response.status_code == 200
+    stored = [memory_store.objects.exists(memory_store.original_key(hashlib.sha256(d).hexdigest())) for d in images]
+    if insert_fails:
+        assert '"status":"error"' in response.text.strip().splitlines()[-1]
+        assert not any(stored)
+    else:
+        assert '"saved":3' in response.text
+        assert all(stored)
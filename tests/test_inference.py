@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+import pytest
+from PIL import Image
+
+from app.services import inference
+from app.services.image_processing import EncodedImageSet
+
+class FlakyModel:
+    """Fails its first call, then succeeds"""
+
+    identity = "flaky"
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def infer(self, images, patch_size=None, size=None):
+        with self._lock:
+            self.calls += 1
+            first = self.calls == 1
+        if first:
+            raise RuntimeError("first call fails")
+        return {"predictions": [{"class": "acne", "confidence": 0.9}]}
+
+class FlakyBatchModel(FlakyModel):
+    max_batch_size = None
+
+    def infer_batch(self, images_list, patch_size=None, size=None):
+        return [self.infer(images, patch_size, size) for images in images_list]
+
+def image():
+    return EncodedImageSet(Image.new("RGB", (32, 32), (200, 80, 80)))
+
+@pytest.mark.parametrize("model_class", [FlakyModel, FlakyBatchModel])
+def test_hedge_recovers_from_failed_first_attempt(model_class):
+    model = model_class()
+    assert inference.batch_scheduler.can_batch(model) == (model_class is FlakyBatchModel)
+
+    async def run():
+        return await inference.run_model_async(model, image(), name=f"hedge-{model_class.__name__}", hedge_after=0.5)
+
+    result = asyncio.run(run())
+    assert "error" not in result
+    assert result["predictions"][0]["class"] == "acne"
+    assert model.calls == 2
+
+@pytest.mark.parametrize("model_class", [FlakyModel, FlakyBatchModel])
+def test_failure_without_hedging_is_returned(model_class):
+    model = model_class()
+
+    async def run():
+        return await inference.run_model_async(model, image(), name=f"nohedge-{model_class.__name__}")
+
+    result = asyncio.run(run())
+    assert result["error"] == "first call fails"
+    assert model.calls == 1
+
+def test_slow_attempt_is_hedged():
+    release = threading.Event()
+
+    class SlowFirstModel(FlakyModel):
+        def infer(self, images, patch_size=None, size=None):
+            with self._lock:
+                self.calls += 1
+                first = self.calls == 1
+            if first:
+                release.wait(5)
+            return {"predictions": [], "first": first}
+
+    model = SlowFirstModel()
+
+    async def run():
+        return await inference.run_model_async(model, image(), name="hedge-slow", hedge_after=0.05)
+
+    try:
+        result = asyncio.run(run())
+    finally:
+        release.set()
+    assert result["first"] is False
+    assert model.calls == 2
+
+def test_timeout_returns_unavailable(monkeypatch):
+    release = threading.Event()
+
+    class HangingModel(FlakyModel):
+        def infer(self, images, patch_size=None, size=None):
+            release.wait(5)
+            return {"predictions": []}
+
+    monkeypatch.setattr(inference, "MODEL_TIMEOUT_SECONDS", 0.05)
+
+    async def run():
+        return await inference.run_model_async(HangingModel(), image(), name="timeout")
+
+    try:
+        result = asyncio.run(run())
+    finally:
+        release.set()
+    assert result == {"error": "Model call timed out", "unavailable": True}
+
+def test_missing_model_is_unavailable():
+    named = asyncio.run(inference.run_model_async(None, image(), name="acne_model"))
+    unnamed = asyncio.run(inference.run_model_async(None, image()))
+    assert named == {"error": "acne_model is not loaded", "unavailable": True}
+    assert unnamed == {"error": "Model is not loaded", "unavailable": True}
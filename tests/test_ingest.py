@@ -0,0 +1,88 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.analysis import pipeline
+from app.analysis.ingest import UploadLimitMiddleware, decode_image, read_upload
+
+def jpeg_bytes(size):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (180, 90, 90)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def test_decode_bounds_the_working_image():
+    ingested = decode_image(jpeg_bytes((4096, 3072)), max_side=2048)
+    assert ingested.image.size == (2048, 1536)
+    assert ingested.original_size == (4096, 3072)
+    assert ingested.scale == (2.0, 2.0)
+
+@pytest.mark.parametrize("max_side, expected", [(2048, 150), (1024, 75), (0, 300)])
+def test_working_side_spans_the_same_original_pixels(max_side, expected):
+    ingested = decode_image(jpeg_bytes((4096, 3072)), max_side=max_side)
+    assert ingested.working_side(300) == expected
+
+def test_classifier_patches_cover_the_original_field_of_view(monkeypatch):
+    calls = {}
+
+    async def resolve_models(*names):
+        return [object() for _ in names]
+
+    async def run_model_async(model, images, input_size=None, task_type="detection", patch_size=None, name=None, **kwargs):
+        calls[name] = (patch_size, input_size)
+        if task_type == "detection":
+            return {"predictions": []}
+        return {"predictions": [{"predictions": [{"class": "acne", "confidence": 0.9}]}]}
+
+    monkeypatch.setattr(pipeline, "resolve_models", resolve_models)
+    monkeypatch.setattr(pipeline, "run_model_async", run_model_async)
+    monkeypatch.setattr(pipeline, "decode_image", lambda data: decode_image(data, max_side=2048))
+
+    features = asyncio.run(pipeline.analyze_image(jpeg_bytes((4096, 3072))))
+    assert not features["degraded"]
+    # Half-size working image: patches of half the side, resized up to the model input
+    assert calls["skin_disease_model"] == (150, 300)
+    assert calls["skin_class_model"] == (320, 640)
+    assert calls["acne_model"] == (None, None)
+
+@pytest.fixture
+def upload_client():
+    app = FastAPI()
+    parsed = []
+
+    @app.post("/skinprocessing")
+    async def upload(file: UploadFile = File(...)):
+        parsed.append(len(await read_upload(file)))
+        return {"ok": True}
+
+    app.add_middleware(UploadLimitMiddleware, limits={("POST", "/skinprocessing"): 1024})
+    client = TestClient(app)
+    client.parsed = parsed
+    return client
+
+def test_uploads_within_the_limit_are_parsed(upload_client):
+    response = upload_client.post("/skinprocessing", files={"file": ("a.jpg", b"x" * 100, "image/jpeg")})
+    assert response.status_code == 200
+    assert upload_client.parsed == [100]
+
+def test_declared_oversized_uploads_are_refused_unread(upload_client):
+    response = upload_client.post("/skinprocessing", files={"file": ("a.jpg", b"x" * 4096, "image/jpeg")})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body exceeds 1024 bytes"}
+    assert upload_client.parsed == []
+
+def test_undeclared_oversized_uploads_are_cut_off(upload_client):
+    def chunks():
+        yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n\r\n"
+        for _ in range(8):
+            yield b"x" * 512
+        yield b"\r\n--b--\r\n"
+
+    response = upload_client.post(
+        "/skinprocessing", content=chunks(), headers={"content-type": "multipart/form-data; boundary=b"}
+    )
+    assert response.status_code == 413
+    assert upload_client.parsed == []
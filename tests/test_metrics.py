@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+from app.server import reset_metrics_dir
+
+# Metric storage is chosen at import time, so each scenario runs in its own interpreter
+SCRIPT = textwrap.dedent("""
+    import os
+    from app.services import metrics
+
+    for _ in range(2):
+        pid = os.fork()
+        if pid == 0:
+            metrics.observe_model("acne_model", 0.1, failed=True)
+            metrics.register_stats({"jobs": lambda: {"queued": 7}})
+            os._exit(0)
+        os.waitpid(pid, 0)
+    metrics.register_stats({"jobs": lambda: {"queued": 3}})
+    print(metrics.render_metrics()[0].decode())
+""")
+
+def scrape(tmp_path, workers):
+    env = dict(os.environ, WEB_WORKERS=str(workers), METRICS_ENABLED="true", METRICS_MULTIPROC_DIR=str(tmp_path))
+    result = subprocess.run([sys.executable, "-c", SCRIPT], env=env, capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()
+
+def test_metrics_add_up_across_workers(tmp_path):
+    lines = scrape(tmp_path, workers=2)
+    assert 'skinintel_model_errors_total{model="acne_model"} 2.0' in lines
+    assert 'skinintel_model_duration_seconds_count{model="acne_model"} 2.0' in lines
+    # Stats gauges come from the process serving the scrape
+    assert "skinintel_jobs_queued 3.0" in lines
+    assert any(name.endswith(".db") for name in os.listdir(tmp_path))
+
+def test_single_worker_reports_its_own_metrics(tmp_path):
+    lines = scrape(tmp_path, workers=1)
+    # Children's values stay in their own memory
+    assert not any(line.startswith('skinintel_model_errors_total{') for line in lines)
+    assert "skinintel_jobs_queued 3.0" in lines
+    assert os.listdir(tmp_path) == []
+
+def test_startup_clears_metric_files_from_earlier_runs(tmp_path):
+    (tmp_path / "counter_123.db").write_bytes(b"")
+    (tmp_path / "notes.txt").write_text("kept")
+    reset_metrics_dir(tmp_path)
+    assert os.listdir(tmp_path) == ["notes.txt"]
@@ -0,0 +1,160 @@
+import os
+import time
+
+import jwt
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services import rate_limit
+from app.services.rate_limit import (
+    MemoryRateLimitStore,
+    Rate,
+    RateLimiter,
+    RateLimitMiddleware,
+    SQLiteRateLimitStore,
+    client_ip,
+    rate_limit_key
+)
+
+SECRET = os.environ["SUPABASE_JWT_SECRET"]
+
+def make_token(sub):
+    now = int(time.time())
+    return jwt.encode({"sub": sub, "aud": "authenticated", "iat": now, "exp": now + 3600}, SECRET, algorithm="HS256")
+
+def scope(path="/auth/login", method="POST", client="10.0.0.1", headers=()):
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "client": (client, 1234),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers]
+    }
+
+@pytest.mark.parametrize("value, expected", [
+    ("30/minute", Rate(30, 60)),
+    ("100 per hour", Rate(100, 3600)),
+    (" 5 / seconds ", Rate(5, 1)),
+    ("1/day", Rate(1, 86400))
+])
+def test_rate_parse(value, expected):
+    assert Rate.parse(value) == expected
+
+@pytest.mark.parametrize("value", ["", "ten/minute", "5/fortnight", "5"])
+def test_rate_parse_rejects_invalid_limits(value):
+    with pytest.raises(ValueError):
+        Rate.parse(value)
+
+def test_refill_is_capped_at_capacity():
+    rate = Rate(10, 10)
+    assert rate_limit.refill(0, 100.0, 103.0, rate) == 3
+    assert rate_limit.refill(5, 100.0, 1000.0, rate) == 10
+    # A clock step backwards never removes tokens
+    assert rate_limit.refill(5, 100.0, 90.0, rate) == 5
+    assert rate_limit.retry_after(0.5, rate) == 0.5
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteRateLimitStore(str(tmp_path / "ratelimit.db"))
+    return MemoryRateLimitStore()
+
+def test_bucket_allows_a_burst_then_refuses(store):
+    rate = Rate(3, 60)
+    assert [store.take("login:ip:a", rate)[0] for _ in range(3)] == [True, True, True]
+    allowed, wait = store.take("login:ip:a", rate)
+    assert not allowed
+    assert 0 < wait <= 20
+    # Each key has its own bucket
+    assert store.take("login:ip:b", rate)[0]
+    store.clear()
+    assert store.take("login:ip:a", rate)[0]
+
+def test_bucket_refills_over_time(store):
+    rate = Rate(2, 1)
+    assert store.take("key", rate)[0] and store.take("key", rate)[0]
+    assert not store.take("key", rate)[0]
+    time.sleep(0.6)
+    assert store.take("key", rate)[0]
+
+def test_memory_store_prunes_idle_buckets(monkeypatch):
+    store = MemoryRateLimitStore(max_keys=2)
+    rate = Rate(1, 60)
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: clock[0])
+    store.take("old", rate)
+    clock[0] += 2 * 86400
+    store.take("new-1", rate)
+    store.take("new-2", rate)
+    assert set(store._buckets) == {"new-1", "new-2"}
+
+def test_client_ip_only_trusts_configured_proxies():
+    forwarded = [("X-Forwarded-For", "6.6.6.6, 1.2.3.4"), ("X-Forwarded-For", "192.168.0.2")]
+    assert client_ip(scope(headers=forwarded), trusted_proxies=0) == "10.0.0.1"
+    assert client_ip(scope(headers=forwarded), trusted_proxies=1) == "192.168.0.2"
+    assert client_ip(scope(headers=forwarded), trusted_proxies=2) == "1.2.3.4"
+    # More proxies than entries never reads past the first address
+    assert client_ip(scope(headers=forwarded), trusted_proxies=5) == "6.6.6.6"
+    assert client_ip(scope(), trusted_proxies=1) == "10.0.0.1"
+
+def test_key_is_the_verified_user_or_the_client_address():
+    token = make_token("rate-user")
+    assert rate_limit_key(scope(headers=[("Authorization", f"Bearer {token}")])) == "user:rate-user"
+    assert rate_limit_key(scope(headers=[("Authorization", "Bearer not-a-jwt")])) == "ip:10.0.0.1"
+    forged = jwt.encode({"sub": "someone-else", "aud": "authenticated"}, "wrong-secret-of-at-least-32-bytes!!", algorithm="HS256")
+    assert rate_limit_key(scope(headers=[("Authorization", f"Bearer {forged}")])) == "ip:10.0.0.1"
+    assert rate_limit_key(scope()) == "ip:10.0.0.1"
+
+def make_client(limiter):
+    app = FastAPI()
+
+    @app.post("/auth/login")
+    async def login():
+        return {"ok": True}
+
+    @app.get("/health")
+    async def health():
+        return {"ok": True}
+
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    return TestClient(app)
+
+def test_middleware_returns_429_with_retry_after():
+    limiter = RateLimiter(MemoryRateLimitStore(), limits={("POST", "/auth/login"): ("login", "2/minute")}, enabled=True)
+    client = make_client(limiter)
+
+    assert [client.post("/auth/login").status_code for _ in range(2)] == [200, 200]
+    refused = client.post("/auth/login/")
+    assert refused.status_code == 429
+    assert refused.json() == {"detail": "Rate limit exceeded: 2/minute"}
+    assert 1 <= int(refused.headers["retry-after"]) <= 30
+    assert limiter.stats()["limited"] == 1
+    # Endpoints without a limit are never refused
+    assert all(client.get("/health").status_code == 200 for _ in range(5))
+
+def test_users_get_separate_buckets_behind_one_address():
+    limiter = RateLimiter(MemoryRateLimitStore(), limits={("POST", "/auth/login"): ("login", "1/minute")}, enabled=True)
+    client = make_client(limiter)
+    alice = {"Authorization": f"Bearer {make_token('alice')}"}
+    bob = {"Authorization": f"Bearer {make_token('bob')}"}
+
+    assert client.post("/auth/login", headers=alice).status_code == 200
+    assert client.post("/auth/login", headers=alice).status_code == 429
+    assert client.post("/auth/login", headers=bob).status_code == 200
+    assert client.post("/auth/login").status_code == 200
+    assert client.post("/auth/login").status_code == 429
+
+def test_disabled_limiter_and_store_errors_let_requests_through():
+    class BrokenStore:
+        shared = False
+
+        def take(self, key, rate):
+            raise ConnectionError("store unavailable")
+
+    limits = {("POST", "/auth/login"): ("login", "1/minute")}
+    disabled = RateLimiter(MemoryRateLimitStore(), limits=limits, enabled=False)
+    broken = RateLimiter(BrokenStore(), limits=limits, enabled=True)
+    for limiter in (disabled, broken):
+        client = make_client(limiter)
+        assert [client.post("/auth/login").status_code for _ in range(3)] == [200, 200, 200]
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from app.services import resilience
+from app.services.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Deadline
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+def breaker(**kwargs):
+    return CircuitBreaker("model", **{"failure_rate": 0.6, "min_calls": 4, "window": 30, "reset_timeout": 10, **kwargs})
+
+def test_opens_once_enough_calls_fail(clock):
+    circuit = breaker()
+    for success in (True, False, False):
+        assert circuit.allow()
+        circuit.record(success)
+    # Too few calls to judge yet
+    assert circuit.state == CLOSED
+    circuit.record(True)
+    assert circuit.state == CLOSED
+    circuit.record(False)
+    assert circuit.state == OPEN
+    assert not circuit.allow()
+    assert circuit.stats() == {"state": OPEN, "open": 1, "opened": 1, "rejected": 1}
+
+def test_old_failures_leave_the_window(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record(False)
+    clock[0] += 31
+    circuit.record(True)
+    circuit.record(True)
+    circuit.record(True)
+    circuit.record(False)
+    assert circuit.state == CLOSED
+
+def test_single_trial_call_after_reset_timeout(clock):
+    circuit = breaker()
+    for _ in range(4):
+        circuit.record(False)
+    assert circuit.state == OPEN
+
+    clock[0] += 9
+    assert not circuit.allow()
+    clock[0] += 1
+    assert circuit.allow()
+    assert circuit.state == HALF_OPEN
+    # Only one trial at a time
+    assert not circuit.allow()
+
+    circuit.record(True)
+    assert circuit.state == CLOSED
+    assert circuit.allow()
+
+def test_failed_trial_opens_again(clock):
+    circuit = breaker()
+    for _ in range(4):
+        circuit.record(False)
+    clock[0] += 10
+    assert circuit.allow()
+    circuit.record(False)
+    assert circuit.state == OPEN
+    assert circuit.opened == 2
+    assert not circuit.allow()
+
+def test_breakers_are_created_per_model():
+    breakers = resilience.CircuitBreakers()
+    assert breakers.get("detector") is breakers.get("detector")
+    assert breakers.get("detector") is not breakers.get("classifier")
+    assert set(breakers.stats()) == {"detector", "classifier"}
+
+def test_deadline_runs_out():
+    deadline = Deadline(0.05)
+    assert 0 < deadline.remaining() <= 0.05
+    assert not deadline.expired
+    time.sleep(0.06)
+    assert deadline.remaining() == 0
+    assert deadline.expired
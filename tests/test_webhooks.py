@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.jobs import webhooks, worker
+from app.jobs.webhooks import resolve_webhook, pinned_request, UnsafeWebhookUrl, WebhookHostUnresolved
+
+@pytest.mark.parametrize("url", [
+    "http://localhost:8000/hook",
+    "http://127.0.0.1/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+    "ftp://8.8.8.8/hook",
+    "not a url"
+])
+def test_internal_and_invalid_targets_are_refused(url):
+    with pytest.raises(UnsafeWebhookUrl):
+        asyncio.run(resolve_webhook(url, allowed_hosts=[]))
+
+def test_public_address_is_accepted():
+    assert asyncio.run(resolve_webhook("https://8.8.8.8/hook", allowed_hosts=[])) == "8.8.8.8"
+
+def test_allowlist():
+    allowed = ["hooks.example.com", "*.example.org"]
+    assert webhooks.host_allowed("hooks.example.com", allowed)
+    assert webhooks.host_allowed("a.example.org", allowed)
+    assert not webhooks.host_allowed("example.org", allowed)
+    assert not webhooks.host_allowed("evil.com", allowed)
+    with pytest.raises(UnsafeWebhookUrl):
+        asyncio.run(resolve_webhook("https://8.8.8.8/hook", allowed_hosts=allowed))
+
+def test_pinned_request_keeps_host_for_tls():
+    target, headers, extensions = pinned_request("https://hooks.example.com:8443/a?b=1", "93.184.216.34")
+    assert str(target) == "https://93.184.216.34:8443/a?b=1"
+    assert headers == {"Host": "hooks.example.com:8443"}
+    assert extensions == {"sni_hostname": "hooks.example.com"}
+
+def _pool_with_transport(handler):
+    pool = worker.JobWorkerPool(workers=0)
+    pool._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=False)
+    return pool
+
+def test_delivery_connects_to_resolved_address(monkeypatch):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(204)
+
+    async def resolve(url):
+        return "93.184.216.34"
+
+    monkeypatch.setattr(worker, "resolve_webhook", resolve)
+    pool = _pool_with_transport(handler)
+    asyncio.run(pool._send_webhook("http://hooks.example.com/done", {"job_id": "j1", "status": "succeeded"}))
+
+    assert len(seen) == 1
+    assert seen[0].url.host == "93.184.216.34"
+    assert seen[0].headers["Host"] == "hooks.example.com"
+    assert json.loads(seen[0].content)["job_id"] == "j1"
+
+def test_delivery_refused_when_host_now_resolves_internally(monkeypatch):
+    seen = []
+
+    async def resolve(url):
+        raise UnsafeWebhookUrl("webhook_url must point to a public address")
+
+    monkeypatch.setattr(worker, "resolve_webhook", resolve)
+    pool = _pool_with_transport(lambda request: seen.append(request) or httpx.Response(204))
+    asyncio.run(pool._send_webhook("http://rebound.example.com/", {"job_id": "j2"}))
+    assert seen == []
+
+def test_redirects_are_not_followed(monkeypatch):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(307, headers={"Location": "http://169.254.169.254/"})
+
+    async def resolve(url):
+        return "93.184.216.34"
+
+    monkeypatch.setattr(worker, "resolve_webhook", resolve)
+    pool = _pool_with_transport(handler)
+    asyncio.run(pool._send_webhook("http://hooks.example.com/", {"job_id": "j3"}))
+    assert len(seen) == 1
+
+def test_unresolved_host_is_retried(monkeypatch):
+    calls = []
+
+    async def resolve(url):
+        calls.append(url)
+        raise WebhookHostUnresolved("webhook_url host cannot be resolved")
+
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(worker, "resolve_webhook", resolve)
+    monkeypatch.setattr(worker.asyncio, "sleep", no_sleep)
+    pool = _pool_with_transport(lambda request: httpx.Response(204))
+    asyncio.run(pool._send_webhook("http://gone.example.com/", {"job_id": "j4"}))
+    assert len(calls) == worker.JOB_WEBHOOK_RETRIES + 1